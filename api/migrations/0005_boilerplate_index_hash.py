@@ -0,0 +1,23 @@
+# Generated by Django 4.2.10 on 2026-10-17 05:26
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0004_scrapedpage_duplicate_of'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='scrapedpage',
+            name='index_hash',
+            field=models.CharField(blank=True, max_length=64, null=True),
+        ),
+        migrations.AddField(
+            model_name='website',
+            name='boilerplate',
+            field=models.BinaryField(blank=True, default=b''),
+        ),
+    ]
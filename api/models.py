@@ -16,6 +16,9 @@ class Website(models.Model):
     title = models.CharField(max_length=255, null=True, blank=True)
     total_pages = models.PositiveIntegerField(default=0)
     status = models.CharField(max_length=1, choices=STATUS_CHOICES, default=STATUS_PENDING)
+    # Shingle hashes (packed uint64) of the site's boilerplate, stripped from
+    # the pages before indexing; set by each crawl (scraper.tasks._deduplicate)
+    boilerplate = models.BinaryField(blank=True, default=b'')
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
@@ -29,15 +32,37 @@ class ScrapedPage(models.Model):
     title = models.CharField(max_length=255, null=True, blank=True)
     content = models.TextField()
     vector_id = models.CharField(max_length=255, null=True, blank=True)
+    # Validators for incremental re-crawls
+    etag = models.CharField(max_length=255, null=True, blank=True)
+    last_modified = models.CharField(max_length=64, null=True, blank=True)
+    sitemap_lastmod = models.CharField(max_length=64, null=True, blank=True)
+    content_hash = models.CharField(max_length=64, null=True, blank=True)
+    # Hash of the text that was indexed (content without the boilerplate),
+    # so pages are re-embedded when a new boilerplate set changes it
+    index_hash = models.CharField(max_length=64, null=True, blank=True)
+    # Set for near-duplicates of another page of the site, which aren't embedded
+    duplicate_of = models.ForeignKey(
+        'self', on_delete=models.SET_NULL, null=True, blank=True, related_name='duplicates'
+    )
     created_at = models.DateTimeField(auto_now_add=True)
     
     def __str__(self):
         return self.title if self.title else self.url
+    
+    class Meta:
+        indexes = [
+            models.Index(fields=['website', 'url']),
+        ]
 
 
 class ChatSession(models.Model):
     website = models.ForeignKey(Website, on_delete=models.CASCADE, related_name='chat_sessions')
     session_id = models.UUIDField(unique=True, default=uuid4, editable=False)
+    # Rolling summary of the turns older than the verbatim window,
+    # maintained in the background by rag.tasks.summarize_session_task
+    summary = models.TextField(blank=True, default='')
+    summary_last_message_id = models.PositiveBigIntegerField(default=0)  # newest message folded in
+    summary_updated_at = models.DateTimeField(null=True, blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
     
     def __str__(self):
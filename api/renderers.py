@@ -0,0 +1,25 @@
+from rest_framework.renderers import BaseRenderer
+import json
+
+
+def format_sse(event: str, data, retry: int = None) -> str:
+    """
+    Serialize one server-sent event
+    `retry` (milliseconds) sets how long EventSource waits before reconnecting.
+    """
+    prefix = f"retry: {retry}\n" if retry is not None else ''
+    return f"{prefix}event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+class EventStreamRenderer(BaseRenderer):
+    """
+    Lets clients send `Accept: text/event-stream` to streaming actions.
+    Successful streams bypass the renderer (StreamingHttpResponse); it only
+    renders error responses, as a single `error` event.
+    """
+    media_type = 'text/event-stream'
+    format = 'sse'
+    charset = 'utf-8'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        return format_sse('error', data).encode(self.charset)
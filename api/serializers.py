@@ -10,7 +10,7 @@ class WebsiteSerializer(serializers.ModelSerializer):
 class ScrapedPageSerializer(serializers.ModelSerializer):
     class Meta:
         model=ScrapedPage
-        fields=['website','url','title','content','vector_id','created_at']
+        fields=['website','url','title','content','vector_id','duplicate_of','created_at']
 
 class MessageSerializer (serializers.ModelSerializer):
     class Meta:
@@ -1,3 +1,39 @@
-from django.test import TestCase
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+from .models import Website
 
-# Create your tests here.
+
+@override_settings(SCRAPER_PROGRESS_POLL_INTERVAL=2.0, SCRAPER_PROGRESS_STREAM_TIMEOUT=0)
+class ProgressStreamTests(TestCase):
+    """The progress stream only stays open under ASGI"""
+
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        self.addCleanup(cache.clear)
+        self.website = Website.objects.create(url='https://example.com/', status=Website.STATUS_SCRAPING)
+        self.url = f'/api/websites/{self.website.id}/progress-stream/'
+
+    def test_wsgi_sends_the_current_event_and_asks_to_reconnect(self):
+        response = self.client.get(self.url)
+
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        self.assertFalse(response.is_async)
+        body = b''.join(response.streaming_content).decode()
+        self.assertTrue(body.startswith('retry: 2000\nevent: progress\n'))
+        self.assertEqual(body.count('event: '), 1)
+
+    def test_wsgi_sends_done_for_a_finished_crawl(self):
+        Website.objects.filter(id=self.website.id).update(status=Website.STATUS_COMPLETE)
+
+        body = b''.join(self.client.get(self.url).streaming_content).decode()
+
+        self.assertIn('event: done\n', body)
+        self.assertNotIn('event: progress', body)
+
+    async def test_asgi_streams(self):
+        response = await self.async_client.get(self.url)
+
+        self.assertTrue(response.is_async)
+        body = b''.join([chunk async for chunk in response.streaming_content]).decode()
+        self.assertTrue(body.startswith('event: progress\n'))
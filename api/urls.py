@@ -1,6 +1,6 @@
 from django.urls import path
 from rest_framework.routers import DefaultRouter
-from .views import WebsiteViewSet, ScrapedPageViewSet, ChatSessionViewSet, MessageViewSet
+from .views import WebsiteViewSet, ScrapedPageViewSet, ChatSessionViewSet, MessageViewSet, chat_async, prometheus_metrics
 
 router = DefaultRouter()
 router.register('websites', WebsiteViewSet, basename='websites')
@@ -8,4 +8,7 @@ router.register('scraped-pages', ScrapedPageViewSet, basename='scraped-pages')
 router.register('chat-sessions', ChatSessionViewSet, basename='chat-sessions')
 router.register('messages', MessageViewSet, basename='messages')
 
-urlpatterns = router.urls
\ No newline at end of file
+urlpatterns = [
+    path('chat-sessions/<int:pk>/chat-async/', chat_async, name='chat-sessions-chat-async'),
+    path('metrics/', prometheus_metrics, name='metrics'),
+] + router.urls
\ No newline at end of file
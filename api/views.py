@@ -1,5 +1,11 @@
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.handlers.asgi import ASGIRequest
+from django.http import Http404, HttpResponse, HttpResponseNotAllowed, JsonResponse, StreamingHttpResponse
+from django.views.decorators.http import require_GET
 from rest_framework import viewsets
 from rest_framework.decorators import action
+from rest_framework.renderers import JSONRenderer
 from rest_framework.response import Response
 from rest_framework import status
 from .models import Website, ScrapedPage, ChatSession, Message
@@ -9,9 +15,19 @@ from .serializers import (
     ChatSessionSerializer, 
     MessageSerializer
 )
+from .renderers import EventStreamRenderer, format_sse
 from scraper.tasks import scrape_website_task
-from rag.qdrant_service import QdrantService
-from rag.gemini_service import GeminiService
+from scraper.progress import IngestProgress, STAGE_QUEUED, website_snapshot
+from rag.chat_service import ChatService
+from rag import metrics, tracing
+import asyncio
+import json
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+PROMETHEUS_CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
 
 
 class WebsiteViewSet(viewsets.ModelViewSet):
@@ -34,6 +50,7 @@ class WebsiteViewSet(viewsets.ModelViewSet):
             )
         
         # Trigger Celery task
+        IngestProgress(website.id).start(STAGE_QUEUED)
         task = scrape_website_task.delay(website.id)
         
         return Response({
@@ -41,6 +58,97 @@ class WebsiteViewSet(viewsets.ModelViewSet):
             'task_id': task.id,
             'website_id': website.id
         }, status=status.HTTP_202_ACCEPTED)
+    
+    def _progress_snapshot(self, pk):
+        snapshot = IngestProgress(int(pk)).snapshot() if str(pk).isdigit() else None
+        if snapshot is None:
+            snapshot = website_snapshot(self.get_object())
+        return snapshot
+    
+    @action(detail=True, methods=['get'])
+    def progress(self, request, pk=None):
+        """
+        Progress of the website's current or last crawl
+        GET /api/websites/{id}/progress/
+        
+        Pages discovered/fetched/unchanged/failed/to_embed/embedded, the
+        throughput of each stage and the ETA of the current one. Served
+        from the cache; the database is only read for websites without
+        recorded progress.
+        """
+        return Response(self._progress_snapshot(pk))
+    
+    @action(
+        detail=True,
+        methods=['get'],
+        url_path='progress-stream',
+        renderer_classes=[JSONRenderer, EventStreamRenderer]
+    )
+    def progress_stream(self, request, pk=None):
+        """
+        Progress of the website's crawl, streamed as server-sent events
+        GET /api/websites/{id}/progress-stream/
+        
+        Events: `progress` whenever the progress changes (polled from the
+        cache every SCRAPER_PROGRESS_POLL_INTERVAL seconds), then `done`
+        once the crawl is complete or failed
+        
+        Under WSGI a stream would hold a worker thread for up to
+        SCRAPER_PROGRESS_STREAM_TIMEOUT, so only the current event is sent
+        and EventSource reconnects after the poll interval (the same
+        polling as the progress endpoint).
+        """
+        snapshot = self._progress_snapshot(pk)
+        
+        if isinstance(request._request, ASGIRequest):
+            events = _progress_event_stream(snapshot['website_id'], snapshot)
+        else:
+            events = _progress_event_once(snapshot)
+        response = StreamingHttpResponse(events, content_type='text/event-stream')
+        response['Cache-Control'] = 'no-cache'
+        response['X-Accel-Buffering'] = 'no'  # Disable proxy buffering (nginx)
+        return response
+
+
+async def _progress_event_stream(website_id, snapshot):
+    """
+    Async iterator for the progress SSE response; waiting between polls
+    doesn't hold a worker thread under ASGI. The stream ends after
+    SCRAPER_PROGRESS_STREAM_TIMEOUT seconds (EventSource clients reconnect).
+    """
+    progress = IngestProgress(website_id)
+    get_snapshot = sync_to_async(progress.snapshot, thread_sensitive=False)
+    deadline = time.monotonic() + settings.SCRAPER_PROGRESS_STREAM_TIMEOUT
+    last = None
+    try:
+        while True:
+            if snapshot['finished']:
+                yield format_sse('done', snapshot)
+                return
+            if snapshot != last:
+                yield format_sse('progress', snapshot)
+                last = snapshot
+            if time.monotonic() >= deadline:
+                return
+            await asyncio.sleep(settings.SCRAPER_PROGRESS_POLL_INTERVAL)
+            snapshot = await get_snapshot() or last
+        
+    except Exception as e:
+        logger.error(f"Error streaming scrape progress: {str(e)}", exc_info=True)
+        yield format_sse('error', {'error': str(e)})
+
+
+def _progress_event_once(snapshot):
+    """
+    Sync iterator for the progress SSE response under WSGI: the current
+    event, with a `retry` of SCRAPER_PROGRESS_POLL_INTERVAL so the client
+    polls by reconnecting
+    """
+    yield format_sse(
+        'done' if snapshot['finished'] else 'progress',
+        snapshot,
+        retry=int(settings.SCRAPER_PROGRESS_POLL_INTERVAL * 1000),
+    )
 
 
 class ScrapedPageViewSet(viewsets.ModelViewSet):
@@ -80,43 +188,224 @@ class ChatSessionViewSet(viewsets.ModelViewSet):
             )
         
         try:
-            # Initialize services
-            qdrant = QdrantService()
-            gemini = GeminiService()
-            
-            # Search for relevant context in Qdrant
-            search_results = qdrant.search(user_message, limit=3)
-            
-            # Build context from search results
-            context = "\n\n".join([
-                f"Source: {result['title']}\nURL: {result['url']}\nContent: {result['content']}"
-                for result in search_results
-            ])
+            with tracing.trace('chat') as trace:
+                with trace.span('service_init'):
+                    chat = ChatService(chat_session.website_id, session=chat_session)
+                retrieval = chat.retrieve(user_message)
+                bot_response = chat.answer(user_message, retrieval)
+                search_results = retrieval['search_results']
+                
+                # Save message to database
+                with trace.span('db_write'):
+                    message = Message.objects.create(
+                        session=chat_session,
+                        user_message=user_message,
+                        bot_response=bot_response
+                    )
+                    chat.schedule_summary()
+                
+                response = Response({
+                    'user_message': user_message,
+                    'bot_response': bot_response,
+                    'sources': search_results,
+                    'prompt_tokens': retrieval['prompt_tokens']
+                }, status=status.HTTP_200_OK)
+                _add_server_timing(response, trace)
+                return response
             
-            # Generate response using Gemini
-            if context:
-                bot_response = gemini.generate_response(user_message, context)
-            else:
-                bot_response = "I couldn't find relevant information in the scraped content. Please make sure the website has been scraped."
-            
-            # Save message to database
-            message = Message.objects.create(
+        except Exception as e:
+            return Response(
+                {'error': str(e)},
+                status=status.HTTP_500_INTERNAL_SERVER_ERROR
+            )
+    
+    @action(
+        detail=True,
+        methods=['post'],
+        url_path='chat-stream',
+        renderer_classes=[JSONRenderer, EventStreamRenderer]
+    )
+    def chat_stream(self, request, pk=None):
+        """
+        Chat with AI about a website, streamed as server-sent events
+        POST /api/chat-sessions/{id}/chat-stream/
+        Body: {"message": "your question"}
+        
+        Events: `sources` (retrieved context), then `token` pieces of the
+        answer, then `done` once the message is saved (or `error`)
+        """
+        chat_session = self.get_object()
+        user_message = request.data.get('message', '')
+        
+        if not user_message:
+            return Response(
+                {'error': 'Message is required'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        # Observed in rag_request_seconds once the stream ends
+        trace = None
+        try:
+            with tracing.trace('chat_stream', finish=False) as trace:
+                with trace.span('service_init'):
+                    chat = ChatService(chat_session.website_id, session=chat_session)
+                retrieval = chat.retrieve(user_message)
+        except Exception as e:
+            if trace is not None:
+                trace.finish()
+            return Response(
+                {'error': str(e)},
+                status=status.HTTP_500_INTERNAL_SERVER_ERROR
+            )
+        
+        response = StreamingHttpResponse(
+            _chat_event_stream(chat_session, user_message, chat, retrieval, trace),
+            content_type='text/event-stream'
+        )
+        response['Cache-Control'] = 'no-cache'
+        response['X-Accel-Buffering'] = 'no'  # Disable proxy buffering (nginx)
+        _add_server_timing(response, trace)
+        return response
+
+
+def _add_server_timing(response, trace):
+    """Per-stage timings of the request in a Server-Timing header (RAG_DEBUG_TIMING)"""
+    if settings.RAG_DEBUG_TIMING:
+        response['Server-Timing'] = trace.server_timing()
+
+
+async def _chat_event_stream(chat_session, user_message, chat, retrieval, trace):
+    """
+    Async iterator for the SSE response, so the ASGI handler
+    (config/asgi.py) sends every event as soon as it is produced.
+    
+    The headers only time the retrieval; with RAG_DEBUG_TIMING the `done`
+    event carries the timings of every stage, answer included. The request
+    is observed in rag_request_seconds when the stream ends (or the client
+    disconnects).
+    """
+    yield format_sse('sources', retrieval['search_results'])
+    
+    pieces = []
+    stream = chat.stream_answer(user_message, retrieval)
+    next_piece = sync_to_async(trace.bind(next), thread_sensitive=False)
+    try:
+        while True:
+            piece = await next_piece(stream, None)
+            if piece is None:
+                break
+            pieces.append(piece)
+            yield format_sse('token', {'text': piece})
+        
+        # Save message to database once the answer is complete
+        bot_response = ''.join(pieces)
+        with trace.span('db_write'):
+            message = await sync_to_async(Message.objects.create)(
                 session=chat_session,
                 user_message=user_message,
                 bot_response=bot_response
             )
+            await sync_to_async(chat.schedule_summary)()
+        done = {
+            'message_id': message.id,
+            'bot_response': bot_response,
+            'prompt_tokens': retrieval['prompt_tokens'],
+        }
+        if settings.RAG_DEBUG_TIMING:
+            done['timings'] = trace.timings()
+        yield format_sse('done', done)
+        
+    except Exception as e:
+        logger.error(f"Error streaming chat response: {str(e)}", exc_info=True)
+        yield format_sse('error', {'error': str(e)})
+    finally:
+        trace.finish()
+
+
+async def chat_async(request, pk):
+    """
+    Chat with AI about a website, fully async (serve with an ASGI server
+    through config/asgi.py)
+    POST /api/chat-sessions/{id}/chat-async/
+    Body: {"message": "your question"}
+    
+    Embedding runs in a bounded executor while Qdrant, Gemini and the ORM
+    are awaited, so a waiting chat doesn't pin a worker thread.
+    """
+    if request.method != 'POST':
+        return HttpResponseNotAllowed(['POST'])
+    
+    try:
+        chat_session = await ChatSession.objects.aget(pk=pk)
+    except ChatSession.DoesNotExist:
+        return JsonResponse({'detail': 'Not found.'}, status=status.HTTP_404_NOT_FOUND)
+    
+    try:
+        user_message = json.loads(request.body or b'{}').get('message', '')
+    except (ValueError, AttributeError):
+        user_message = ''
+    
+    if not user_message:
+        return JsonResponse(
+            {'error': 'Message is required'},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    
+    try:
+        with tracing.trace('chat_async') as trace:
+            # First construction in a process may check the collection (blocking)
+            with trace.span('service_init'):
+                chat = await sync_to_async(ChatService, thread_sensitive=False)(
+                    chat_session.website_id, session=chat_session
+                )
+            retrieval = await chat.aretrieve(user_message)
+            bot_response = await chat.aanswer(user_message, retrieval)
             
-            return Response({
+            # Save message to database
+            with trace.span('db_write'):
+                await Message.objects.acreate(
+                    session=chat_session,
+                    user_message=user_message,
+                    bot_response=bot_response
+                )
+                await sync_to_async(chat.schedule_summary)()
+            
+            response = JsonResponse({
                 'user_message': user_message,
                 'bot_response': bot_response,
-                'sources': search_results
+                'sources': retrieval['search_results'],
+                'prompt_tokens': retrieval['prompt_tokens']
             }, status=status.HTTP_200_OK)
-            
-        except Exception as e:
-            return Response(
-                {'error': str(e)},
-                status=status.HTTP_500_INTERNAL_SERVER_ERROR
-            )
+            _add_server_timing(response, trace)
+            return response
+        
+    except Exception as e:
+        return JsonResponse(
+            {'error': str(e)},
+            status=status.HTTP_500_INTERNAL_SERVER_ERROR
+        )
+
+
+# JSON API without session auth, like the DRF views (csrf_exempt() can't
+# wrap coroutine functions on Django 4.2)
+chat_async.csrf_exempt = True
+
+
+@require_GET
+def prometheus_metrics(request):
+    """
+    Counters and histograms of this process in the Prometheus text format
+    GET /api/metrics/
+    
+    Stage latencies are in rag_stage_seconds{stage} (service_init, memory,
+    embed, vector_search, lexical_search, rerank, prompt_build,
+    answer_cache, extractive, llm, db_write) and whole requests in
+    rag_request_seconds{endpoint}. Metrics are kept per process: with
+    several workers, scrape each of them.
+    """
+    if not settings.RAG_METRICS_ENABLED:
+        raise Http404
+    return HttpResponse(metrics.render_prometheus(), content_type=PROMETHEUS_CONTENT_TYPE)
 
 
 class MessageViewSet(viewsets.ModelViewSet):
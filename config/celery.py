@@ -1,5 +1,6 @@
 import os
 from celery import Celery
+from celery.signals import celeryd_init, worker_process_init
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'config.settings')
 
@@ -7,6 +8,34 @@ app = Celery('config')
 app.config_from_object('django.conf:settings', namespace='CELERY')
 app.autodiscover_tasks()
 
+
+@celeryd_init.connect
+def configure_stage_concurrency(conf=None, options=None, **kwargs):
+    # With INGEST_STAGE_QUEUES on, a worker dedicated to one ingest stage
+    # queue gets that stage's pool size (INGEST_STAGE_CONCURRENCY) unless
+    # -c/--concurrency is given:
+    #   celery -A config worker -Q ingest.fetch -n fetch@%h
+    from django.conf import settings
+
+    options = options or {}
+    queues = options.get('queues') or []
+    if isinstance(queues, str):
+        queues = queues.split(',')
+    if options.get('concurrency') or len(queues) != 1:
+        return
+    concurrency = settings.INGEST_STAGE_CONCURRENCY.get(queues[0].strip())
+    if concurrency:
+        conf.worker_concurrency = concurrency
+
+
+@worker_process_init.connect
+def reset_rag_connections(**kwargs):
+    # Forked pool processes keep the parent's warmed-up embedding model
+    # but must open their own Qdrant/Gemini connections.
+    from rag.registry import registry
+    registry.reset_connections()
+
+
 @app.task(bind=True)
 def debug_task(self):
-    print(f'Request: {self.request!r}')
\ No newline at end of file
+    print(f'Request: {self.request!r}')
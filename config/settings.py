@@ -1,4 +1,5 @@
 import os
+import sys
 from pathlib import Path
 from decouple import config
 
@@ -125,15 +126,226 @@ CELERY_TIMEZONE = 'UTC'
 CELERY_RESULT_BACKEND = 'django-db'
 CELERY_CACHE_BACKEND = 'django-cache'
 
+# Ingest pipeline (scraper/tasks.py). By default every stage goes to the
+# default 'celery' queue, consumed by a plain worker:
+#   celery -A config worker
+# With INGEST_STAGE_QUEUES on, each stage has its own queue so it can run on
+# its own workers/nodes; every queue then needs a worker, e.g.
+#   celery -A config worker -Q ingest.discover -n discover@%h
+#   celery -A config worker -Q ingest.fetch -n fetch@%h
+#   celery -A config worker -Q ingest.parse -n parse@%h
+#   celery -A config worker -Q ingest.embed -n embed@%h
+#   celery -A config worker -Q ingest.index -n index@%h
+# (or one worker for all of them: -Q celery,ingest.discover,ingest.fetch,...)
+CELERY_TASK_DEFAULT_QUEUE = 'celery'
+INGEST_STAGE_QUEUES = config('INGEST_STAGE_QUEUES', default=False, cast=bool)
+CELERY_TASK_ROUTES = {
+    'scraper.tasks.scrape_website_task': {'queue': 'ingest.discover'},
+    'scraper.tasks.plan_embedding_task': {'queue': 'ingest.discover'},
+    'scraper.tasks.finalize_ingest_task': {'queue': 'ingest.discover'},
+    'scraper.tasks.fetch_pages_task': {'queue': 'ingest.fetch'},
+    'scraper.tasks.parse_pages_task': {'queue': 'ingest.parse'},
+    'scraper.tasks.embed_pages_task': {'queue': 'ingest.embed'},
+    'scraper.tasks.index_pages_task': {'queue': 'ingest.index'},
+} if INGEST_STAGE_QUEUES else {}
+# Pool size of a worker consuming a single stage queue (unless -c is given),
+# see config/celery.py
+INGEST_STAGE_CONCURRENCY = {
+    'ingest.discover': config('INGEST_DISCOVER_CONCURRENCY', default=2, cast=int),
+    'ingest.fetch': config('INGEST_FETCH_CONCURRENCY', default=8, cast=int),  # I/O bound
+    'ingest.parse': config('INGEST_PARSE_CONCURRENCY', default=os.cpu_count() or 2, cast=int),
+    'ingest.embed': config('INGEST_EMBED_CONCURRENCY', default=1, cast=int),  # model uses all cores
+    'ingest.index': config('INGEST_INDEX_CONCURRENCY', default=4, cast=int),
+}
+
+# Redis URL
+REDIS_URL = config('REDIS_URL', default='redis://localhost:6379/0')
+REDIS_SOCKET_TIMEOUT = config('REDIS_SOCKET_TIMEOUT', default=0.1, cast=float)  # seconds, cache lookups
+
+# Cache, shared by the web processes and the Celery workers: answer cache
+# invalidation, ingest progress and the memory summary lock are written by
+# one and read by the other. Test runs use local memory.
+CACHES = {
+    'default': {
+        'BACKEND': config('CACHE_BACKEND', default='django.core.cache.backends.redis.RedisCache'),
+        'LOCATION': config('CACHE_LOCATION', default=REDIS_URL),
+    }
+}
+if sys.argv[1:2] == ['test']:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'LOCATION': 'ai-chatbot-tests',
+        }
+    }
+
 # Qdrant Configuration (Cloud)
 QDRANT_URL = config('QDRANT_URL', default=None)  # For cloud: https://xxx.qdrant.io
 QDRANT_API_KEY = config('QDRANT_API_KEY', default=None)
 QDRANT_HOST = config('QDRANT_HOST', default='localhost')
 QDRANT_PORT = config('QDRANT_PORT', default=6333, cast=int)
 QDRANT_COLLECTION_NAME = 'website_embeddings'
+QDRANT_TIMEOUT = config('QDRANT_TIMEOUT', default=10, cast=int)
+QDRANT_UPSERT_BATCH_SIZE = config('QDRANT_UPSERT_BATCH_SIZE', default=256, cast=int)
+# Vector compression: 'none', 'scalar' (int8) or 'binary'; quantized vectors
+# stay in RAM, originals go to disk and are used to rescore the candidates
+QDRANT_QUANTIZATION = config('QDRANT_QUANTIZATION', default='none')
+QDRANT_ORIGINALS_ON_DISK = config('QDRANT_ORIGINALS_ON_DISK', default=True, cast=bool)
+QDRANT_RESCORE = config('QDRANT_RESCORE', default=True, cast=bool)
+QDRANT_OVERSAMPLING = config('QDRANT_OVERSAMPLING', default=2.0, cast=float)
+# Website IDs (comma separated) whose vectors live in a dedicated collection
+QDRANT_DEDICATED_COLLECTION_WEBSITES = config(
+    'QDRANT_DEDICATED_COLLECTION_WEBSITES',
+    default='',
+    cast=lambda value: {int(item) for item in value.split(',') if item.strip()}
+)
+
+# Scraper
+SCRAPER_DB_BATCH_SIZE = config('SCRAPER_DB_BATCH_SIZE', default=500, cast=int)
+SCRAPER_CONCURRENCY = config('SCRAPER_CONCURRENCY', default=16, cast=int)  # in-flight requests per crawl
+SCRAPER_PER_HOST_RATE = config('SCRAPER_PER_HOST_RATE', default=4.0, cast=float)  # requests/second per host
+SCRAPER_PER_HOST_BURST = config('SCRAPER_PER_HOST_BURST', default=4, cast=int)
+# Share the per-host limit of parallel fetch batches in Redis (REDIS_URL)
+SCRAPER_HOST_LIMIT_REDIS_ENABLED = config('SCRAPER_HOST_LIMIT_REDIS_ENABLED', default=True, cast=bool)
+SCRAPER_REQUEST_TIMEOUT = config('SCRAPER_REQUEST_TIMEOUT', default=10, cast=int)
+SCRAPER_PARSE_EXECUTOR = config('SCRAPER_PARSE_EXECUTOR', default='process')  # 'process' or 'thread'
+SCRAPER_PARSE_WORKERS = config('SCRAPER_PARSE_WORKERS', default=2, cast=int)
+SCRAPER_EXTRACTOR = config('SCRAPER_EXTRACTOR', default='lxml')  # 'lxml' or 'soup' (BeautifulSoup reference)
+# Boilerplate and near-duplicate detection across a site's pages (scraper/dedup.py)
+SCRAPER_DEDUP_ENABLED = config('SCRAPER_DEDUP_ENABLED', default=True, cast=bool)
+SCRAPER_SHINGLE_WORDS = config('SCRAPER_SHINGLE_WORDS', default=6, cast=int)  # words per shingle (max 64)
+SCRAPER_BOILERPLATE_MIN_PAGES = config('SCRAPER_BOILERPLATE_MIN_PAGES', default=3, cast=int)
+SCRAPER_BOILERPLATE_MIN_RATIO = config('SCRAPER_BOILERPLATE_MIN_RATIO', default=0.3, cast=float)  # of the site's pages
+SCRAPER_NEAR_DUPLICATE_SIMILARITY = config('SCRAPER_NEAR_DUPLICATE_SIMILARITY', default=0.8, cast=float)  # Jaccard
+SCRAPER_MAX_PAGES = config('SCRAPER_MAX_PAGES', default=10, cast=int)  # per crawl (free tier)
+SCRAPER_FETCH_BATCH_SIZE = config('SCRAPER_FETCH_BATCH_SIZE', default=20, cast=int)  # pages per fetch/parse task
+SCRAPER_EMBED_BATCH_SIZE = config('SCRAPER_EMBED_BATCH_SIZE', default=50, cast=int)  # pages per embed/index task
+SCRAPER_PAYLOAD_TTL = config('SCRAPER_PAYLOAD_TTL', default=86400, cast=int)  # seconds a stage's output waits in the cache
+SCRAPER_PROGRESS_TTL = config('SCRAPER_PROGRESS_TTL', default=86400, cast=int)  # seconds progress is kept
+SCRAPER_PROGRESS_POLL_INTERVAL = config('SCRAPER_PROGRESS_POLL_INTERVAL', default=1.0, cast=float)  # SSE, seconds
+SCRAPER_PROGRESS_STREAM_TIMEOUT = config('SCRAPER_PROGRESS_STREAM_TIMEOUT', default=3600, cast=int)  # SSE, seconds
 
 # Gemini API
 GEMINI_API_KEY = config('GEMINI_API_KEY', default='')
+GEMINI_MODEL_NAME = config('GEMINI_MODEL_NAME', default='gemini-2.5-flash')
+GEMINI_BACKEND = config('GEMINI_BACKEND', default='gemini')  # 'gemini' or 'fake' (offline)
+# Resilience layer (rag/llm_client.py): concurrency caps per process and across
+# the cluster (Redis semaphore, 0 disables), a request rate bucket matched to
+# the API quota (0 disables), retries with jittered backoff, optional hedging
+# after the p95 latency and a circuit breaker
+GEMINI_TIMEOUT = config('GEMINI_TIMEOUT', default=30, cast=float)  # seconds per attempt
+GEMINI_MAX_CONCURRENCY = config('GEMINI_MAX_CONCURRENCY', default=8, cast=int)
+GEMINI_CLUSTER_MAX_CONCURRENCY = config('GEMINI_CLUSTER_MAX_CONCURRENCY', default=32, cast=int)
+GEMINI_RATE_LIMIT_RPM = config('GEMINI_RATE_LIMIT_RPM', default=1000, cast=float)
+GEMINI_RATE_LIMIT_BURST = config('GEMINI_RATE_LIMIT_BURST', default=20, cast=int)
+GEMINI_LIMITER_REDIS_ENABLED = config('GEMINI_LIMITER_REDIS_ENABLED', default=True, cast=bool)
+GEMINI_QUEUE_TIMEOUT = config('GEMINI_QUEUE_TIMEOUT', default=10, cast=float)  # max wait for a slot/token
+GEMINI_MAX_RETRIES = config('GEMINI_MAX_RETRIES', default=2, cast=int)
+GEMINI_RETRY_BASE_DELAY = config('GEMINI_RETRY_BASE_DELAY', default=0.5, cast=float)
+GEMINI_RETRY_MAX_DELAY = config('GEMINI_RETRY_MAX_DELAY', default=8, cast=float)
+GEMINI_HEDGE_ENABLED = config('GEMINI_HEDGE_ENABLED', default=False, cast=bool)
+GEMINI_HEDGE_MIN_DELAY = config('GEMINI_HEDGE_MIN_DELAY', default=2, cast=float)  # until p95 is known
+GEMINI_BREAKER_FAILURES = config('GEMINI_BREAKER_FAILURES', default=5, cast=int)
+GEMINI_BREAKER_RESET_SECONDS = config('GEMINI_BREAKER_RESET_SECONDS', default=30, cast=float)
+# Fault injection for the fake model
+GEMINI_FAKE_DELAY = config('GEMINI_FAKE_DELAY', default=0.0, cast=float)
+GEMINI_FAKE_JITTER = config('GEMINI_FAKE_JITTER', default=0.0, cast=float)
+GEMINI_FAKE_FAILURE_RATE = config('GEMINI_FAKE_FAILURE_RATE', default=0.0, cast=float)
 
-# Redis URL
-REDIS_URL = config('REDIS_URL', default='redis://localhost:6379/0')
\ No newline at end of file
+# RAG services (shared once per worker process, see rag/registry.py)
+RAG_EMBEDDING_MODEL = config('RAG_EMBEDDING_MODEL', default='all-MiniLM-L6-v2')
+RAG_WARMUP_ON_STARTUP = config('RAG_WARMUP_ON_STARTUP', default=True, cast=bool)
+# Embedding backend: 'sentence-transformers' (PyTorch) or 'onnx' (ONNX Runtime,
+# no torch import); export the ONNX model with `manage.py export_onnx_model`
+RAG_EMBEDDING_BACKEND = config('RAG_EMBEDDING_BACKEND', default='sentence-transformers')
+RAG_ONNX_MODEL_DIR = config('RAG_ONNX_MODEL_DIR', default=str(BASE_DIR / 'var' / 'onnx' / 'all-MiniLM-L6-v2'))
+RAG_ONNX_QUANTIZED = config('RAG_ONNX_QUANTIZED', default=True, cast=bool)  # int8 weights
+# Intra-op threads per encode call (0 = runtime default, i.e. all cores)
+RAG_EMBED_THREADS = config('RAG_EMBED_THREADS', default=0, cast=int)
+
+# Chunking: windows of whole words counted in the model's word-pieces; with
+# the title prepended they stay within RAG_EMBEDDING_MAX_TOKENS (the model's
+# max_seq_length, 256 for all-MiniLM-L6-v2), so no tail is truncated
+RAG_CHUNK_TOKENS = config('RAG_CHUNK_TOKENS', default=160, cast=int)
+RAG_CHUNK_OVERLAP = config('RAG_CHUNK_OVERLAP', default=32, cast=int)
+RAG_EMBEDDING_MAX_TOKENS = config('RAG_EMBEDDING_MAX_TOKENS', default=256, cast=int)
+RAG_EMBED_BATCH_SIZE = config('RAG_EMBED_BATCH_SIZE', default=32, cast=int)
+# Threads encoding queries for async views (bounds CPU use per process)
+RAG_EMBED_EXECUTOR_WORKERS = config('RAG_EMBED_EXECUTOR_WORKERS', default=2, cast=int)
+# Micro-batching of concurrent query embeddings (rag/embedding_batcher.py)
+RAG_EMBED_BATCHER_ENABLED = config('RAG_EMBED_BATCHER_ENABLED', default=True, cast=bool)
+RAG_EMBED_BATCHER_MAX_BATCH_SIZE = config('RAG_EMBED_BATCHER_MAX_BATCH_SIZE', default=32, cast=int)
+RAG_EMBED_BATCHER_MAX_WAIT_MS = config('RAG_EMBED_BATCHER_MAX_WAIT_MS', default=5, cast=float)
+# Query embedding cache (rag/embedding_cache.py): in-process LRU, then float16
+# vectors shared in Redis (REDIS_URL); keys include the embedding model version
+RAG_EMBEDDING_CACHE_ENABLED = config('RAG_EMBEDDING_CACHE_ENABLED', default=True, cast=bool)
+RAG_EMBEDDING_CACHE_SIZE = config('RAG_EMBEDDING_CACHE_SIZE', default=4096, cast=int)  # entries per process
+RAG_EMBEDDING_CACHE_REDIS_ENABLED = config('RAG_EMBEDDING_CACHE_REDIS_ENABLED', default=True, cast=bool)
+RAG_EMBEDDING_CACHE_TTL = config('RAG_EMBEDDING_CACHE_TTL', default=7 * 24 * 3600, cast=int)
+RAG_EMBEDDING_CACHE_VERSION = config('RAG_EMBEDDING_CACHE_VERSION', default='1')  # bump to drop every entry
+
+# Vector store (rag/vector_stores.py): 'qdrant', 'local' (embedded NumPy index
+# per website, no Qdrant needed) or 'auto' (local until a website has more than
+# RAG_LOCAL_VECTOR_MAX_POINTS chunks, then moved to Qdrant). 'local' and 'auto'
+# keep files in RAG_LOCAL_VECTOR_DIR, so they are only for single-host
+# deployments where the web processes and the Celery workers share that disk.
+RAG_VECTOR_STORE = config('RAG_VECTOR_STORE', default='qdrant')
+RAG_LOCAL_VECTOR_DIR = config('RAG_LOCAL_VECTOR_DIR', default=str(BASE_DIR / 'var' / 'vectors'))
+RAG_LOCAL_VECTOR_MAX_POINTS = config('RAG_LOCAL_VECTOR_MAX_POINTS', default=10000, cast=int)
+
+# Hybrid retrieval: BM25 index per website (local files) fused with vector search.
+# The index files are written by the ingest workers and read by the web
+# processes, so only enable it on a single host (or with RAG_LEXICAL_INDEX_DIR
+# on a disk shared by every node); a missing index leaves only the vector leg.
+RAG_HYBRID_ENABLED = config('RAG_HYBRID_ENABLED', default=False, cast=bool)
+RAG_HYBRID_CANDIDATES = config('RAG_HYBRID_CANDIDATES', default=10, cast=int)  # per leg, before fusion
+RAG_LEXICAL_INDEX_DIR = config('RAG_LEXICAL_INDEX_DIR', default=str(BASE_DIR / 'var' / 'lexical_index'))
+RAG_RETRIEVAL_EXECUTOR_WORKERS = config('RAG_RETRIEVAL_EXECUTOR_WORKERS', default=4, cast=int)
+
+# Cross-encoder reranking of over-fetched candidates (rag/reranker.py); when the
+# budget runs out, unscored candidates keep their first-pass order
+RAG_RERANK_ENABLED = config('RAG_RERANK_ENABLED', default=False, cast=bool)
+RAG_RERANK_MODEL = config('RAG_RERANK_MODEL', default='cross-encoder/ms-marco-MiniLM-L-6-v2')
+RAG_RERANK_CANDIDATES = config('RAG_RERANK_CANDIDATES', default=20, cast=int)
+RAG_RERANK_BUDGET_MS = config('RAG_RERANK_BUDGET_MS', default=150, cast=float)
+RAG_RERANK_BATCH_SIZE = config('RAG_RERANK_BATCH_SIZE', default=8, cast=int)
+
+# Prompt assembly: context token budget, filled by relevance with deduplicated
+# sentences; compression keeps each source's sentences closest to the query
+RAG_PROMPT_CONTEXT_TOKENS = config('RAG_PROMPT_CONTEXT_TOKENS', default=600, cast=int)
+RAG_PROMPT_COMPRESSION_ENABLED = config('RAG_PROMPT_COMPRESSION_ENABLED', default=True, cast=bool)
+RAG_PROMPT_SENTENCES_PER_SOURCE = config('RAG_PROMPT_SENTENCES_PER_SOURCE', default=4, cast=int)
+
+# Conversation memory: recent turns verbatim plus a rolling summary of older
+# ones (ChatSession.summary), folded in by a Celery task every few turns
+RAG_MEMORY_TURNS = config('RAG_MEMORY_TURNS', default=4, cast=int)
+RAG_MEMORY_SUMMARIZE_EVERY = config('RAG_MEMORY_SUMMARIZE_EVERY', default=4, cast=int)
+RAG_MEMORY_SUMMARY_CHARS = config('RAG_MEMORY_SUMMARY_CHARS', default=1000, cast=int)
+RAG_MEMORY_TURN_CHARS = config('RAG_MEMORY_TURN_CHARS', default=400, cast=int)  # per message in the prompt
+# Standalone retrieval query for follow-ups: 'none', 'concat' (previous
+# question + follow-up) or 'llm' (rewritten by Gemini from the memory)
+RAG_QUERY_REWRITE = config('RAG_QUERY_REWRITE', default='concat')
+
+# Answer cache (exact + semantic lookup per website and retrieved context)
+RAG_ANSWER_CACHE_ENABLED = config('RAG_ANSWER_CACHE_ENABLED', default=True, cast=bool)
+RAG_ANSWER_CACHE_ALIAS = 'default'
+RAG_ANSWER_CACHE_TTL = config('RAG_ANSWER_CACHE_TTL', default=3600, cast=int)
+RAG_ANSWER_CACHE_MAX_ENTRIES = config('RAG_ANSWER_CACHE_MAX_ENTRIES', default=200, cast=int)
+RAG_ANSWER_CACHE_SIMILARITY = config('RAG_ANSWER_CACHE_SIMILARITY', default=0.92, cast=float)
+# Looser match, any context, served only when Gemini is unavailable
+RAG_ANSWER_CACHE_FALLBACK_SIMILARITY = config('RAG_ANSWER_CACHE_FALLBACK_SIMILARITY', default=0.85, cast=float)
+
+# Extractive answers: lookups whose top result has a confident sentence
+# (vector score, sentence cosine and query term coverage) are answered with
+# that sentence, without Gemini. Also the degraded-mode answer.
+RAG_EXTRACTIVE_ENABLED = config('RAG_EXTRACTIVE_ENABLED', default=True, cast=bool)
+RAG_EXTRACTIVE_MIN_SCORE = config('RAG_EXTRACTIVE_MIN_SCORE', default=0.55, cast=float)
+RAG_EXTRACTIVE_MIN_SENTENCE_SCORE = config('RAG_EXTRACTIVE_MIN_SENTENCE_SCORE', default=0.7, cast=float)
+RAG_EXTRACTIVE_MIN_TERM_COVERAGE = config('RAG_EXTRACTIVE_MIN_TERM_COVERAGE', default=0.6, cast=float)
+
+# Instrumentation: the counters and histograms of each process (stage
+# latencies in rag_stage_seconds) in the Prometheus text format at
+# /api/metrics/, and the stage timings of chat requests in a Server-Timing
+# response header (and the `done` event of streams) when RAG_DEBUG_TIMING is on
+RAG_METRICS_ENABLED = config('RAG_METRICS_ENABLED', default=True, cast=bool)
+RAG_DEBUG_TIMING = config('RAG_DEBUG_TIMING', default=False, cast=bool)
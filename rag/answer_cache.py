@@ -0,0 +1,207 @@
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import caches
+from . import metrics
+import numpy as np
+import hashlib
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+
+def normalize_query(query: str) -> str:
+    """Case and whitespace insensitive form of a question"""
+    return ' '.join(query.lower().split())
+
+
+def context_fingerprint(search_results: list, history: str = '') -> str:
+    """
+    Fingerprint of the prompt's context: the chunk IDs and a digest of
+    their text (IDs derive from the URL and position, so they stay the
+    same when a re-scraped page changes), plus the conversation history
+    when there is one, so answers that depend on one session's earlier
+    turns are never served to another
+    """
+    digest = hashlib.sha1()
+    if history:
+        digest.update(f"history:{hashlib.sha1(history.encode('utf-8')).hexdigest()}|".encode('utf-8'))
+    for key, content in sorted(
+        (str(result.get('id') or result.get('page_id')), result.get('content') or '')
+        for result in search_results
+    ):
+        digest.update(f"{key}:{hashlib.sha1(content.encode('utf-8')).hexdigest()}|".encode('utf-8'))
+    return digest.hexdigest()
+
+
+class AnswerCache:
+    """
+    Cache of generated answers for one website
+
+    Answers are keyed by the normalized question and the fingerprint of the
+    retrieved context and history (context_fingerprint). A miss on the
+    exact key falls back to a semantic lookup: the nearest recent question
+    with the same fingerprint is reused when its embedding similarity is
+    above the threshold. Private answers (generated with a session's
+    history) are left out of the fallback lookup, which ignores fingerprints.
+
+    Entries expire after RAG_ANSWER_CACHE_TTL seconds and each website keeps
+    at most RAG_ANSWER_CACHE_MAX_ENTRIES recent questions (least recently
+    used are evicted). Re-scraping a website bumps its generation, which
+    makes every older entry unreachable.
+    """
+
+    def __init__(self, website_id: int):
+        self.website_id = website_id
+        self.enabled = settings.RAG_ANSWER_CACHE_ENABLED
+        self.cache = caches[settings.RAG_ANSWER_CACHE_ALIAS]
+        self.ttl = settings.RAG_ANSWER_CACHE_TTL
+        self.max_entries = settings.RAG_ANSWER_CACHE_MAX_ENTRIES
+        self.threshold = settings.RAG_ANSWER_CACHE_SIMILARITY
+        self._generation = None
+
+    @staticmethod
+    def _generation_key(website_id: int) -> str:
+        return f"rag:answers:{website_id}:generation"
+
+    @classmethod
+    def invalidate(cls, website_id: int):
+        """Drop every cached answer of a website (e.g. after a re-scrape)"""
+        cache = caches[settings.RAG_ANSWER_CACHE_ALIAS]
+        cache.set(cls._generation_key(website_id), time.time_ns(), None)
+        logger.info(f"Invalidated answer cache for website {website_id}")
+
+    @property
+    def generation(self) -> int:
+        if self._generation is None:
+            key = self._generation_key(self.website_id)
+            generation = self.cache.get(key)
+            if generation is None:
+                generation = time.time_ns()
+                self.cache.add(key, generation, None)
+                generation = self.cache.get(key, generation)
+            self._generation = generation
+        return self._generation
+
+    def _prefix(self) -> str:
+        return f"rag:answers:{self.website_id}:{self.generation}"
+
+    def _entry_key(self, query: str, fingerprint: str) -> str:
+        digest = hashlib.sha256(f"{normalize_query(query)}|{fingerprint}".encode('utf-8')).hexdigest()
+        return f"{self._prefix()}:answer:{digest}"
+
+    def _recent_key(self) -> str:
+        return f"{self._prefix()}:recent"
+
+    def _touch(self, recent: list, entry: dict):
+        """Move an entry to the front of the recent list (LRU order)"""
+        recent = [item for item in recent if item['key'] != entry['key']]
+        recent.insert(0, entry)
+        self.cache.set(self._recent_key(), recent[:self.max_entries], self.ttl)
+
+    def get(self, query: str, fingerprint: str, query_vector=None):
+        """
+        Look up a cached answer
+        Returns: the cached answer or None
+        """
+        if not self.enabled:
+            return None
+
+        key = self._entry_key(query, fingerprint)
+        answer = self.cache.get(key)
+        if answer is not None:
+            metrics.increment('rag_answer_cache_hits_total', kind='exact')
+            return answer
+
+        if query_vector is not None:
+            answer = self._semantic_get(fingerprint, query_vector)
+            if answer is not None:
+                metrics.increment('rag_answer_cache_hits_total', kind='semantic')
+                return answer
+
+        metrics.increment('rag_answer_cache_misses_total')
+        return None
+
+    def _semantic_get(self, fingerprint: str, query_vector, threshold: float = None):
+        recent = self.cache.get(self._recent_key()) or []
+        if fingerprint is None:
+            candidates = [item for item in recent if not item.get('private')]
+        else:
+            candidates = [item for item in recent if item['fingerprint'] == fingerprint]
+        if not candidates:
+            return None
+
+        query = np.asarray(query_vector, dtype=np.float32)
+        query = query / (np.linalg.norm(query) or 1.0)
+        matrix = np.stack([
+            np.frombuffer(item['vector'], dtype=np.float16) for item in candidates
+        ]).astype(np.float32)
+        similarities = matrix @ query
+        best = int(np.argmax(similarities))
+        if similarities[best] < (threshold or self.threshold):
+            return None
+
+        answer = self.cache.get(candidates[best]['key'])
+        if answer is not None:
+            self._touch(recent, candidates[best])
+        return answer
+
+    def get_fallback(self, query_vector):
+        """
+        Answer of the most similar recent question, whatever its context
+        (RAG_ANSWER_CACHE_FALLBACK_SIMILARITY); for when no new answer can
+        be generated
+        Returns: the cached answer or None
+        """
+        if not self.enabled or query_vector is None:
+            return None
+        return self._semantic_get(None, query_vector, settings.RAG_ANSWER_CACHE_FALLBACK_SIMILARITY)
+
+    def set(self, query: str, fingerprint: str, answer: str, query_vector=None, private: bool = False):
+        """
+        Store an answer (and remember the question for semantic lookups)
+        private: the answer depends on a session's history; it is only
+        reused with the same fingerprint
+        """
+        if not self.enabled:
+            return
+
+        key = self._entry_key(query, fingerprint)
+        self.cache.set(key, answer, self.ttl)
+
+        if query_vector is not None:
+            vector = np.asarray(query_vector, dtype=np.float32)
+            vector = vector / (np.linalg.norm(vector) or 1.0)
+            recent = self.cache.get(self._recent_key()) or []
+            self._touch(recent, {
+                'key': key,
+                'fingerprint': fingerprint,
+                'vector': vector.astype(np.float16).tobytes(),
+                'private': private,
+            })
+
+    async def aget(self, query: str, fingerprint: str, query_vector=None):
+        """Async variant of get() for async views"""
+        return await sync_to_async(self.get, thread_sensitive=False)(query, fingerprint, query_vector)
+
+    async def aget_fallback(self, query_vector):
+        """Async variant of get_fallback()"""
+        return await sync_to_async(self.get_fallback, thread_sensitive=False)(query_vector)
+
+    async def aset(self, query: str, fingerprint: str, answer: str, query_vector=None, private: bool = False):
+        """Async variant of set() for async views"""
+        await sync_to_async(self.set, thread_sensitive=False)(query, fingerprint, answer, query_vector, private)
+
+    @staticmethod
+    def stats() -> dict:
+        """Hit/miss counters of this process"""
+        exact = metrics.get_counter('rag_answer_cache_hits_total', kind='exact')
+        semantic = metrics.get_counter('rag_answer_cache_hits_total', kind='semantic')
+        misses = metrics.get_counter('rag_answer_cache_misses_total')
+        lookups = exact + semantic + misses
+        return {
+            'exact_hits': exact,
+            'semantic_hits': semantic,
+            'misses': misses,
+            'hit_rate': (exact + semantic) / lookups if lookups else 0.0,
+        }
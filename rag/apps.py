@@ -1,6 +1,21 @@
 from django.apps import AppConfig
+import sys
 
 
 class RagConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'rag'
+
+    def ready(self):
+        from django.conf import settings
+        from .registry import registry
+
+        if not settings.RAG_WARMUP_ON_STARTUP:
+            return
+
+        # Management commands such as migrate or shell don't serve chat
+        # traffic, so only warm up servers and workers.
+        if sys.argv and sys.argv[0].endswith('manage.py') and sys.argv[1:2] != ['runserver']:
+            return
+
+        registry.warm_up()
@@ -0,0 +1,364 @@
+from django.conf import settings
+from .qdrant_service import QdrantService
+from .hybrid_retriever import HybridRetriever
+from .reranker import Reranker
+from .gemini_service import GeminiService
+from .llm_client import LLMUnavailableError
+from .prompt_builder import PromptBuilder, TOKEN_BUCKETS, count_tokens
+from .answer_cache import AnswerCache, context_fingerprint
+from .extractive import ExtractiveAnswerer
+from .memory import ConversationMemory, format_history
+from .registry import registry
+from . import metrics, tracing
+import asyncio
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class ChatService:
+    """
+    Retrieval-augmented answering for a website's chat sessions
+    Shared by the blocking and the streaming chat endpoints.
+    """
+
+    NO_CONTEXT_RESPONSE = (
+        "I couldn't find relevant information in the scraped content. "
+        "Please make sure the website has been scraped."
+    )
+
+    UNAVAILABLE_RESPONSE = "I can't answer right now. Please try again in a moment."
+
+    EXTRACTIVE_RESPONSE_INTRO = "I can't generate a full answer right now, but this is what I found:"
+
+    # Excerpts quoted by the extractive fallback
+    FALLBACK_EXCERPTS = 2
+
+    EMPTY_MEMORY = {'summary': '', 'turns': []}
+
+    def __init__(self, website_id: int, session=None):
+        self.website_id = website_id
+        # Cheap to build: the model and clients are shared per process
+        self.qdrant = QdrantService()
+        self.answer_cache = AnswerCache(website_id)
+        self.extractive = ExtractiveAnswerer()
+        # Multi-turn memory of the chat session, if any
+        self.memory = ConversationMemory(session) if session is not None else None
+
+    def _retrieval(self, user_message: str, query: str, search_results: list, query_vector,
+                   memory: dict) -> dict:
+        """Bundle search results with the context built from them"""
+        # Fill the token budget with the most relevant, deduplicated sentences
+        with tracing.span('prompt_build', search_results=len(search_results)) as span:
+            prompt = PromptBuilder().build(search_results, query_vector)
+            history = format_history(memory)
+            prompt_tokens = count_tokens(GeminiService.build_prompt(user_message, prompt['context'], history))
+            span.set(
+                prompt_tokens=prompt_tokens,
+                context_tokens=prompt['context_tokens'],
+                sources_used=prompt['sources_used'],
+            )
+        metrics.observe('rag_prompt_tokens', prompt_tokens, buckets=TOKEN_BUCKETS)
+        logger.info(
+            f"Prompt for website {self.website_id}: {prompt_tokens} tokens "
+            f"(context {prompt['context_tokens']} of {prompt['source_tokens']} retrieved, "
+            f"{prompt['sources_used']}/{len(search_results)} sources)"
+        )
+
+        return {
+            'query': query,
+            'search_results': search_results,
+            'context': prompt['context'],
+            'history': history,
+            'prompt_tokens': prompt_tokens,
+            'excerpts': prompt['excerpts'],
+            'sentence_scores': prompt['sentence_scores'],
+            'query_vector': query_vector,
+            # The prompt includes the history: answers are only shared between equal histories
+            'fingerprint': context_fingerprint(search_results, history),
+        }
+
+    def _candidate_count(self, limit: int) -> int:
+        """First-pass results to fetch: over-fetch when a reranker picks the top ones"""
+        if settings.RAG_RERANK_ENABLED:
+            return max(limit, settings.RAG_RERANK_CANDIDATES)
+        return limit
+
+    def retrieve(self, user_message: str, limit: int = 3) -> dict:
+        """
+        Find the context for a question
+        Follow-up questions are searched as a standalone query built from
+        the session's memory.
+        Returns: dict with 'query', 'search_results', 'context', 'history',
+        'prompt_tokens', 'excerpts', 'sentence_scores', 'query_vector',
+        'fingerprint'
+        """
+        with tracing.span('memory'):
+            memory = self.memory.load() if self.memory else self.EMPTY_MEMORY
+            query = self.memory.rewrite_query(user_message, memory) if self.memory else user_message
+        candidates = self._candidate_count(limit)
+        if settings.RAG_HYBRID_ENABLED:
+            # Vector + BM25 legs in parallel, fused by rank
+            search_results, query_vector = HybridRetriever(self.qdrant, self.website_id).search(
+                query, limit=candidates
+            )
+        else:
+            # Embed once; the vector serves both the search and the answer cache
+            query_vector = self.qdrant.generate_embedding(query)
+
+            # Search for relevant context in this website's chunks only
+            search_results = self.qdrant.search(
+                query,
+                limit=candidates,
+                website_id=self.website_id,
+                query_vector=query_vector
+            )
+
+        if settings.RAG_RERANK_ENABLED:
+            with tracing.span('rerank', candidates=len(search_results)):
+                search_results = Reranker().rerank(query, search_results, limit)
+
+        return self._retrieval(user_message, query, search_results, query_vector, memory)
+
+    async def aretrieve(self, user_message: str, limit: int = 3) -> dict:
+        """Async variant of retrieve()"""
+        with tracing.span('memory'):
+            memory = await self.memory.aload() if self.memory else self.EMPTY_MEMORY
+            query = await self.memory.arewrite_query(user_message, memory) if self.memory else user_message
+        candidates = self._candidate_count(limit)
+        if settings.RAG_HYBRID_ENABLED:
+            search_results, query_vector = await HybridRetriever(self.qdrant, self.website_id).asearch(
+                query, limit=candidates
+            )
+        else:
+            query_vector = await self.qdrant.agenerate_embedding(query)
+            search_results = await self.qdrant.asearch(
+                query,
+                limit=candidates,
+                website_id=self.website_id,
+                query_vector=query_vector
+            )
+
+        if settings.RAG_RERANK_ENABLED:
+            with tracing.span('rerank', candidates=len(search_results)):
+                search_results = await Reranker().arerank(query, search_results, limit)
+
+        # The prompt build encodes the context's sentences: keep it off the event loop
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            registry.get_embedding_executor(),
+            tracing.in_context(self._retrieval),
+            user_message, query, search_results, query_vector, memory,
+        )
+
+    def _cached_answer(self, retrieval: dict):
+        with tracing.span('answer_cache') as span:
+            cached = self.answer_cache.get(retrieval['query'], retrieval['fingerprint'], retrieval['query_vector'])
+            span.set(hit=cached is not None)
+        return cached
+
+    def _answered(self, source: str):
+        metrics.increment('rag_chat_answers_total', source=source)
+
+    def _extract(self, retrieval: dict):
+        answer_span = self.extractive.find(
+            retrieval['query'], retrieval['query_vector'], retrieval['search_results'],
+            sentence_scores=retrieval['sentence_scores'],
+        )
+        return ExtractiveAnswerer.format(answer_span) if answer_span else None
+
+    def local_answer(self, retrieval: dict):
+        """
+        Answer a lookup with a span of the top result, without Gemini
+        Returns: the answer, or None when no span is confident enough
+        """
+        if not self.extractive.enabled:
+            return None
+        with tracing.span('extractive') as span:
+            answer = self._extract(retrieval)
+            span.set(hit=answer is not None)
+        return answer
+
+    async def alocal_answer(self, retrieval: dict):
+        """Async variant of local_answer(); sentences are embedded in the embedding executor"""
+        if not self.extractive.enabled:
+            return None
+        loop = asyncio.get_running_loop()
+        with tracing.span('extractive') as span:
+            answer = await loop.run_in_executor(registry.get_embedding_executor(), self._extract, retrieval)
+            span.set(hit=answer is not None)
+        return answer
+
+    def excerpts_answer(self, retrieval: dict) -> str:
+        """Quote the most relevant excerpts of the context with their URLs"""
+        excerpts = retrieval['excerpts'][:self.FALLBACK_EXCERPTS]
+        if not excerpts:
+            return self.UNAVAILABLE_RESPONSE
+        quotes = "\n".join(f"- {excerpt['text']} ({excerpt['url']})" for excerpt in excerpts)
+        return f"{self.EXTRACTIVE_RESPONSE_INTRO}\n\n{quotes}"
+
+    def _degraded_answer(self, retrieval: dict):
+        """Best sentence of the top results whatever its scores, else None"""
+        span = self.extractive.find(
+            retrieval['query'], retrieval['query_vector'], retrieval['search_results'], confident_only=False,
+            sentence_scores=retrieval['sentence_scores'],
+        )
+        return f"{self.EXTRACTIVE_RESPONSE_INTRO}\n\n{ExtractiveAnswerer.format(span)}" if span else None
+
+    def _fallback(self, retrieval: dict, cached, degraded, error: LLMUnavailableError) -> str:
+        if cached is not None:
+            kind, response = 'cache', cached
+        elif degraded is not None:
+            kind, response = 'extractive', degraded
+        else:
+            kind, response = 'excerpts', self.excerpts_answer(retrieval)
+        metrics.increment('rag_answer_fallbacks_total', kind=kind, reason=error.reason)
+        self._answered('fallback')
+        logger.warning(f"Gemini unavailable ({error.reason}), answering from the {kind} fallback")
+        return response
+
+    def fallback_answer(self, retrieval: dict, error: LLMUnavailableError) -> str:
+        """
+        Answer without Gemini: the cached answer of a similar question if
+        any, else the best sentence of the retrieved context, else excerpts
+        of it (never cached)
+        """
+        cached = self.answer_cache.get_fallback(retrieval['query_vector'])
+        degraded = self._degraded_answer(retrieval) if cached is None else None
+        return self._fallback(retrieval, cached, degraded, error)
+
+    async def afallback_answer(self, retrieval: dict, error: LLMUnavailableError) -> str:
+        """Async variant of fallback_answer()"""
+        cached = await self.answer_cache.aget_fallback(retrieval['query_vector'])
+        degraded = None
+        if cached is None:
+            loop = asyncio.get_running_loop()
+            degraded = await loop.run_in_executor(
+                registry.get_embedding_executor(), self._degraded_answer, retrieval
+            )
+        return self._fallback(retrieval, cached, degraded, error)
+
+    def answer(self, user_message: str, retrieval: dict) -> str:
+        """
+        Generate the answer using Gemini, unless a cached answer or a
+        confident extractive span answers it locally
+        """
+        if not retrieval['context']:
+            self._answered('no_context')
+            return self.NO_CONTEXT_RESPONSE
+
+        cached = self._cached_answer(retrieval)
+        if cached is not None:
+            self._answered('cache')
+            return cached
+
+        local = self.local_answer(retrieval)
+        if local is not None:
+            self._answered('extractive')
+            return local
+
+        try:
+            bot_response = GeminiService().generate_response(user_message, retrieval['context'], retrieval['history'])
+        except LLMUnavailableError as e:
+            return self.fallback_answer(retrieval, e)
+        self._answered('llm')
+        self.answer_cache.set(
+            retrieval['query'], retrieval['fingerprint'], bot_response, retrieval['query_vector'],
+            private=bool(retrieval['history']),
+        )
+        return bot_response
+
+    async def aanswer(self, user_message: str, retrieval: dict) -> str:
+        """Async variant of answer()"""
+        if not retrieval['context']:
+            self._answered('no_context')
+            return self.NO_CONTEXT_RESPONSE
+
+        with tracing.span('answer_cache') as span:
+            cached = await self.answer_cache.aget(retrieval['query'], retrieval['fingerprint'], retrieval['query_vector'])
+            span.set(hit=cached is not None)
+        if cached is not None:
+            self._answered('cache')
+            return cached
+
+        local = await self.alocal_answer(retrieval)
+        if local is not None:
+            self._answered('extractive')
+            return local
+
+        try:
+            bot_response = await GeminiService().agenerate_response(
+                user_message, retrieval['context'], retrieval['history']
+            )
+        except LLMUnavailableError as e:
+            return await self.afallback_answer(retrieval, e)
+        self._answered('llm')
+        await self.answer_cache.aset(
+            retrieval['query'], retrieval['fingerprint'], bot_response, retrieval['query_vector'],
+            private=bool(retrieval['history']),
+        )
+        return bot_response
+
+    def stream_answer(self, user_message: str, retrieval: dict):
+        """
+        Generate the answer piece by piece
+        Cached and extractive answers are sent in one piece. The full answer
+        is cached once the stream completes. If Gemini fails before the
+        first piece, the fallback answer is sent instead.
+        """
+        if not retrieval['context']:
+            self._answered('no_context')
+            yield self.NO_CONTEXT_RESPONSE
+            return
+
+        cached = self._cached_answer(retrieval)
+        if cached is not None:
+            self._answered('cache')
+            yield cached
+            return
+
+        local = self.local_answer(retrieval)
+        if local is not None:
+            self._answered('extractive')
+            yield local
+            return
+
+        pieces = []
+        try:
+            for piece in GeminiService().stream_response(user_message, retrieval['context'], retrieval['history']):
+                pieces.append(piece)
+                yield piece
+        except LLMUnavailableError as e:
+            if pieces:
+                raise
+            yield self.fallback_answer(retrieval, e)
+            return
+
+        self._answered('llm')
+        self.answer_cache.set(
+            retrieval['query'], retrieval['fingerprint'], ''.join(pieces), retrieval['query_vector'],
+            private=bool(retrieval['history']),
+        )
+
+    @staticmethod
+    def answer_stats() -> dict:
+        """
+        Answer sources of this process
+        local_share: answers not generated by Gemini (cache, extractive or
+        fallback) over all answers with context
+        """
+        counts = {
+            source: metrics.get_counter('rag_chat_answers_total', source=source)
+            for source in ('llm', 'cache', 'extractive', 'fallback', 'no_context')
+        }
+        answered = sum(counts.values()) - counts['no_context']
+        return {
+            **counts,
+            'local_share': (answered - counts['llm']) / answered if answered else 0.0,
+            'extractive_share': counts['extractive'] / answered if answered else 0.0,
+        }
+
+    def schedule_summary(self):
+        """Queue the session's background summary when it is due (after saving a turn)"""
+        if self.memory is not None:
+            self.memory.schedule_summary()
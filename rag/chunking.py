@@ -0,0 +1,136 @@
+from django.conf import settings
+from typing import List, Dict, Optional
+from .registry import registry
+import bisect
+import re
+import uuid
+
+# Namespace for deterministic chunk IDs (uuid5 of website/url/index)
+CHUNK_NAMESPACE = uuid.UUID('8f6d3c1e-5b0a-4c36-9a51-2f4f1d7b9e20')
+
+_WORD_RE = re.compile(r'\S+')
+
+# [CLS] and [SEP], added to every embedded text
+SPECIAL_TOKENS = 2
+
+# Longer titles are cut before being prepended to each window
+MAX_TITLE_TOKENS = 32
+
+
+def chunk_id(website_id: Optional[int], url: str, index: int) -> str:
+    """
+    Stable ID for the index-th chunk of a page.
+    Re-ingesting the same page overwrites its points instead of duplicating them.
+    """
+    return str(uuid.uuid5(CHUNK_NAMESPACE, f"{website_id}:{url}:{index}"))
+
+
+def _words(text: str, tokenizer) -> List[tuple]:
+    """(char_start, char_end, word-pieces) of every whitespace-separated word"""
+    spans = [match.span() for match in _WORD_RE.finditer(text)]
+    if not spans:
+        return []
+    starts = [span[0] for span in spans]
+    counts = [0] * len(spans)
+    for piece_start, piece_end in tokenizer.encode(text, add_special_tokens=False).offsets:
+        if piece_end > piece_start:
+            counts[bisect.bisect_right(starts, piece_start) - 1] += 1
+    return [(start, end, count) for (start, end), count in zip(spans, counts)]
+
+
+def split_text(text: str, max_tokens: int = None, overlap: int = None, tokenizer=None) -> List[Dict]:
+    """
+    Split text into overlapping windows of at most max_tokens tokens.
+
+    Tokens are the embedding model's word-pieces (see
+    registry.get_chunk_tokenizer), so URLs, numbers and non-English text
+    can't overflow the model. Windows hold whole words; consecutive ones
+    share about `overlap` tokens. A single word longer than max_tokens
+    gets a window of its own.
+
+    Returns: list of dicts with 'text', 'char_start', 'char_end'
+    """
+    max_tokens = max_tokens or settings.RAG_CHUNK_TOKENS
+    overlap = settings.RAG_CHUNK_OVERLAP if overlap is None else overlap
+    if overlap >= max_tokens:
+        raise ValueError("Chunk overlap must be smaller than the chunk size")
+
+    words = _words(text, tokenizer or registry.get_chunk_tokenizer())
+    if not words:
+        return []
+
+    windows = []
+    start = 0
+    while True:
+        end = start
+        tokens = 0
+        while end < len(words) and (end == start or tokens + words[end][2] <= max_tokens):
+            tokens += words[end][2]
+            end += 1
+        char_start = words[start][0]
+        char_end = words[end - 1][1]
+        windows.append({
+            'text': text[char_start:char_end],
+            'char_start': char_start,
+            'char_end': char_end,
+        })
+        if end == len(words):
+            break
+
+        # Start the next window `overlap` tokens back (always moving forward)
+        next_start = end
+        shared = 0
+        while next_start - 1 > start and shared + words[next_start - 1][2] <= overlap:
+            next_start -= 1
+            shared += words[next_start][2]
+        start = next_start
+    return windows
+
+
+def _embed_title(title: str, tokenizer) -> tuple:
+    """Title prepended to each window (cut to MAX_TITLE_TOKENS), and its tokens"""
+    offsets = tokenizer.encode(title, add_special_tokens=False).offsets
+    if len(offsets) > MAX_TITLE_TOKENS:
+        return title[:offsets[MAX_TITLE_TOKENS - 1][1]], MAX_TITLE_TOKENS
+    return title, len(offsets)
+
+
+def chunk_page(page_id: int, url: str, title: str, content: str,
+               website_id: Optional[int] = None) -> List[Dict]:
+    """
+    Split a scraped page into chunks ready to embed.
+
+    Each window is embedded as "title\nwindow", so its size leaves room
+    for the title and the special tokens within RAG_EMBEDDING_MAX_TOKENS.
+
+    Returns: list of dicts with 'id', 'text', 'embed_text' and the Qdrant
+    'payload'
+    """
+    tokenizer = registry.get_chunk_tokenizer()
+    title_text, title_tokens = _embed_title(title or '', tokenizer)
+    max_tokens = min(
+        settings.RAG_CHUNK_TOKENS,
+        settings.RAG_EMBEDDING_MAX_TOKENS - SPECIAL_TOKENS - title_tokens,
+    )
+    overlap = min(settings.RAG_CHUNK_OVERLAP, max_tokens // 4)
+    windows = split_text(content, max_tokens, overlap, tokenizer)
+    chunks = []
+    for index, window in enumerate(windows):
+        chunks.append({
+            'id': chunk_id(website_id, url, index),
+            'text': window['text'],
+            'embed_text': f"{title_text}\n{window['text']}",
+            'payload': {
+                'page_id': page_id,
+                'website_id': website_id,
+                'url': url,
+                'title': title,
+                'content': window['text'],
+                'chunk_index': index,
+                'chunk_count': len(windows),
+                'char_start': window['char_start'],
+                'char_end': window['char_end'],
+                'content_length': len(content),
+            },
+        })
+    return chunks
@@ -0,0 +1,162 @@
+from django.conf import settings
+from pathlib import Path
+import json
+import logging
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Written next to the ONNX model by `manage.py export_onnx_model`
+ONNX_MODEL_FILE = 'model.onnx'
+ONNX_QUANTIZED_MODEL_FILE = 'model.int8.onnx'
+TOKENIZER_FILE = 'tokenizer.json'
+CONFIG_FILE = 'embedding_config.json'
+
+
+class SentenceTransformerBackend:
+    """
+    Embeddings with sentence-transformers on PyTorch
+    The reference implementation; importing it loads torch.
+    """
+
+    name = 'sentence-transformers'
+
+    def __init__(self, model_name: str, threads: int = 0):
+        if threads:
+            import torch
+
+            torch.set_num_threads(threads)
+
+        from sentence_transformers import SentenceTransformer
+
+        self.model = SentenceTransformer(model_name)
+
+    def encode(self, texts, batch_size: int = 32, show_progress_bar: bool = False):
+        return self.model.encode(texts, batch_size=batch_size, show_progress_bar=show_progress_bar)
+
+
+class OnnxEmbeddingBackend:
+    """
+    Embeddings with ONNX Runtime on CPU, without torch
+
+    Runs the exported transformer (int8 dynamically quantized by default)
+    and applies the sentence-transformers pooling in NumPy: mean over the
+    attention mask, then L2 normalization if the model has it.
+    """
+
+    name = 'onnx'
+
+    def __init__(self, model_dir: str, quantized: bool = True, threads: int = 0):
+        import onnxruntime
+        from tokenizers import Tokenizer
+
+        model_dir = Path(model_dir)
+        config = json.loads((model_dir / CONFIG_FILE).read_text())
+        self.normalize = config.get('normalize', True)
+
+        self.tokenizer = Tokenizer.from_file(str(model_dir / TOKENIZER_FILE))
+        self.tokenizer.enable_truncation(max_length=config['max_seq_length'])
+        self.tokenizer.enable_padding()
+
+        options = onnxruntime.SessionOptions()
+        options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if threads:
+            options.intra_op_num_threads = threads
+        model_file = model_dir / (ONNX_QUANTIZED_MODEL_FILE if quantized else ONNX_MODEL_FILE)
+        self.session = onnxruntime.InferenceSession(
+            str(model_file), options, providers=['CPUExecutionProvider']
+        )
+        self.input_names = {model_input.name for model_input in self.session.get_inputs()}
+        logger.info(f"Loaded ONNX embedding model: {model_file}")
+
+    def _encode_batch(self, texts: list) -> np.ndarray:
+        encodings = self.tokenizer.encode_batch(texts)
+        inputs = {
+            'input_ids': np.array([e.ids for e in encodings], dtype=np.int64),
+            'attention_mask': np.array([e.attention_mask for e in encodings], dtype=np.int64),
+            'token_type_ids': np.array([e.type_ids for e in encodings], dtype=np.int64),
+        }
+        token_embeddings = self.session.run(
+            None, {name: value for name, value in inputs.items() if name in self.input_names}
+        )[0]
+
+        mask = inputs['attention_mask'][:, :, None].astype(np.float32)
+        embeddings = (token_embeddings * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+        if self.normalize:
+            embeddings /= np.clip(np.linalg.norm(embeddings, axis=1, keepdims=True), 1e-12, None)
+        return embeddings.astype(np.float32)
+
+    def encode(self, texts, batch_size: int = 32, show_progress_bar: bool = False):
+        """Same contract as SentenceTransformer.encode: a vector for a str, a matrix for a list"""
+        single = isinstance(texts, str)
+        if single:
+            texts = [texts]
+
+        # Batch texts of similar length together to limit padding
+        order = sorted(range(len(texts)), key=lambda i: len(texts[i]), reverse=True)
+        embeddings = None
+        for start in range(0, len(order), batch_size):
+            batch = order[start:start + batch_size]
+            vectors = self._encode_batch([texts[i] for i in batch])
+            if embeddings is None:
+                embeddings = np.empty((len(texts), vectors.shape[1]), dtype=np.float32)
+            embeddings[batch] = vectors
+
+        if embeddings is None:
+            return np.empty((0, 0), dtype=np.float32)
+        return embeddings[0] if single else embeddings
+
+
+def load_embedding_backend(backend: str):
+    """Instantiate an embedding backend by name (see RAG_EMBEDDING_BACKEND)"""
+    if backend == OnnxEmbeddingBackend.name:
+        return OnnxEmbeddingBackend(
+            settings.RAG_ONNX_MODEL_DIR,
+            quantized=settings.RAG_ONNX_QUANTIZED,
+            threads=settings.RAG_EMBED_THREADS,
+        )
+    if backend == SentenceTransformerBackend.name:
+        return SentenceTransformerBackend(settings.RAG_EMBEDDING_MODEL, threads=settings.RAG_EMBED_THREADS)
+    raise ValueError(f"Unknown embedding backend: {backend}")
+
+
+def load_tokenizer():
+    """
+    Word-piece tokenizer of the configured embedding model (tokenizers
+    only, no torch): the ONNX export's tokenizer.json, the one of a local
+    model directory, or the model's on the Hugging Face Hub (cached)
+    Truncation and padding are off, so every token is counted.
+    """
+    from tokenizers import Tokenizer
+
+    if settings.RAG_EMBEDDING_BACKEND == OnnxEmbeddingBackend.name:
+        tokenizer = Tokenizer.from_file(str(Path(settings.RAG_ONNX_MODEL_DIR) / TOKENIZER_FILE))
+    elif Path(settings.RAG_EMBEDDING_MODEL, TOKENIZER_FILE).is_file():
+        tokenizer = Tokenizer.from_file(str(Path(settings.RAG_EMBEDDING_MODEL, TOKENIZER_FILE)))
+    else:
+        model_name = settings.RAG_EMBEDDING_MODEL
+        if '/' not in model_name:
+            model_name = f'sentence-transformers/{model_name}'
+        tokenizer = Tokenizer.from_pretrained(model_name)
+    tokenizer.no_truncation()
+    tokenizer.no_padding()
+    return tokenizer
+
+
+def embedding_model_version() -> str:
+    """
+    Identifier of the configured embedding model, known without loading it
+    Changes whenever the vectors may: another backend or model, or a new
+    ONNX export (file modification time).
+    """
+    backend = settings.RAG_EMBEDDING_BACKEND
+    if backend == OnnxEmbeddingBackend.name:
+        model_file = Path(settings.RAG_ONNX_MODEL_DIR) / (
+            ONNX_QUANTIZED_MODEL_FILE if settings.RAG_ONNX_QUANTIZED else ONNX_MODEL_FILE
+        )
+        try:
+            modified = model_file.stat().st_mtime_ns
+        except FileNotFoundError:
+            modified = 0
+        return f"{backend}:{model_file}:{modified}"
+    return f"{backend}:{settings.RAG_EMBEDDING_MODEL}"
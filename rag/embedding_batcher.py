@@ -0,0 +1,95 @@
+from concurrent.futures import Future
+from . import metrics
+import asyncio
+import queue
+import threading
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128)
+QUEUE_LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1.0)
+
+
+class EmbeddingBatcher:
+    """
+    Dynamic micro-batching for query embeddings
+
+    Concurrent callers (request threads or coroutines) enqueue single texts.
+    A background thread waits up to max_wait_ms after the first text for
+    more to arrive, encodes up to max_batch_size of them in one forward
+    pass and resolves each caller's future with its own vector.
+
+    Metrics: rag_embedding_batch_size and rag_embedding_queue_seconds histograms.
+    """
+
+    def __init__(self, encode, max_batch_size: int = 32, max_wait_ms: float = 5):
+        """
+        Args:
+            encode: callable taking a list of texts, returning a NumPy matrix
+        """
+        self.encode = encode
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self._queue = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def _ensure_worker(self):
+        if self._thread is None or not self._thread.is_alive():
+            with self._lock:
+                if self._thread is None or not self._thread.is_alive():
+                    self._thread = threading.Thread(
+                        target=self._run, name='rag-embedding-batcher', daemon=True
+                    )
+                    self._thread.start()
+
+    def submit(self, text: str) -> Future:
+        """Queue a text; the future resolves to its embedding vector"""
+        self._ensure_worker()
+        future = Future()
+        self._queue.put((text, future, time.monotonic()))
+        return future
+
+    def embed(self, text: str, timeout: float = None):
+        """Embed one text, blocking until its batch has been encoded"""
+        return self.submit(text).result(timeout=timeout)
+
+    async def aembed(self, text: str):
+        """Embed one text without blocking the event loop"""
+        return await asyncio.wrap_future(self.submit(text))
+
+    def _collect(self) -> list:
+        """Wait for a first item, then gather more until the batch is full or the wait is over"""
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            started_at = time.monotonic()
+            metrics.observe('rag_embedding_batch_size', len(batch), buckets=BATCH_SIZE_BUCKETS)
+            for _, _, enqueued_at in batch:
+                metrics.observe('rag_embedding_queue_seconds', started_at - enqueued_at,
+                                buckets=QUEUE_LATENCY_BUCKETS)
+
+            try:
+                vectors = self.encode([text for text, _, _ in batch])
+            except Exception as e:
+                logger.error(f"Error encoding embedding batch: {e}")
+                for _, future, _ in batch:
+                    future.set_exception(e)
+                continue
+
+            for (_, future, _), vector in zip(batch, vectors):
+                future.set_result(vector)
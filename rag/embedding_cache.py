@@ -0,0 +1,199 @@
+from collections import OrderedDict
+from django.conf import settings
+from .embedding_backends import embedding_model_version
+from .registry import registry
+from . import metrics
+import numpy as np
+import asyncio
+import hashlib
+import threading
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+# After a Redis error the shared tier is skipped for this long
+REDIS_RETRY_SECONDS = 30
+
+
+def normalize_text(text: str) -> str:
+    """
+    Whitespace-insensitive form of a text
+    Case is kept: it changes the vectors of cased models.
+    """
+    return ' '.join(text.split())
+
+
+class EmbeddingCache:
+    """
+    Two-tier cache of query embeddings
+
+    - memory: an LRU of RAG_EMBEDDING_CACHE_SIZE float32 vectors in this
+      process
+    - redis: vectors shared by every process in REDIS_URL, stored as
+      float16 bytes (768 bytes for 384 dimensions), expiring after
+      RAG_EMBEDDING_CACHE_TTL seconds. Redis hits are copied to memory.
+
+    Keys combine the normalized text with the embedding model version
+    (see embedding_model_version) and RAG_EMBEDDING_CACHE_VERSION, so a new
+    model never reads the vectors of the previous one. Redis failures are
+    logged and the shared tier is skipped for REDIS_RETRY_SECONDS.
+
+    Metrics: rag_embedding_cache_hits_total (by tier),
+    rag_embedding_cache_misses_total and rag_embedding_cache_errors_total.
+    """
+
+    def __init__(self, max_entries: int = None, ttl: int = None):
+        self.enabled = settings.RAG_EMBEDDING_CACHE_ENABLED
+        self.shared = settings.RAG_EMBEDDING_CACHE_REDIS_ENABLED
+        self.max_entries = max_entries or settings.RAG_EMBEDDING_CACHE_SIZE
+        self.ttl = ttl or settings.RAG_EMBEDDING_CACHE_TTL
+        self.version = f"{embedding_model_version()}|{settings.RAG_EMBEDDING_CACHE_VERSION}"
+        self._prefix = f"rag:embedding:{hashlib.sha1(self.version.encode('utf-8')).hexdigest()[:16]}"
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._redis_down_until = 0.0
+
+    def key(self, text: str) -> str:
+        digest = hashlib.sha256(normalize_text(text).encode('utf-8')).hexdigest()
+        return f"{self._prefix}:{digest}"
+
+    def _get_memory(self, key: str):
+        with self._lock:
+            vector = self._entries.get(key)
+            if vector is not None:
+                self._entries.move_to_end(key)
+            return vector
+
+    def _set_memory(self, key: str, vector: np.ndarray):
+        with self._lock:
+            self._entries[key] = vector
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def _redis_available(self) -> bool:
+        return self.shared and time.monotonic() >= self._redis_down_until
+
+    def _redis_failed(self, e: Exception):
+        metrics.increment('rag_embedding_cache_errors_total')
+        self._redis_down_until = time.monotonic() + REDIS_RETRY_SECONDS
+        logger.warning(f"Embedding cache: Redis unavailable, retrying in {REDIS_RETRY_SECONDS}s: {e}")
+
+    def _get_shared(self, key: str):
+        """Look up the Redis tier, copying a hit to memory"""
+        if not self._redis_available():
+            return None
+        try:
+            value = registry.get_redis_client().get(key)
+        except Exception as e:
+            self._redis_failed(e)
+            return None
+        if value is None:
+            return None
+
+        vector = np.frombuffer(value, dtype=np.float16).astype(np.float32)
+        vector.flags.writeable = False
+        self._set_memory(key, vector)
+        return vector
+
+    def _set_shared(self, key: str, vector: np.ndarray):
+        if not self._redis_available():
+            return
+        try:
+            registry.get_redis_client().set(key, vector.astype(np.float16).tobytes(), ex=self.ttl)
+        except Exception as e:
+            self._redis_failed(e)
+
+    def _memory_hit(self, key: str):
+        vector = self._get_memory(key)
+        if vector is not None:
+            metrics.increment('rag_embedding_cache_hits_total', tier='memory')
+        return vector
+
+    def _shared_result(self, vector):
+        if vector is not None:
+            metrics.increment('rag_embedding_cache_hits_total', tier='redis')
+        else:
+            metrics.increment('rag_embedding_cache_misses_total')
+        return vector
+
+    def get(self, text: str):
+        """
+        Look up the embedding of a text
+        Returns: read-only float32 vector, or None
+        """
+        if not self.enabled:
+            return None
+        key = self.key(text)
+        vector = self._memory_hit(key)
+        if vector is not None:
+            return vector
+        return self._shared_result(self._get_shared(key))
+
+    def set(self, text: str, vector) -> np.ndarray:
+        """
+        Store the embedding of a text in both tiers
+        Returns: the vector as stored in memory (read-only float32)
+        """
+        vector = np.array(vector, dtype=np.float32)
+        vector.flags.writeable = False
+        if not self.enabled:
+            return vector
+        key = self.key(text)
+        self._set_memory(key, vector)
+        self._set_shared(key, vector)
+        return vector
+
+    async def aget(self, text: str):
+        """Async variant of get(); the Redis round trip runs in the retrieval executor"""
+        if not self.enabled:
+            return None
+        key = self.key(text)
+        vector = self._memory_hit(key)
+        if vector is not None:
+            return vector
+        if not self._redis_available():
+            return self._shared_result(None)
+
+        loop = asyncio.get_running_loop()
+        return self._shared_result(
+            await loop.run_in_executor(registry.get_retrieval_executor(), self._get_shared, key)
+        )
+
+    async def aset(self, text: str, vector) -> np.ndarray:
+        """Async variant of set()"""
+        vector = np.array(vector, dtype=np.float32)
+        vector.flags.writeable = False
+        if not self.enabled:
+            return vector
+        key = self.key(text)
+        self._set_memory(key, vector)
+        if self._redis_available():
+            loop = asyncio.get_running_loop()
+            await loop.run_in_executor(registry.get_retrieval_executor(), self._set_shared, key, vector)
+        return vector
+
+    def clear(self):
+        """Empty the memory tier (the Redis tier expires on its own)"""
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+    @staticmethod
+    def stats() -> dict:
+        """Hit/miss counters of this process"""
+        memory = metrics.get_counter('rag_embedding_cache_hits_total', tier='memory')
+        shared = metrics.get_counter('rag_embedding_cache_hits_total', tier='redis')
+        misses = metrics.get_counter('rag_embedding_cache_misses_total')
+        lookups = memory + shared + misses
+        return {
+            'memory_hits': memory,
+            'redis_hits': shared,
+            'misses': misses,
+            'errors': metrics.get_counter('rag_embedding_cache_errors_total'),
+            'hit_rate': (memory + shared) / lookups if lookups else 0.0,
+            'memory_hit_rate': memory / lookups if lookups else 0.0,
+        }
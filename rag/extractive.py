@@ -0,0 +1,141 @@
+from django.conf import settings
+from .lexical_index import tokenize
+from .prompt_builder import split_sentences, sentence_similarities
+import numpy as np
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Question words that rarely appear in the sentence answering the question
+QUESTION_WORDS = frozenset(
+    'can could did do does get i me my our please tell us we would'.split()
+)
+
+# Shorter best sentences ("Contact us:") are extended with the next one
+MIN_SPAN_CHARS = 60
+
+# Results searched for a span in degraded mode
+DEGRADED_RESULTS = 3
+
+
+def _stem(term: str) -> str:
+    """Crude plural folding, so "hours" matches "hour\""""
+    return term[:-1] if len(term) > 3 and term.endswith('s') else term
+
+
+def _terms(text: str) -> set:
+    return {_stem(term) for term in tokenize(text) if term not in QUESTION_WORDS}
+
+
+def term_coverage(query: str, sentence: str) -> float:
+    """Share of the question's terms found in a sentence (1.0 without terms)"""
+    query_terms = _terms(query)
+    if not query_terms:
+        return 1.0
+    return len(query_terms & _terms(sentence)) / len(query_terms)
+
+
+def _sentence_scores(sentences: list, query_vector, known: dict = None):
+    """
+    Cosine of each sentence with the query; sentences already scored by the
+    prompt build (known) aren't embedded again
+    """
+    if query_vector is None or not sentences:
+        return None
+    known = known or {}
+    missing = [sentence for sentence in dict.fromkeys(sentences) if sentence not in known]
+    scores = dict(known)
+    if missing:
+        missing_scores = sentence_similarities(missing, query_vector)
+        if missing_scores is None:
+            return None
+        scores.update(zip(missing, missing_scores.tolist()))
+    return np.array([scores[sentence] for sentence in sentences], dtype=np.float32)
+
+
+def vector_score(result: dict):
+    """Cosine score of a search result (None for lexical-only hybrid hits)"""
+    return result['vector_score'] if 'vector_score' in result else result.get('score')
+
+
+class ExtractiveAnswerer:
+    """
+    Answers lookups with a span of the top search result, without the LLM
+
+    Questions such as "what are your opening hours" are answered word for
+    word by one passage. The top result is used when:
+
+    - its vector score is at least RAG_EXTRACTIVE_MIN_SCORE
+    - its best sentence has a cosine of at least
+      RAG_EXTRACTIVE_MIN_SENTENCE_SCORE with the query
+    - and contains RAG_EXTRACTIVE_MIN_TERM_COVERAGE of the query's terms
+
+    The span is that sentence, extended with the next one when shorter
+    than MIN_SPAN_CHARS. Sentences are only scored once the top result
+    passes its score check, reusing the scores of the prompt build
+    (PromptBuilder.build's 'sentence_scores'); only sentences it dropped as
+    duplicates are embedded.
+
+    In degraded mode (confident_only off, when Gemini is unavailable) the
+    best sentence of the top DEGRADED_RESULTS results is returned whatever
+    its scores.
+    """
+
+    def __init__(self, min_score: float = None, min_sentence_score: float = None,
+                 min_term_coverage: float = None):
+        self.enabled = settings.RAG_EXTRACTIVE_ENABLED
+        self.min_score = settings.RAG_EXTRACTIVE_MIN_SCORE if min_score is None else min_score
+        self.min_sentence_score = (
+            settings.RAG_EXTRACTIVE_MIN_SENTENCE_SCORE if min_sentence_score is None else min_sentence_score
+        )
+        self.min_term_coverage = (
+            settings.RAG_EXTRACTIVE_MIN_TERM_COVERAGE if min_term_coverage is None else min_term_coverage
+        )
+
+    def find(self, query: str, query_vector, search_results: list, confident_only: bool = True,
+             sentence_scores: dict = None):
+        """
+        Best answer span for a question
+        Returns: dict with 'text', 'title', 'url', 'score', 'sentence_score'
+        and 'term_coverage', or None
+        """
+        if confident_only:
+            if not self.enabled or not search_results:
+                return None
+            score = vector_score(search_results[0])
+            if score is None or score < self.min_score:
+                return None
+            results = search_results[:1]
+        else:
+            results = search_results[:DEGRADED_RESULTS]
+
+        candidates = []
+        for result in results:
+            sentences = split_sentences(result.get('content') or '')
+            candidates.extend((result, sentences, i) for i in range(len(sentences)))
+        scores = _sentence_scores([sentences[i] for _, sentences, i in candidates], query_vector, sentence_scores)
+        if scores is None:
+            return None
+
+        best = int(np.argmax(scores))
+        result, sentences, i = candidates[best]
+        coverage = term_coverage(query, sentences[i])
+        if confident_only and (scores[best] < self.min_sentence_score or coverage < self.min_term_coverage):
+            return None
+
+        text = sentences[i]
+        if len(text) < MIN_SPAN_CHARS and i + 1 < len(sentences):
+            text = f"{text} {sentences[i + 1]}"
+        return {
+            'text': text,
+            'title': result.get('title'),
+            'url': result.get('url'),
+            'score': vector_score(result),
+            'sentence_score': float(scores[best]),
+            'term_coverage': coverage,
+        }
+
+    @staticmethod
+    def format(span: dict) -> str:
+        """Answer text: the span and its source"""
+        return f"{span['text']}\n\nSource: {span['title']} ({span['url']})"
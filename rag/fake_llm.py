@@ -0,0 +1,80 @@
+import asyncio
+import random
+import re
+import time
+
+
+class FakeResponse:
+    """Mimics the parts of a Gemini response the services use"""
+
+    def __init__(self, text: str):
+        self.text = text
+
+
+class ResourceExhausted(Exception):
+    """Mimics google.api_core.exceptions.ResourceExhausted (HTTP 429)"""
+
+    code = 429
+
+
+class FakeGenerativeModel:
+    """
+    Offline stand-in for genai.GenerativeModel
+
+    Answers with the first sentences of the prompt's context, so responses
+    are deterministic and grounded. Selected with GEMINI_BACKEND='fake'.
+
+    To exercise the resilience layer (rag.llm_client), calls can fail with
+    ResourceExhausted at `failure_rate` and take `delay` seconds, plus up to
+    `jitter` more (GEMINI_FAKE_FAILURE_RATE, GEMINI_FAKE_DELAY and
+    GEMINI_FAKE_JITTER).
+    """
+
+    def __init__(self, model_name: str = 'fake', chunk_words: int = 3, delay: float = 0.0,
+                 failure_rate: float = 0.0, jitter: float = 0.0):
+        self.model_name = model_name
+        self.chunk_words = chunk_words
+        self.delay = delay
+        self.failure_rate = failure_rate
+        self.jitter = jitter
+        self.calls = 0
+
+    def _latency(self) -> float:
+        return self.delay + (random.uniform(0, self.jitter) if self.jitter else 0.0)
+
+    def _maybe_fail(self):
+        self.calls += 1
+        if self.failure_rate and random.random() < self.failure_rate:
+            raise ResourceExhausted("429 Resource has been exhausted (fake)")
+
+    def _answer(self, prompt: str) -> str:
+        match = re.search(r'Content: (.+)', prompt)
+        if not match:
+            return "I don't have enough information to answer that."
+        sentences = re.split(r'(?<=[.!?])\s+', match.group(1).strip())
+        return ' '.join(sentences[:2])
+
+    def _stream(self, text: str):
+        words = text.split(' ')
+        for start in range(0, len(words), self.chunk_words):
+            if self.delay:
+                time.sleep(self.delay)
+            piece = ' '.join(words[start:start + self.chunk_words])
+            yield FakeResponse(piece if start == 0 else ' ' + piece)
+
+    def generate_content(self, prompt, stream: bool = False, **kwargs):
+        self._maybe_fail()
+        text = self._answer(str(prompt))
+        if stream:
+            return self._stream(text)
+        latency = self._latency()
+        if latency:
+            time.sleep(latency)
+        return FakeResponse(text)
+
+    async def generate_content_async(self, prompt, **kwargs):
+        latency = self._latency()
+        if latency:
+            await asyncio.sleep(latency)
+        self._maybe_fail()
+        return FakeResponse(self._answer(str(prompt)))
@@ -1,5 +1,9 @@
-import google.generativeai as genai
 from django.conf import settings
+from .registry import registry
+from .llm_client import LLMUnavailableError
+from .prompt_builder import count_tokens
+from . import tracing
+import time
 import logging
 
 logger = logging.getLogger(__name__)
@@ -8,60 +12,153 @@ logger = logging.getLogger(__name__)
 class GeminiService:
     """
     Service to interact with Google Gemini API
+
+    Calls go through the process-wide resilient client (concurrency and
+    rate limits, retries, circuit breaker; see rag.llm_client). When Gemini
+    can't answer, LLMUnavailableError is raised and the caller picks a
+    fallback; error text is never returned as an answer.
     """
     
     def __init__(self):
-        # Configure Gemini
-        genai.configure(api_key=settings.GEMINI_API_KEY)
-        
-        # Use gemini-2.5-flash (free tier model)
-        self.model = genai.GenerativeModel('gemini-2.5-flash')
-        logger.info("Initialized Gemini API with gemini-2.5-flash")
+        # Shared client around the configured model (gemini-2.5-flash by default)
+        self.client = registry.get_llm_client()
+    
+    @staticmethod
+    def build_prompt(query: str, context: str, history: str = '') -> str:
+        """Wrap the user's question, the conversation so far and the retrieved context in the RAG template"""
+        conversation = f"Conversation so far:\n{history}\n\n" if history else ''
+        return f"""You are a helpful AI assistant. Answer the user's question based on the following context.
+
+Context:
+{context}
+
+{conversation}User Question: {query}
+
+Please provide a clear and accurate answer based on the context provided. If the context doesn't contain relevant information, politely say so.
+
+Answer:"""
     
-    def generate_response(self, query: str, context: str) -> str:
+    def generate_response(self, query: str, context: str, history: str = '') -> str:
         """
         Generate response using Gemini with RAG context
         
         Args:
             query: User's question
             context: Retrieved context from vector DB
+            history: Conversation memory (summary and recent turns)
         
         Returns:
             AI-generated response
+        
+        Raises:
+            LLMUnavailableError: Gemini failed or is unavailable
         """
+        # Create prompt with context
+        prompt = self.build_prompt(query, context, history)
+        
+        logger.info(f"Generating response for query: {query[:50]}...")
+        
         try:
-            # Create prompt with context
-            prompt = f"""You are a helpful AI assistant. Answer the user's question based on the following context.
+            with tracing.span('llm', prompt_tokens=count_tokens(prompt)) as span:
+                response = self.client.generate(prompt)
+                span.set(response_tokens=count_tokens(response))
+        except LLMUnavailableError as e:
+            logger.error(f"Error generating response with Gemini: {e}")
+            raise
+        
+        logger.info("Successfully generated response with Gemini")
+        return response
+    
+    async def agenerate_response(self, query: str, context: str, history: str = '') -> str:
+        """
+        Async variant of generate_response(); awaits Gemini without
+        holding a worker thread
+        """
+        prompt = self.build_prompt(query, context, history)
+        logger.info(f"Generating response for query: {query[:50]}...")
+        
+        try:
+            with tracing.span('llm', prompt_tokens=count_tokens(prompt)) as span:
+                response = await self.client.agenerate(prompt)
+                span.set(response_tokens=count_tokens(response))
+        except LLMUnavailableError as e:
+            logger.error(f"Error generating response with Gemini: {e}")
+            raise
+        
+        logger.info("Successfully generated response with Gemini")
+        return response
+    
+    def stream_response(self, query: str, context: str, history: str = ''):
+        """
+        Generate response using Gemini with RAG context, chunk by chunk
+        
+        Yields: pieces of the AI-generated response as they arrive
+        Raises: LLMUnavailableError (possibly after some pieces)
+        """
+        prompt = self.build_prompt(query, context, history)
+        logger.info(f"Streaming response for query: {query[:50]}...")
+        started_at = time.perf_counter()
+        
+        try:
+            with tracing.span('llm', prompt_tokens=count_tokens(prompt)) as span:
+                pieces = []
+                for piece in self.client.stream(prompt):
+                    if not pieces:
+                        span.set(first_piece_ms=round((time.perf_counter() - started_at) * 1000, 2))
+                    pieces.append(piece)
+                    yield piece
+                span.set(response_tokens=count_tokens(''.join(pieces)))
+        except LLMUnavailableError as e:
+            logger.error(f"Error streaming response with Gemini: {e}")
+            raise
+        
+        logger.info("Successfully streamed response with Gemini")
+    
+    def summarize_conversation(self, summary: str, turns: list) -> str:
+        """
+        Fold chat turns into the rolling conversation summary
+        
+        Args:
+            summary: Summary of the turns before these (may be empty)
+            turns: list of (user_message, bot_response), oldest first
+        
+        Returns:
+            The updated summary (raises on errors, so the task retries)
+        """
+        transcript = "\n".join(
+            f"User: {user_message}\nAssistant: {bot_response}" for user_message, bot_response in turns
+        )
+        prompt = f"""Update the summary of a conversation between a user and a website assistant with the new messages.
+Keep the facts, names and open questions that later questions may refer to. Answer with the summary only, in at most {settings.RAG_MEMORY_SUMMARY_CHARS // 6} words.
 
-Context:
-{context}
+Current summary:
+{summary or '(none)'}
 
-User Question: {query}
+New messages:
+{transcript}
 
-Please provide a clear and accurate answer based on the context provided. If the context doesn't contain relevant information, politely say so.
+Updated summary:"""
+        # Off the request path: no need to spend quota on hedges
+        return self.client.generate(prompt, hedge=False).strip()
+    
+    def rewrite_query(self, query: str, history: str) -> str:
+        """
+        Rewrite a follow-up question into a standalone search query
+        using the conversation memory (raises on errors)
+        """
+        prompt = f"""Rewrite the user's last question as a standalone search query, resolving references to the conversation. Answer with the query only.
 
-Answer:"""
-            
-            logger.info(f"Generating response for query: {query[:50]}...")
-            
-            # Generate response
-            response = self.model.generate_content(prompt)
-            
-            logger.info("Successfully generated response with Gemini")
-            return response.text
-            
-        except Exception as e:
-            logger.error(f"Error generating response with Gemini: {str(e)}", exc_info=True)
-            return f"I apologize, but I encountered an error: {str(e)}"
+Conversation so far:
+{history}
+
+Last question: {query}
+
+Standalone query:"""
+        return self.client.generate(prompt).strip()
     
     def generate_simple_response(self, query: str) -> str:
         """
-        Generate response without context (fallback)
+        Generate response without context (raises LLMUnavailableError)
         """
-        try:
-            logger.info("Generating simple response without context")
-            response = self.model.generate_content(query)
-            return response.text
-        except Exception as e:
-            logger.error(f"Error generating simple response: {str(e)}", exc_info=True)
-            return f"I apologize, but I encountered an error: {str(e)}"
\ No newline at end of file
+        logger.info("Generating simple response without context")
+        return self.client.generate(query)
@@ -0,0 +1,117 @@
+from django.conf import settings
+from .lexical_index import LexicalIndex
+from .registry import registry
+from . import metrics, tracing
+import asyncio
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Websites whose missing BM25 index was already reported by this process
+_missing_indexes = set()
+
+
+def reciprocal_rank_fusion(result_lists: list, limit: int, k: int = 60) -> list:
+    """
+    Merge ranked result lists with reciprocal rank fusion
+
+    Each result scores sum(1 / (k + rank)) over the lists it appears in.
+    The fused score is returned as 'score'; the leg scores are kept as
+    'vector_score' and 'lexical_score'.
+    """
+    fused = {}
+    for leg, results in result_lists:
+        for rank, result in enumerate(results, 1):
+            entry = fused.get(result['id'])
+            if entry is None:
+                entry = dict(result, score=0.0, vector_score=None, lexical_score=None)
+                fused[result['id']] = entry
+            entry[f'{leg}_score'] = result['score']
+            entry['score'] += 1.0 / (k + rank)
+    return sorted(fused.values(), key=lambda result: result['score'], reverse=True)[:limit]
+
+
+class HybridRetriever:
+    """
+    Dense (Qdrant) + lexical (BM25) retrieval for one website
+
+    Both legs over-fetch RAG_HYBRID_CANDIDATES (at least `limit`) results and run concurrently,
+    so the hybrid search costs about as much as the slower leg.
+    """
+
+    def __init__(self, qdrant, website_id: int):
+        self.qdrant = qdrant
+        self.website_id = website_id
+        self.candidates = settings.RAG_HYBRID_CANDIDATES
+
+    def _lexical_search(self, query: str, candidates: int) -> list:
+        with tracing.span('lexical_search', limit=candidates) as span:
+            if not LexicalIndex.exists(self.website_id):
+                self._report_missing_index()
+            try:
+                results = LexicalIndex.load(self.website_id).search(query, limit=candidates)
+            except Exception as e:
+                logger.error(f"Error searching lexical index: {e}")
+                results = []
+            span.set(results=len(results))
+        return results
+
+    def _report_missing_index(self):
+        """
+        The lexical leg finds nothing without the index file, e.g. when the
+        ingest workers that write it run on another host
+        """
+        metrics.increment('rag_lexical_index_missing_total')
+        if self.website_id not in _missing_indexes:
+            _missing_indexes.add(self.website_id)
+            logger.warning(
+                f"No BM25 index for website {self.website_id} in {settings.RAG_LEXICAL_INDEX_DIR}: "
+                f"hybrid search falls back to the vector leg (RAG_HYBRID_ENABLED needs the index "
+                f"on this host; rebuild it with manage.py build_lexical_index)"
+            )
+
+    def search(self, query: str, limit: int = 3, query_vector=None) -> tuple:
+        """
+        Run both legs in parallel and fuse their rankings
+        Returns: (fused results, query embedding)
+        """
+        candidates = max(self.candidates, limit)
+        lexical_future = registry.get_retrieval_executor().submit(
+            tracing.in_context(self._lexical_search), query, candidates
+        )
+        if query_vector is None:
+            query_vector = self.qdrant.generate_embedding(query)
+        vector_results = self.qdrant.search(
+            query,
+            limit=candidates,
+            website_id=self.website_id,
+            query_vector=query_vector
+        )
+        lexical_results = lexical_future.result()
+        fused = reciprocal_rank_fusion(
+            [('vector', vector_results), ('lexical', lexical_results)], limit
+        )
+        return fused, query_vector
+
+    async def asearch(self, query: str, limit: int = 3, query_vector=None) -> tuple:
+        """Async variant of search()"""
+        candidates = max(self.candidates, limit)
+        loop = asyncio.get_running_loop()
+        lexical_future = loop.run_in_executor(
+            registry.get_retrieval_executor(), tracing.in_context(self._lexical_search), query, candidates
+        )
+        if query_vector is None:
+            query_vector = await self.qdrant.agenerate_embedding(query)
+        vector_results, lexical_results = await asyncio.gather(
+            self.qdrant.asearch(
+                query,
+                limit=candidates,
+                website_id=self.website_id,
+                query_vector=query_vector
+            ),
+            lexical_future,
+        )
+        fused = reciprocal_rank_fusion(
+            [('vector', vector_results), ('lexical', lexical_results)], limit
+        )
+        return fused, query_vector
@@ -0,0 +1,191 @@
+from django.conf import settings
+from contextlib import contextmanager
+from collections import Counter
+from pathlib import Path
+from .chunking import chunk_page
+import fcntl
+import math
+import os
+import pickle
+import re
+import threading
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Keeps identifiers such as "err_404", "x-200" or "v2.1" as single terms
+_TERM_RE = re.compile(r'\w+(?:[-.]\w+)*')
+
+STOPWORDS = frozenset(
+    'a an and are as at be by for from has have how i in is it its of on or '
+    'that the this to was were what when where which who why will with you your'.split()
+)
+
+# website_id -> (mtime, LexicalIndex); reloaded when the file changes
+_loaded = {}
+_loaded_lock = threading.Lock()
+
+
+def tokenize(text: str) -> list:
+    """Lowercase terms of a text, without stopwords"""
+    return [term for term in _TERM_RE.findall(text.lower()) if term not in STOPWORDS]
+
+
+class LexicalIndex:
+    """
+    BM25 inverted index over one website's chunks
+
+    Documents are the same chunks (and chunk IDs) as the vector index, so
+    results of both can be fused. The index is updated incrementally per
+    page and persisted as a pickle file under RAG_LEXICAL_INDEX_DIR, which
+    the web processes must be able to read (single host or shared disk).
+    """
+
+    k1 = 1.5
+    b = 0.75
+
+    def __init__(self, website_id: int):
+        self.website_id = website_id
+        self.postings = {}      # term -> {chunk_id: term frequency}
+        self.documents = {}     # chunk_id -> {'length', 'terms', 'result'}
+        self.page_chunks = {}   # page_id -> [chunk_id]
+        self.total_length = 0
+
+    @staticmethod
+    def path_for(website_id: int) -> Path:
+        return Path(settings.RAG_LEXICAL_INDEX_DIR) / f"website_{website_id}.pkl"
+
+    @classmethod
+    def exists(cls, website_id: int) -> bool:
+        return cls.path_for(website_id).exists()
+
+    @classmethod
+    def load(cls, website_id: int, fresh: bool = False) -> 'LexicalIndex':
+        """
+        Return the website's index, reusing the in-process copy when the
+        file is unchanged (unless fresh is set, e.g. to modify it)
+        """
+        path = cls.path_for(website_id)
+        try:
+            mtime = path.stat().st_mtime_ns
+        except FileNotFoundError:
+            return cls(website_id)
+
+        with _loaded_lock:
+            cached = _loaded.get(website_id)
+            if cached and cached[0] == mtime and not fresh:
+                return cached[1]
+
+        with open(path, 'rb') as index_file:
+            index = pickle.load(index_file)
+        if not fresh:
+            with _loaded_lock:
+                _loaded[website_id] = (mtime, index)
+        return index
+
+    @classmethod
+    @contextmanager
+    def update(cls, website_id: int):
+        """
+        Load, modify and save a website's index under an exclusive file lock
+        (ingest tasks for the same website may run in parallel)
+        """
+        path = cls.path_for(website_id)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with open(f"{path}.lock", 'w') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                index = cls.load(website_id, fresh=True)
+                yield index
+                index.save()
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def save(self):
+        """Atomically write the index file"""
+        path = self.path_for(self.website_id)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'wb') as index_file:
+            pickle.dump(self, index_file, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, path)
+        with _loaded_lock:
+            _loaded[self.website_id] = (path.stat().st_mtime_ns, self)
+
+    def remove_pages(self, page_ids: list):
+        """Drop every chunk of the given pages"""
+        for page_id in page_ids:
+            for chunk_id in self.page_chunks.pop(page_id, []):
+                document = self.documents.pop(chunk_id, None)
+                if document is None:
+                    continue
+                self.total_length -= document['length']
+                for term in document['terms']:
+                    postings = self.postings.get(term)
+                    if postings is not None:
+                        postings.pop(chunk_id, None)
+                        if not postings:
+                            del self.postings[term]
+
+    def add_documents(self, documents: list):
+        """
+        Index (or re-index) pages
+
+        Args:
+            documents: list of dicts with 'page_id', 'url', 'title' and 'content'
+        """
+        self.remove_pages([document['page_id'] for document in documents])
+        for document in documents:
+            chunks = chunk_page(
+                document['page_id'],
+                document['url'],
+                document['title'],
+                document['content'],
+                website_id=self.website_id,
+            )
+            self.page_chunks[document['page_id']] = [chunk['id'] for chunk in chunks]
+            for chunk in chunks:
+                terms = Counter(tokenize(f"{document['title']} {chunk['text']}"))
+                length = sum(terms.values())
+                payload = chunk['payload']
+                self.documents[chunk['id']] = {
+                    'length': length,
+                    'terms': list(terms),
+                    'result': {
+                        'id': chunk['id'],
+                        'page_id': payload['page_id'],
+                        'website_id': payload['website_id'],
+                        'url': payload['url'],
+                        'title': payload['title'],
+                        'content': payload['content'],
+                        'chunk_index': payload['chunk_index'],
+                    },
+                }
+                self.total_length += length
+                for term, frequency in terms.items():
+                    self.postings.setdefault(term, {})[chunk['id']] = frequency
+
+    def search(self, query: str, limit: int = 10) -> list:
+        """
+        Rank chunks with BM25
+        Returns: list of result dicts (same shape as QdrantService.search) with scores
+        """
+        if not self.documents:
+            return []
+
+        document_count = len(self.documents)
+        average_length = self.total_length / document_count or 1
+        scores = Counter()
+        for term in set(tokenize(query)):
+            postings = self.postings.get(term)
+            if not postings:
+                continue
+            idf = math.log(1 + (document_count - len(postings) + 0.5) / (len(postings) + 0.5))
+            for chunk_id, frequency in postings.items():
+                length = self.documents[chunk_id]['length']
+                norm = frequency + self.k1 * (1 - self.b + self.b * length / average_length)
+                scores[chunk_id] += idf * frequency * (self.k1 + 1) / norm
+
+        return [
+            dict(self.documents[chunk_id]['result'], score=score)
+            for chunk_id, score in scores.most_common(limit)
+        ]
@@ -0,0 +1,601 @@
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait as wait_futures
+from collections import deque
+from django.conf import settings
+from .registry import registry
+from . import metrics
+import asyncio
+import math
+import queue
+import random
+import threading
+import time
+import uuid
+import logging
+
+logger = logging.getLogger(__name__)
+
+# google.api_core exceptions worth retrying: rate limits, overload, timeouts
+TRANSIENT_ERRORS = {
+    'ResourceExhausted', 'TooManyRequests', 'ServiceUnavailable', 'InternalServerError',
+    'DeadlineExceeded', 'GatewayTimeout', 'Aborted',
+}
+
+# After a Redis error the cluster-wide limits are skipped for this long
+REDIS_RETRY_SECONDS = 30
+# Wait between attempts at a free concurrency slot
+SLOT_POLL_SECONDS = 0.02
+# Successful call latencies kept for the hedging deadline (p95)
+LATENCY_WINDOW = 200
+MIN_LATENCY_SAMPLES = 20
+# Put on a stream's queue after its last piece
+_STREAM_END = object()
+
+# Sorted set of slot holders scored by start time; expired leases are dropped
+_SEMAPHORE_ACQUIRE = """
+redis.call('ZREMRANGEBYSCORE', KEYS[1], '-inf', tonumber(ARGV[1]) - tonumber(ARGV[2]))
+if redis.call('ZCARD', KEYS[1]) < tonumber(ARGV[3]) then
+    redis.call('ZADD', KEYS[1], ARGV[1], ARGV[4])
+    redis.call('EXPIRE', KEYS[1], math.ceil(tonumber(ARGV[2])))
+    return 1
+end
+return 0
+"""
+
+# Token bucket in a hash; returns the seconds to wait (0: token taken)
+_BUCKET_TAKE = """
+local now = tonumber(ARGV[1])
+local rate = tonumber(ARGV[2])
+local capacity = tonumber(ARGV[3])
+local tokens = tonumber(redis.call('HGET', KEYS[1], 'tokens'))
+local updated = tonumber(redis.call('HGET', KEYS[1], 'updated'))
+if tokens == nil or updated == nil then
+    tokens = capacity
+    updated = now
+end
+tokens = math.min(capacity, tokens + math.max(0, now - updated) * rate)
+local wait = 0
+if tokens >= 1 then
+    tokens = tokens - 1
+else
+    wait = (1 - tokens) / rate
+end
+redis.call('HSET', KEYS[1], 'tokens', tokens, 'updated', now)
+redis.call('EXPIRE', KEYS[1], math.ceil(capacity / rate) + 1)
+return tostring(wait)
+"""
+
+
+class LLMUnavailableError(Exception):
+    """
+    The model gave no answer: the circuit breaker is open, no slot or rate
+    token was free within GEMINI_QUEUE_TIMEOUT, or every attempt failed
+
+    Attributes:
+        reason: 'circuit_open', 'overloaded' or 'failed'
+    """
+
+    def __init__(self, reason: str, message: str):
+        super().__init__(message)
+        self.reason = reason
+
+
+def is_transient(error: Exception) -> bool:
+    """Whether a failed call is worth retrying (and counts against the breaker)"""
+    return isinstance(error, (TimeoutError, ConnectionError)) or type(error).__name__ in TRANSIENT_ERRORS
+
+
+class _RedisShared:
+    """Cluster-wide state in Redis, skipped for a while after an error"""
+
+    def __init__(self, redis_enabled: bool = None):
+        self.redis_enabled = settings.GEMINI_LIMITER_REDIS_ENABLED if redis_enabled is None else redis_enabled
+        self._redis_down_until = 0.0
+
+    def _redis(self):
+        if not self.redis_enabled or time.monotonic() < self._redis_down_until:
+            return None
+        return registry.get_redis_client()
+
+    def _redis_failed(self, e: Exception):
+        metrics.increment('rag_llm_limiter_errors_total')
+        self._redis_down_until = time.monotonic() + REDIS_RETRY_SECONDS
+        logger.warning(
+            f"{type(self).__name__}: Redis unavailable, limiting this process only "
+            f"for {REDIS_RETRY_SECONDS}s: {e}"
+        )
+
+
+class ConcurrencyLimiter(_RedisShared):
+    """
+    Caps in-flight calls per process and, through a Redis semaphore, across
+    the cluster
+
+    Cluster slots are leases that expire after `lease` seconds, so a
+    crashed process can't hold one forever. A cluster limit of 0 disables
+    the Redis semaphore.
+    """
+
+    def __init__(self, limit: int, cluster_limit: int = 0, lease: float = 60, key: str = 'rag:llm:slots'):
+        super().__init__()
+        self.limit = limit
+        self.cluster_limit = cluster_limit
+        self.lease = lease
+        self.key = key
+        self._active = 0
+        self._lock = threading.Lock()
+
+    @property
+    def active(self) -> int:
+        return self._active
+
+    def try_acquire(self):
+        """
+        Take a slot without waiting
+        Returns: a permit for release() ('' when only held locally), or None
+        """
+        with self._lock:
+            if self._active >= self.limit:
+                return None
+            self._active += 1
+
+        client = self._redis() if self.cluster_limit else None
+        if client is None:
+            return ''
+        permit = uuid.uuid4().hex
+        try:
+            acquired = client.register_script(_SEMAPHORE_ACQUIRE)(
+                keys=[self.key], args=[time.time(), self.lease, self.cluster_limit, permit]
+            )
+        except Exception as e:
+            self._redis_failed(e)
+            return ''
+        if not acquired:
+            self.release('')
+            return None
+        return permit
+
+    def release(self, permit: str):
+        with self._lock:
+            self._active -= 1
+        if permit:
+            try:
+                registry.get_redis_client().zrem(self.key, permit)
+            except Exception as e:
+                # The lease expires on its own
+                logger.warning(f"Error releasing cluster slot: {e}")
+
+
+class TokenBucket(_RedisShared):
+    """
+    Request rate limiter: `per_minute` tokens a minute, bursts of up to
+    `burst`, shared by the cluster in Redis (per process while Redis is
+    unavailable). A rate of 0 disables it. Also keeps the crawler's
+    per-host limit (scraper.crawler).
+    """
+
+    def __init__(self, per_minute: float, burst: int, key: str = 'rag:llm:bucket', redis_enabled: bool = None):
+        super().__init__(redis_enabled)
+        self.rate = per_minute / 60
+        self.capacity = max(burst, 1)
+        self.key = key
+        self._tokens = float(self.capacity)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def take(self) -> float:
+        """
+        Take a token if one is available
+        Returns: 0 when taken, else the seconds until the next token
+        """
+        if not self.rate:
+            return 0.0
+
+        client = self._redis()
+        if client is not None:
+            try:
+                return float(client.register_script(_BUCKET_TAKE)(
+                    keys=[self.key], args=[time.time(), self.rate, self.capacity]
+                ))
+            except Exception as e:
+                self._redis_failed(e)
+
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return 0.0
+            return (1 - self._tokens) / self.rate
+
+
+class CircuitBreaker:
+    """
+    Stops calling a failing dependency
+
+    Opens after `failure_threshold` consecutive transient failures; while
+    open every call fails fast. After `reset_seconds` one trial call is let
+    through (half-open): a success closes the breaker, a failure keeps it
+    open for another period.
+    """
+
+    def __init__(self, failure_threshold: int, reset_seconds: float, name: str = 'gemini'):
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.name = name
+        self._failures = 0
+        self._opened_at = None
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        if self._opened_at is None:
+            return 'closed'
+        if time.monotonic() - self._opened_at < self.reset_seconds:
+            return 'open'
+        return 'half_open'
+
+    def allow(self) -> bool:
+        """Whether a call may go ahead (claims the trial call when half-open)"""
+        with self._lock:
+            if self._opened_at is None:
+                return True
+            now = time.monotonic()
+            if now - self._opened_at < self.reset_seconds:
+                return False
+            self._opened_at = now
+            return True
+
+    def record_success(self):
+        with self._lock:
+            if self._opened_at is not None:
+                logger.info(f"Circuit breaker {self.name} closed")
+            self._failures = 0
+            self._opened_at = None
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self._opened_at is None and self._failures < self.failure_threshold:
+                return
+            if self._opened_at is None:
+                metrics.increment('rag_llm_circuit_opened_total')
+                logger.warning(
+                    f"Circuit breaker {self.name} opened after {self._failures} failures, "
+                    f"failing fast for {self.reset_seconds}s"
+                )
+            self._opened_at = time.monotonic()
+
+
+class LatencyTracker:
+    """Recent successful call latencies, for the hedging deadline"""
+
+    def __init__(self, window: int = LATENCY_WINDOW):
+        self._samples = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def add(self, seconds: float):
+        with self._lock:
+            self._samples.append(seconds)
+
+    def percentile(self, q: float):
+        """Latency at quantile q (0-1), or None with too few samples"""
+        with self._lock:
+            samples = sorted(self._samples)
+        if len(samples) < MIN_LATENCY_SAMPLES:
+            return None
+        return samples[min(len(samples) - 1, math.ceil(q * len(samples)) - 1)]
+
+
+class ResilientLLMClient:
+    """
+    Guarded calls to a generative model (genai.GenerativeModel or the fake)
+
+    Every attempt needs a concurrency slot (GEMINI_MAX_CONCURRENCY per
+    process, GEMINI_CLUSTER_MAX_CONCURRENCY across the cluster) and a token
+    of the GEMINI_RATE_LIMIT_RPM bucket; callers wait for both up to
+    GEMINI_QUEUE_TIMEOUT. Then:
+
+    - attempts time out after GEMINI_TIMEOUT seconds (streams: waiting for
+      the first piece or for the next one)
+    - transient errors (429, 5xx, timeouts) are retried up to
+      GEMINI_MAX_RETRIES times with full-jitter exponential backoff
+    - with GEMINI_HEDGE_ENABLED, a second request is sent when the first
+      one is slower than the p95 latency (GEMINI_HEDGE_MIN_DELAY until
+      enough samples) and a slot and token are free; the first answer wins
+    - a circuit breaker fails fast after GEMINI_BREAKER_FAILURES
+      consecutive transient failures
+
+    Failures raise LLMUnavailableError; callers choose the fallback.
+
+    Metrics: rag_llm_requests_total (by outcome), rag_llm_retries_total,
+    rag_llm_hedges_total (by winner), rag_llm_seconds histogram.
+    """
+
+    def __init__(self, model):
+        self.model = model
+        prefix = f"rag:llm:{settings.GEMINI_MODEL_NAME}"
+        self.limiter = ConcurrencyLimiter(
+            settings.GEMINI_MAX_CONCURRENCY,
+            settings.GEMINI_CLUSTER_MAX_CONCURRENCY,
+            lease=settings.GEMINI_TIMEOUT * 2,
+            key=f"{prefix}:slots",
+        )
+        self.bucket = TokenBucket(
+            settings.GEMINI_RATE_LIMIT_RPM, settings.GEMINI_RATE_LIMIT_BURST, key=f"{prefix}:bucket"
+        )
+        self.breaker = CircuitBreaker(settings.GEMINI_BREAKER_FAILURES, settings.GEMINI_BREAKER_RESET_SECONDS)
+        self.latencies = LatencyTracker()
+        # Blocking calls run here so they can time out and be hedged;
+        # each one holds a slot, so the limiter bounds the threads in use
+        self.executor = ThreadPoolExecutor(
+            max_workers=settings.GEMINI_MAX_CONCURRENCY, thread_name_prefix='rag-llm'
+        )
+
+    # Admission
+
+    def _admit_once(self):
+        """
+        One try at a concurrency slot and a rate token
+        Returns: (permit, 0) when admitted, else (None, seconds to wait)
+        """
+        permit = self.limiter.try_acquire()
+        if permit is None:
+            return None, SLOT_POLL_SECONDS
+        wait = self.bucket.take()
+        if wait:
+            self.limiter.release(permit)
+            return None, wait
+        return permit, 0
+
+    def _overloaded(self):
+        metrics.increment('rag_llm_requests_total', outcome='overloaded')
+        return LLMUnavailableError(
+            'overloaded', f"No Gemini capacity within {settings.GEMINI_QUEUE_TIMEOUT}s"
+        )
+
+    def _admit(self):
+        deadline = time.monotonic() + settings.GEMINI_QUEUE_TIMEOUT
+        while True:
+            permit, wait = self._admit_once()
+            if permit is not None:
+                return permit
+            if time.monotonic() + wait > deadline:
+                raise self._overloaded()
+            time.sleep(wait)
+
+    async def _aadmit(self):
+        loop = asyncio.get_running_loop()
+        deadline = time.monotonic() + settings.GEMINI_QUEUE_TIMEOUT
+        while True:
+            # Redis round trips stay off the event loop
+            permit, wait = await loop.run_in_executor(registry.get_retrieval_executor(), self._admit_once)
+            if permit is not None:
+                return permit
+            if time.monotonic() + wait > deadline:
+                raise self._overloaded()
+            await asyncio.sleep(wait)
+
+    # Retries and the breaker
+
+    def _check_breaker(self):
+        if not self.breaker.allow():
+            metrics.increment('rag_llm_requests_total', outcome='circuit_open')
+            raise LLMUnavailableError('circuit_open', "Gemini circuit breaker is open")
+
+    def _retry_delay(self, attempt: int) -> float:
+        """Full jitter: uniform between 0 and the exponential backoff"""
+        return random.uniform(
+            0, min(settings.GEMINI_RETRY_MAX_DELAY, settings.GEMINI_RETRY_BASE_DELAY * 2 ** attempt)
+        )
+
+    def _failed(self, error: Exception, attempt: int) -> bool:
+        """
+        Record a failed attempt
+        Returns: whether to retry
+        """
+        if not is_transient(error):
+            # The request itself is at fault; says nothing about the service
+            return False
+        self.breaker.record_failure()
+        logger.warning(f"Gemini attempt {attempt + 1} failed: {type(error).__name__}: {error}")
+        return attempt < settings.GEMINI_MAX_RETRIES
+
+    def _succeeded(self, started_at: float):
+        self.breaker.record_success()
+        metrics.increment('rag_llm_requests_total', outcome='ok')
+        metrics.observe('rag_llm_seconds', time.monotonic() - started_at)
+
+    def _give_up(self, error: Exception):
+        metrics.increment('rag_llm_requests_total', outcome='failed')
+        return LLMUnavailableError('failed', f"Gemini call failed: {type(error).__name__}: {error}")
+
+    def hedge_delay(self) -> float:
+        p95 = self.latencies.percentile(0.95)
+        return max(p95 or 0.0, settings.GEMINI_HEDGE_MIN_DELAY)
+
+    # Blocking calls
+
+    def _submit(self, prompt, permit):
+        def call():
+            started_at = time.monotonic()
+            try:
+                text = self.model.generate_content(prompt).text
+            finally:
+                self.limiter.release(permit)
+            self.latencies.add(time.monotonic() - started_at)
+            return text
+        return self.executor.submit(call)
+
+    def _attempt(self, prompt, hedge: bool) -> str:
+        started_at = time.monotonic()
+        deadline = started_at + settings.GEMINI_TIMEOUT
+        primary = self._submit(prompt, self._admit())
+        pending = {primary}
+
+        hedged = False
+        if hedge:
+            done, _ = wait_futures(pending, timeout=min(self.hedge_delay(), settings.GEMINI_TIMEOUT))
+            if not done:
+                permit, _ = self._admit_once()
+                if permit is not None:
+                    pending.add(self._submit(prompt, permit))
+                    hedged = True
+
+        error = None
+        while pending:
+            done, pending = wait_futures(
+                pending, timeout=max(deadline - time.monotonic(), 0), return_when=FIRST_COMPLETED
+            )
+            if not done:
+                break
+            for future in done:
+                if future.exception() is None:
+                    if hedged:
+                        metrics.increment('rag_llm_hedges_total', winner='primary' if future is primary else 'hedge')
+                    return future.result()
+                error = future.exception()
+        # Slow calls keep running in the executor and free their slots when done
+        raise error or TimeoutError(f"No answer within {settings.GEMINI_TIMEOUT}s")
+
+    def generate(self, prompt, hedge: bool = None) -> str:
+        """
+        Generate text for a prompt
+        Raises: LLMUnavailableError
+        """
+        hedge = settings.GEMINI_HEDGE_ENABLED if hedge is None else hedge
+        started_at = time.monotonic()
+        for attempt in range(settings.GEMINI_MAX_RETRIES + 1):
+            self._check_breaker()
+            try:
+                text = self._attempt(prompt, hedge)
+            except LLMUnavailableError:
+                raise
+            except Exception as e:
+                if not self._failed(e, attempt):
+                    raise self._give_up(e) from e
+                metrics.increment('rag_llm_retries_total')
+                time.sleep(self._retry_delay(attempt))
+                continue
+            self._succeeded(started_at)
+            return text
+
+    def _submit_stream(self, prompt, permit, pieces: queue.Queue, cancelled: threading.Event):
+        def pull():
+            try:
+                for chunk in self.model.generate_content(prompt, stream=True):
+                    if cancelled.is_set():
+                        return
+                    if chunk.text:
+                        pieces.put(chunk.text)
+                pieces.put(_STREAM_END)
+            except Exception as e:
+                pieces.put(e)
+            finally:
+                self.limiter.release(permit)
+        self.executor.submit(pull)
+
+    def stream(self, prompt):
+        """
+        Generate text for a prompt piece by piece
+        Each piece must arrive within GEMINI_TIMEOUT of the previous one (or
+        of the start). Retried only until the first piece arrives (no hedging).
+        Raises: LLMUnavailableError
+        """
+        started_at = time.monotonic()
+        for attempt in range(settings.GEMINI_MAX_RETRIES + 1):
+            self._check_breaker()
+            pieces = queue.Queue()
+            cancelled = threading.Event()
+            self._submit_stream(prompt, self._admit(), pieces, cancelled)
+            yielded = False
+            try:
+                while True:
+                    try:
+                        piece = pieces.get(timeout=settings.GEMINI_TIMEOUT)
+                    except queue.Empty:
+                        raise TimeoutError(f"No streamed piece within {settings.GEMINI_TIMEOUT}s") from None
+                    if piece is _STREAM_END:
+                        break
+                    if isinstance(piece, Exception):
+                        raise piece
+                    yielded = True
+                    yield piece
+            except Exception as e:
+                # Pieces already sent can't be taken back
+                if not self._failed(e, attempt) or yielded:
+                    raise self._give_up(e) from e
+            else:
+                self._succeeded(started_at)
+                return
+            finally:
+                # A stalled or abandoned stream stops at its next piece and
+                # frees its slot when the call returns
+                cancelled.set()
+            metrics.increment('rag_llm_retries_total')
+            time.sleep(self._retry_delay(attempt))
+
+    # Async calls
+
+    async def _acall(self, prompt, permit) -> str:
+        started_at = time.monotonic()
+        try:
+            response = await self.model.generate_content_async(prompt)
+        finally:
+            self.limiter.release(permit)
+        self.latencies.add(time.monotonic() - started_at)
+        return response.text
+
+    async def _aattempt(self, prompt, hedge: bool) -> str:
+        deadline = time.monotonic() + settings.GEMINI_TIMEOUT
+        primary = asyncio.ensure_future(self._acall(prompt, await self._aadmit()))
+        pending = {primary}
+        try:
+            hedged = False
+            if hedge:
+                done, _ = await asyncio.wait(pending, timeout=min(self.hedge_delay(), settings.GEMINI_TIMEOUT))
+                if not done:
+                    permit, _ = await asyncio.get_running_loop().run_in_executor(
+                        registry.get_retrieval_executor(), self._admit_once
+                    )
+                    if permit is not None:
+                        pending.add(asyncio.ensure_future(self._acall(prompt, permit)))
+                        hedged = True
+
+            error = None
+            while pending:
+                done, pending = await asyncio.wait(
+                    pending, timeout=max(deadline - time.monotonic(), 0), return_when=asyncio.FIRST_COMPLETED
+                )
+                if not done:
+                    break
+                for task in done:
+                    if task.exception() is None:
+                        if hedged:
+                            metrics.increment('rag_llm_hedges_total', winner='primary' if task is primary else 'hedge')
+                        return task.result()
+                    error = task.exception()
+            raise error or TimeoutError(f"No answer within {settings.GEMINI_TIMEOUT}s")
+        finally:
+            # Cancelling frees the slot of the losing or timed-out request
+            for task in pending:
+                task.cancel()
+
+    async def agenerate(self, prompt, hedge: bool = None) -> str:
+        """Async variant of generate()"""
+        hedge = settings.GEMINI_HEDGE_ENABLED if hedge is None else hedge
+        started_at = time.monotonic()
+        for attempt in range(settings.GEMINI_MAX_RETRIES + 1):
+            self._check_breaker()
+            try:
+                text = await self._aattempt(prompt, hedge)
+            except LLMUnavailableError:
+                raise
+            except Exception as e:
+                if not self._failed(e, attempt):
+                    raise self._give_up(e) from e
+                metrics.increment('rag_llm_retries_total')
+                await asyncio.sleep(self._retry_delay(attempt))
+                continue
+            self._succeeded(started_at)
+            return text
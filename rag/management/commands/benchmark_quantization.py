@@ -0,0 +1,126 @@
+from django.core.management.base import BaseCommand
+from api.models import ScrapedPage
+from rag.chunking import chunk_page
+from rag.qdrant_service import QdrantService
+import numpy as np
+import time
+
+VECTOR_SIZE = 384  # all-MiniLM-L6-v2
+
+# Set bits per byte value, for Hamming distances of packed binary vectors
+_POPCOUNT = np.unpackbits(np.arange(256, dtype=np.uint8)[:, None], axis=1).sum(axis=1)
+
+
+def _normalize(matrix: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return (matrix / norms).astype(np.float32)
+
+
+def _top_k(scores: np.ndarray, k: int) -> np.ndarray:
+    """Indexes of the k best scores per row, best first"""
+    k = min(k, scores.shape[1])
+    top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    order = np.argsort(-np.take_along_axis(scores, top, axis=1), axis=1)
+    return np.take_along_axis(top, order, axis=1)
+
+
+def _recall(found: np.ndarray, expected: np.ndarray) -> float:
+    hits = sum(len(set(f) & set(e)) for f, e in zip(found, expected))
+    return hits / expected.size
+
+
+def _scalar_quantize(vectors: np.ndarray, quantile: float = 0.99):
+    """int8 quantization like Qdrant's: clip to the quantile range, scale to [-127, 127]"""
+    bound = float(np.quantile(np.abs(vectors), quantile)) or 1.0
+    quantized = np.clip(np.round(vectors / bound * 127), -127, 127).astype(np.int8)
+    return quantized, bound
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare recall@k and bytes per vector of float32, int8 scalar and "
+        "binary quantized vectors (exact NumPy search, with and without rescoring)"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--website', type=int,
+                            help="Embed this website's chunks (default: random vectors)")
+        parser.add_argument('--vectors', type=int, default=20000,
+                            help="Number of random vectors when no website is given")
+        parser.add_argument('--queries', type=int, default=200)
+        parser.add_argument('-k', type=int, default=5)
+        parser.add_argument('--oversampling', type=float, default=2.0)
+
+    def _load_vectors(self, options):
+        rng = np.random.default_rng(0)
+        if not options['website']:
+            vectors = rng.standard_normal((options['vectors'], VECTOR_SIZE), dtype=np.float32)
+            # Queries near existing points, like questions about a page
+            picks = rng.choice(len(vectors), options['queries'])
+            noise = rng.standard_normal((len(picks), vectors.shape[1]), dtype=np.float32)
+            return _normalize(vectors), _normalize(vectors[picks] + noise)
+
+        qdrant = QdrantService()
+        chunks, titles = [], []
+        for page in ScrapedPage.objects.filter(website_id=options['website']).iterator():
+            titles.append(page.title or page.url)
+            chunks.extend(
+                chunk['embed_text']
+                for chunk in chunk_page(page.id, page.url, page.title or '', page.content,
+                                        website_id=options['website'])
+            )
+        # Page titles stand in for user questions
+        return (
+            _normalize(qdrant.generate_embeddings(chunks)),
+            _normalize(qdrant.generate_embeddings(titles[:options['queries']])),
+        )
+
+    def handle(self, *args, **options):
+        vectors, queries = self._load_vectors(options)
+        if not len(vectors) or not len(queries):
+            self.stderr.write("No vectors to benchmark")
+            return
+
+        k = options['k']
+        candidates = max(k, int(round(k * options['oversampling'])))
+        dimensions = vectors.shape[1]
+        expected = _top_k(queries @ vectors.T, k)
+
+        scalar, _ = _scalar_quantize(vectors)
+        scalar_queries, _ = _scalar_quantize(queries)
+        binary = np.packbits(vectors > 0, axis=1)
+        binary_queries = np.packbits(queries > 0, axis=1)
+
+        def scalar_scores():
+            return scalar_queries.astype(np.int32) @ scalar.astype(np.int32).T
+
+        def binary_scores():
+            # Fewer differing bits = more similar; one query at a time bounds memory
+            return -np.stack([
+                _POPCOUNT[query ^ binary].sum(axis=1, dtype=np.int32) for query in binary_queries
+            ])
+
+        def rescore(coarse):
+            top = _top_k(coarse, candidates)
+            exact = np.einsum('qd,qcd->qc', queries, vectors[top])
+            return np.take_along_axis(top, _top_k(exact, k), axis=1)
+
+        rows = [
+            ('float32', dimensions * 4, lambda: _top_k(queries @ vectors.T, k)),
+            ('int8 scalar', dimensions, lambda: _top_k(scalar_scores(), k)),
+            ('int8 scalar + rescore', dimensions, lambda: rescore(scalar_scores())),
+            ('binary', dimensions // 8, lambda: _top_k(binary_scores(), k)),
+            ('binary + rescore', dimensions // 8, lambda: rescore(binary_scores())),
+        ]
+
+        self.stdout.write(
+            f"{len(vectors)} vectors x {dimensions} dims, {len(queries)} queries, "
+            f"k={k}, rescoring {candidates} candidates"
+        )
+        self.stdout.write(f"{'storage':<24}{'bytes/vector':>14}{'recall@k':>10}{'ms/query':>10}")
+        for name, size, search in rows:
+            started_at = time.perf_counter()
+            found = search()
+            elapsed_ms = (time.perf_counter() - started_at) * 1000 / len(queries)
+            self.stdout.write(f"{name:<24}{size:>14}{_recall(found, expected):>10.3f}{elapsed_ms:>10.3f}")
@@ -0,0 +1,36 @@
+from django.core.management.base import BaseCommand
+from api.models import Website, ScrapedPage
+from rag.lexical_index import LexicalIndex
+from scraper.dedup import strip_boilerplate, unpack_hashes
+
+
+class Command(BaseCommand):
+    help = "Rebuild the BM25 index of the hybrid retriever from ScrapedPage content"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--website', type=int, help="Only rebuild this website's index")
+
+    def handle(self, *args, **options):
+        websites = Website.objects.all()
+        if options['website']:
+            websites = websites.filter(id=options['website'])
+
+        for website in websites:
+            pages = list(ScrapedPage.objects.filter(website=website))
+            # Same chunks as the vector index: the boilerplate stored by the
+            # last crawl stripped, duplicates skipped
+            boilerplate = unpack_hashes(website.boilerplate)
+            documents = [
+                {
+                    'page_id': page.id,
+                    'url': page.url,
+                    'title': page.title or '',
+                    'content': strip_boilerplate(page.content, boilerplate),
+                }
+                for page in pages
+                if page.duplicate_of_id is None
+            ]
+            with LexicalIndex.update(website.id) as index:
+                index.remove_pages(list(index.page_chunks))
+                index.add_documents(documents)
+            self.stdout.write(f"Indexed {len(documents)} pages for {website}")
@@ -0,0 +1,77 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from api.models import ScrapedPage
+from rag.chunking import chunk_page
+from rag.embedding_backends import OnnxEmbeddingBackend, SentenceTransformerBackend
+import numpy as np
+import time
+
+SAMPLE_TEXTS = [
+    "What are your opening hours?",
+    "How do I reset my password?",
+    "Shipping is free for orders over 50 euros within the EU.",
+    "Our support team answers emails within one business day.",
+    "Refunds are issued to the original payment method within 14 days.",
+    "The API rate limit is 100 requests per minute per key.",
+]
+
+
+class Command(BaseCommand):
+    help = (
+        "Check that the ONNX embedding backend matches the sentence-transformers "
+        "backend within a cosine tolerance, and compare their throughput"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--website', type=int,
+                            help="Use this website's chunks as sample texts")
+        parser.add_argument('--limit', type=int, default=256, help="Maximum number of texts")
+        parser.add_argument('--tolerance', type=float, default=0.99,
+                            help="Minimum cosine similarity between the backends' vectors")
+        parser.add_argument('--fp32', action='store_true',
+                            help="Check the unquantized ONNX model instead of the int8 one")
+
+    def _texts(self, options) -> list:
+        if not options['website']:
+            return SAMPLE_TEXTS
+        texts = []
+        for page in ScrapedPage.objects.filter(website_id=options['website']).iterator():
+            for chunk in chunk_page(page.id, page.url, page.title or '', page.content,
+                                    website_id=options['website']):
+                texts.append(chunk['embed_text'])
+                if len(texts) >= options['limit']:
+                    return texts
+        return texts
+
+    def _encode(self, backend, texts: list):
+        backend.encode(texts[:1])  # exclude one-off graph setup from the timing
+        started_at = time.perf_counter()
+        vectors = np.asarray(backend.encode(texts, batch_size=settings.RAG_EMBED_BATCH_SIZE), dtype=np.float32)
+        elapsed = time.perf_counter() - started_at
+        self.stdout.write(f"{backend.name:<24}{len(texts) / elapsed:>10.1f} texts/s")
+        return vectors
+
+    def handle(self, *args, **options):
+        texts = self._texts(options)
+        if not texts:
+            raise CommandError("No texts to compare")
+
+        threads = settings.RAG_EMBED_THREADS
+        reference = self._encode(SentenceTransformerBackend(settings.RAG_EMBEDDING_MODEL, threads=threads), texts)
+        candidate = self._encode(
+            OnnxEmbeddingBackend(settings.RAG_ONNX_MODEL_DIR, quantized=not options['fp32'], threads=threads),
+            texts,
+        )
+
+        if reference.shape != candidate.shape:
+            raise CommandError(f"Shape mismatch: {reference.shape} vs {candidate.shape}")
+        reference /= np.linalg.norm(reference, axis=1, keepdims=True)
+        candidate /= np.linalg.norm(candidate, axis=1, keepdims=True)
+        similarities = (reference * candidate).sum(axis=1)
+        self.stdout.write(
+            f"cosine similarity over {len(texts)} texts: "
+            f"min {similarities.min():.5f}, mean {similarities.mean():.5f}"
+        )
+        if similarities.min() < options['tolerance']:
+            raise CommandError(f"Parity check failed: min similarity below {options['tolerance']}")
+        self.stdout.write(self.style.SUCCESS("Parity check passed"))
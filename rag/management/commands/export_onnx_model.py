@@ -0,0 +1,64 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from pathlib import Path
+from rag.embedding_backends import (
+    ONNX_MODEL_FILE, ONNX_QUANTIZED_MODEL_FILE, TOKENIZER_FILE, CONFIG_FILE
+)
+import json
+
+
+class Command(BaseCommand):
+    help = (
+        "Export RAG_EMBEDDING_MODEL to ONNX (plus an int8 quantized copy) for the "
+        "'onnx' embedding backend. Needs torch, so run it at build time, not in workers."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--output', default=settings.RAG_ONNX_MODEL_DIR,
+                            help="Target directory (default: RAG_ONNX_MODEL_DIR)")
+        parser.add_argument('--opset', type=int, default=14)
+
+    def handle(self, *args, **options):
+        import torch
+        from onnxruntime.quantization import QuantType, quantize_dynamic
+        from sentence_transformers import SentenceTransformer
+        from sentence_transformers.models import Normalize
+
+        output = Path(options['output'])
+        output.mkdir(parents=True, exist_ok=True)
+
+        model = SentenceTransformer(settings.RAG_EMBEDDING_MODEL, device='cpu')
+        transformer = model[0].auto_model.eval()
+        tokenizer = model.tokenizer
+
+        # The fast tokenizer's tokenizer.json is all the 'tokenizers' package needs
+        tokenizer.backend_tokenizer.save(str(output / TOKENIZER_FILE))
+        (output / CONFIG_FILE).write_text(json.dumps({
+            'model': settings.RAG_EMBEDDING_MODEL,
+            'max_seq_length': model.max_seq_length,
+            'normalize': any(isinstance(module, Normalize) for module in model),
+        }, indent=2))
+
+        sample = tokenizer(['An example sentence to trace the graph'], return_tensors='pt')
+        input_names = [name for name in ('input_ids', 'attention_mask', 'token_type_ids') if name in sample]
+        dynamic_axes = {name: {0: 'batch', 1: 'sequence'} for name in input_names}
+        dynamic_axes['last_hidden_state'] = {0: 'batch', 1: 'sequence'}
+        with torch.no_grad():
+            torch.onnx.export(
+                transformer,
+                tuple(sample[name] for name in input_names),
+                str(output / ONNX_MODEL_FILE),
+                input_names=input_names,
+                output_names=['last_hidden_state'],
+                dynamic_axes=dynamic_axes,
+                opset_version=options['opset'],
+            )
+        self.stdout.write(f"Exported {output / ONNX_MODEL_FILE}")
+
+        # Dynamic quantization: int8 weights, activations quantized at run time
+        quantize_dynamic(
+            str(output / ONNX_MODEL_FILE),
+            str(output / ONNX_QUANTIZED_MODEL_FILE),
+            weight_type=QuantType.QInt8,
+        )
+        self.stdout.write(f"Quantized {output / ONNX_QUANTIZED_MODEL_FILE}")
@@ -0,0 +1,134 @@
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from api.models import Message
+import re
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Words that make a question depend on the previous turns
+_REFERENCE_RE = re.compile(
+    r'\b(it|its|this|that|these|those|they|them|their|there|he|she|his|her|'
+    r'one|ones|same|more|also|else|other|another)\b',
+    re.IGNORECASE,
+)
+# Openers of elliptical follow-ups ("what about pricing?", "and on weekends?"),
+# only trusted in short messages
+_ELLIPSIS_RE = re.compile(
+    r'^\s*(and|or|but|so|then|what about|how about|what if|why not|same for)\b',
+    re.IGNORECASE,
+)
+FOLLOW_UP_MAX_WORDS = 6
+
+# Held while a session's summary task is queued or running
+SUMMARY_LOCK_KEY = 'rag:memory:summarizing:{}'
+
+
+def _clip(text: str, limit: int) -> str:
+    text = ' '.join(text.split())
+    return text if len(text) <= limit else text[:limit].rsplit(' ', 1)[0] + '...'
+
+
+def format_history(memory: dict) -> str:
+    """Render the summary and recent turns for a prompt (empty without history)"""
+    lines = []
+    if memory['summary']:
+        lines.append(f"Summary of the earlier conversation: {memory['summary']}")
+    for user_message, bot_response in memory['turns']:
+        lines.append(f"User: {_clip(user_message, settings.RAG_MEMORY_TURN_CHARS)}")
+        lines.append(f"Assistant: {_clip(bot_response, settings.RAG_MEMORY_TURN_CHARS)}")
+    return "\n".join(lines)
+
+
+def is_follow_up(message: str) -> bool:
+    """Whether a question likely refers to earlier turns ("what about pricing?", "does it ...")"""
+    if _REFERENCE_RE.search(message):
+        return True
+    return len(message.split()) <= FOLLOW_UP_MAX_WORDS and bool(_ELLIPSIS_RE.match(message))
+
+
+class ConversationMemory:
+    """
+    Bounded memory of a chat session
+
+    The prompt gets the session's rolling summary plus the turns not yet
+    folded into it. The summary is updated by a background task once
+    RAG_MEMORY_SUMMARIZE_EVERY turns have accumulated beyond the
+    RAG_MEMORY_TURNS verbatim window, so at most TURNS + SUMMARIZE_EVERY
+    turns are ever sent verbatim.
+    """
+
+    def __init__(self, session):
+        self.session = session
+        self.window = settings.RAG_MEMORY_TURNS + settings.RAG_MEMORY_SUMMARIZE_EVERY
+
+    def _unsummarized(self):
+        return Message.objects.filter(
+            session_id=self.session.id, id__gt=self.session.summary_last_message_id
+        )
+
+    def _memory(self, messages: list) -> dict:
+        # Newest first from the query; the prompt reads oldest first
+        return {
+            'summary': self.session.summary,
+            'turns': [(message.user_message, message.bot_response) for message in reversed(messages)],
+        }
+
+    def load(self) -> dict:
+        """
+        Returns: dict with 'summary' and 'turns' (list of (user_message, bot_response), oldest first)
+        """
+        return self._memory(list(self._unsummarized().order_by('-id')[:self.window]))
+
+    async def aload(self) -> dict:
+        """Async variant of load()"""
+        return self._memory([message async for message in self._unsummarized().order_by('-id')[:self.window]])
+
+    def rewrite_query(self, user_message: str, memory: dict) -> str:
+        """
+        Standalone query for retrieval (RAG_QUERY_REWRITE)
+        Questions that don't look like follow-ups are used as they are.
+        """
+        mode = settings.RAG_QUERY_REWRITE
+        if mode == 'none' or not memory['turns'] or not is_follow_up(user_message):
+            return user_message
+
+        if mode == 'llm':
+            from .gemini_service import GeminiService
+
+            try:
+                return GeminiService().rewrite_query(user_message, format_history(memory)) or user_message
+            except Exception as e:
+                logger.error(f"Error rewriting query, using the previous question instead: {e}")
+
+        previous_question = memory['turns'][-1][0]
+        return f"{_clip(previous_question, settings.RAG_MEMORY_TURN_CHARS)} {user_message}"
+
+    async def arewrite_query(self, user_message: str, memory: dict) -> str:
+        """Async variant of rewrite_query()"""
+        if settings.RAG_QUERY_REWRITE != 'llm':
+            return self.rewrite_query(user_message, memory)
+        return await sync_to_async(self.rewrite_query, thread_sensitive=False)(user_message, memory)
+
+    def schedule_summary(self):
+        """
+        Queue the background summary once enough turns are past the
+        verbatim window; never blocks or fails the chat request
+        """
+        try:
+            pending = self._unsummarized().count()
+            if pending < self.window:
+                return
+            # One queued task per session at a time
+            if not cache.add(SUMMARY_LOCK_KEY.format(self.session.id), 1, timeout=300):
+                return
+            from .tasks import summarize_session_task
+
+            try:
+                summarize_session_task.delay(self.session.id)
+            except Exception:
+                cache.delete(SUMMARY_LOCK_KEY.format(self.session.id))
+                raise
+        except Exception as e:
+            logger.error(f"Error scheduling summary for session {self.session.id}: {e}")
@@ -0,0 +1,111 @@
+from collections import defaultdict
+import bisect
+import threading
+
+# In-process counters and histograms, keyed by (name, sorted label items)
+_lock = threading.Lock()
+_counters = defaultdict(float)
+_histograms = {}
+
+# Latency buckets in seconds
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _key(name: str, labels: dict):
+    return name, tuple(sorted(labels.items()))
+
+
+def increment(name: str, value: float = 1, **labels):
+    """Add value to a counter"""
+    with _lock:
+        _counters[_key(name, labels)] += value
+
+
+def get_counter(name: str, **labels) -> float:
+    """Current value of a counter (0 if never incremented)"""
+    with _lock:
+        return _counters.get(_key(name, labels), 0)
+
+
+def counters() -> dict:
+    """Snapshot of every counter as {(name, labels): value}"""
+    with _lock:
+        return dict(_counters)
+
+
+def observe(name: str, value: float, buckets: tuple = DEFAULT_BUCKETS, **labels):
+    """
+    Record a value in a histogram
+    The bucket bounds are fixed by the first observation of a series.
+    """
+    key = _key(name, labels)
+    with _lock:
+        histogram = _histograms.get(key)
+        if histogram is None:
+            histogram = {
+                'buckets': tuple(buckets),
+                'counts': [0] * (len(buckets) + 1),  # last one is +Inf
+                'sum': 0.0,
+                'count': 0,
+            }
+            _histograms[key] = histogram
+        histogram['counts'][bisect.bisect_left(histogram['buckets'], value)] += 1
+        histogram['sum'] += value
+        histogram['count'] += 1
+
+
+def histograms() -> dict:
+    """Snapshot of every histogram as {(name, labels): histogram}"""
+    with _lock:
+        return {
+            key: dict(histogram, counts=list(histogram['counts']))
+            for key, histogram in _histograms.items()
+        }
+
+
+def _format_labels(labels) -> str:
+    if not labels:
+        return ''
+    pairs = ','.join(
+        '{}="{}"'.format(name, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+        for name, value in labels
+    )
+    return f'{{{pairs}}}'
+
+
+def _format_value(value: float) -> str:
+    return repr(float(value)) if value != int(value) else str(int(value))
+
+
+def _series_key(item):
+    (name, labels), _ = item
+    return name, repr(labels)
+
+
+def render_prometheus() -> str:
+    """
+    Every counter and histogram of this process in the Prometheus text
+    exposition format (version 0.0.4)
+    """
+    lines = []
+    by_name = defaultdict(list)
+    for (name, labels), value in sorted(counters().items(), key=_series_key):
+        by_name[name].append((labels, value))
+    for name, series in by_name.items():
+        lines.append(f'# TYPE {name} counter')
+        lines.extend(f'{name}{_format_labels(labels)} {_format_value(value)}' for labels, value in series)
+
+    by_name = defaultdict(list)
+    for (name, labels), histogram in sorted(histograms().items(), key=_series_key):
+        by_name[name].append((labels, histogram))
+    for name, series in by_name.items():
+        lines.append(f'# TYPE {name} histogram')
+        for labels, histogram in series:
+            cumulative = 0
+            bounds = [_format_value(bound) for bound in histogram['buckets']] + ['+Inf']
+            for bound, count in zip(bounds, histogram['counts']):
+                cumulative += count
+                lines.append(f'{name}_bucket{_format_labels(labels + (("le", bound),))} {cumulative}')
+            lines.append(f'{name}_sum{_format_labels(labels)} {repr(histogram["sum"])}')
+            lines.append(f'{name}_count{_format_labels(labels)} {histogram["count"]}')
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,171 @@
+from django.conf import settings
+from .registry import registry
+from . import metrics
+import numpy as np
+import math
+import re
+import logging
+
+logger = logging.getLogger(__name__)
+
+_SENTENCE_RE = re.compile(r'(?<=[.!?])\s+')
+
+# Gemini's tokenizer isn't available offline; ~4 characters per token is
+# its documented average for English text
+CHARS_PER_TOKEN = 4
+
+# Shorter sentences ("Yes.") are only deduped on exact matches
+MIN_FRAGMENT_CHARS = 20
+
+TOKEN_BUCKETS = (64, 128, 256, 512, 1024, 2048, 4096, 8192)
+
+
+def count_tokens(text: str) -> int:
+    """Estimated LLM tokens of a text"""
+    return math.ceil(len(text) / CHARS_PER_TOKEN)
+
+
+def split_sentences(text: str) -> list:
+    return [sentence.strip() for sentence in _SENTENCE_RE.split(text) if sentence.strip()]
+
+
+def _normalize(sentence: str) -> str:
+    return ' '.join(sentence.lower().split())
+
+
+def sentence_similarities(sentences: list, query_vector) -> np.ndarray:
+    """Cosine similarity of each sentence to the query (None if unavailable)"""
+    if query_vector is None or not sentences:
+        return None
+    try:
+        matrix = np.asarray(registry.get_embedding_model().encode(
+            sentences, batch_size=settings.RAG_EMBED_BATCH_SIZE, show_progress_bar=False
+        ), dtype=np.float32)
+    except Exception as e:
+        logger.error(f"Error scoring context sentences: {e}")
+        return None
+    query = np.asarray(query_vector, dtype=np.float32)
+    query = query / (np.linalg.norm(query) or 1.0)
+    norms = np.linalg.norm(matrix, axis=1)
+    norms[norms == 0] = 1.0
+    return matrix @ query / norms
+
+
+class PromptBuilder:
+    """
+    Assemble the retrieved context under a token budget
+
+    Sources are taken in relevance order (the order of the search results)
+    until RAG_PROMPT_CONTEXT_TOKENS is used up:
+
+    - sentences already included from an earlier source (overlapping chunks
+      of one page, duplicated boilerplate) are dropped
+    - with compression on, each source keeps only its
+      RAG_PROMPT_SENTENCES_PER_SOURCE sentences closest to the query
+      (embedding cosine), in their original order
+    - the last source that doesn't fit entirely contributes its best
+      sentences that still fit
+
+    Metrics: rag_prompt_context_tokens and rag_prompt_source_tokens histograms.
+    """
+
+    def __init__(self, token_budget: int = None, sentences_per_source: int = None,
+                 compress: bool = None):
+        self.token_budget = token_budget or settings.RAG_PROMPT_CONTEXT_TOKENS
+        self.sentences_per_source = sentences_per_source or settings.RAG_PROMPT_SENTENCES_PER_SOURCE
+        self.compress = settings.RAG_PROMPT_COMPRESSION_ENABLED if compress is None else compress
+
+    @staticmethod
+    def format_source(result: dict, content: str) -> str:
+        return f"Source: {result['title']}\nURL: {result['url']}\nContent: {content}"
+
+    def build(self, search_results: list, query_vector=None) -> dict:
+        """
+        Returns: dict with 'context', 'context_tokens', 'source_tokens'
+        (before dedupe and compression), 'sources_used', 'excerpts' (title,
+        url and kept text of each source in the context) and
+        'sentence_scores' (sentence -> cosine with the query, for the
+        sentences scored during compression; reused by ExtractiveAnswerer)
+        """
+        # Dedupe first so only new sentences are embedded and scored
+        seen = []
+        sources = []
+        for result in search_results:
+            sentences = []
+            for sentence in split_sentences(result.get('content') or ''):
+                normalized = _normalize(sentence)
+                if normalized in seen:
+                    continue
+                # Chunk overlaps cut sentences, so longer fragments also
+                # count as duplicates when contained in a kept sentence
+                if len(normalized) >= MIN_FRAGMENT_CHARS and any(
+                    normalized in other or other in normalized for other in seen
+                ):
+                    continue
+                seen.append(normalized)
+                sentences.append(sentence)
+            if sentences:
+                sources.append((result, sentences))
+
+        scores = None
+        sentence_scores = {}
+        if self.compress:
+            scored = [sentence for _, sentences in sources for sentence in sentences]
+            scores = sentence_similarities(scored, query_vector)
+            if scores is not None:
+                sentence_scores = dict(zip(scored, scores.tolist()))
+
+        parts = []
+        excerpts = []
+        used = 0
+        offset = 0
+        for result, sentences in sources:
+            positions = list(range(len(sentences)))
+            if scores is not None:
+                source_scores = scores[offset:offset + len(sentences)]
+                # Most relevant first; ties keep document order
+                positions = sorted(positions, key=lambda i: -source_scores[i])[:self.sentences_per_source]
+            offset += len(sentences)
+
+            remaining = self.token_budget - used - count_tokens(self.format_source(result, ''))
+            kept = []
+            for i in positions:
+                cost = count_tokens(sentences[i]) + 1
+                if cost <= remaining:
+                    kept.append(i)
+                    remaining -= cost
+            if not kept:
+                # A single overlong sentence (e.g. text without punctuation)
+                # is cut at a word boundary rather than dropped
+                if positions and remaining > 0:
+                    sentence = sentences[positions[0]][:remaining * CHARS_PER_TOKEN].rsplit(' ', 1)[0]
+                    if sentence:
+                        part = self.format_source(result, sentence)
+                        parts.append(part)
+                        excerpts.append({'title': result['title'], 'url': result['url'], 'text': sentence})
+                break
+
+            text = ' '.join(sentences[i] for i in sorted(kept))
+            part = self.format_source(result, text)
+            parts.append(part)
+            excerpts.append({'title': result['title'], 'url': result['url'], 'text': text})
+            used += count_tokens(part)
+            if len(kept) < len(positions):
+                break  # out of budget
+
+        context = "\n\n".join(parts)
+        context_tokens = count_tokens(context)
+        source_tokens = sum(
+            count_tokens(self.format_source(result, result.get('content') or ''))
+            for result in search_results
+        )
+        metrics.observe('rag_prompt_context_tokens', context_tokens, buckets=TOKEN_BUCKETS)
+        metrics.observe('rag_prompt_source_tokens', source_tokens, buckets=TOKEN_BUCKETS)
+        return {
+            'context': context,
+            'context_tokens': context_tokens,
+            'source_tokens': source_tokens,
+            'sources_used': len(parts),
+            'excerpts': excerpts,
+            'sentence_scores': sentence_scores,
+        }
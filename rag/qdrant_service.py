@@ -1,165 +1,276 @@
-from qdrant_client import QdrantClient
-from qdrant_client.models import Distance, VectorParams, PointStruct
-from sentence_transformers import SentenceTransformer
 from django.conf import settings
+from .registry import registry
+from .chunking import chunk_page
+from .vector_stores import QdrantVectorStore, LocalVectorStore, LocalVectorIndex
+from . import tracing
+import numpy as np
+import asyncio
 import logging
-import uuid
 
 logger = logging.getLogger(__name__)
 
 
 class QdrantService:
     """
-    Service to interact with Qdrant vector database
+    Service to embed documents and store and search their vectors
+
+    The vectors live in a store chosen by RAG_VECTOR_STORE (see
+    rag.vector_stores): Qdrant (the default), the embedded local store, or
+    'auto', which keeps small websites (up to RAG_LOCAL_VECTOR_MAX_POINTS
+    chunks) in the local store and moves them to Qdrant once they outgrow
+    it. The local store is files on one host, so 'local' and 'auto' need the
+    web processes and the workers on the same machine.
+
+    The client and the embedding model come from the process-wide
+    registry, so constructing this service is cheap.
     """
     
     def __init__(self):
-        # Initialize Qdrant client
-        if settings.QDRANT_URL and settings.QDRANT_API_KEY:
-            # Cloud setup
-            self.client = QdrantClient(
-                url=settings.QDRANT_URL,
-                api_key=settings.QDRANT_API_KEY,
-            )
-            logger.info("Connected to Qdrant Cloud")
-        else:
-            # Local setup
-            self.client = QdrantClient(
-                host=settings.QDRANT_HOST,
-                port=settings.QDRANT_PORT,
-            )
-            logger.info(f"Connected to local Qdrant at {settings.QDRANT_HOST}:{settings.QDRANT_PORT}")
-        
-        self.collection_name = settings.QDRANT_COLLECTION_NAME
-        
-        # Initialize embedding model
-        self.model = SentenceTransformer('all-MiniLM-L6-v2')
         self.vector_size = 384  # Dimension for all-MiniLM-L6-v2
-        
-        # Create collection if it doesn't exist
-        self._ensure_collection_exists()
+        self.mode = settings.RAG_VECTOR_STORE
+        self.local_store = LocalVectorStore()
+        # Creates the collection if it doesn't exist (checked once per process)
+        self.qdrant_store = QdrantVectorStore(self.vector_size) if self.mode != 'local' else None
     
-    def _ensure_collection_exists(self):
-        """Create collection if it doesn't exist"""
-        try:
-            collections = self.client.get_collections().collections
-            collection_names = [col.name for col in collections]
-            
-            if self.collection_name not in collection_names:
-                self.client.create_collection(
-                    collection_name=self.collection_name,
-                    vectors_config=VectorParams(
-                        size=self.vector_size,
-                        distance=Distance.COSINE
-                    )
-                )
-                logger.info(f"Created collection: {self.collection_name}")
-            else:
-                logger.info(f"Collection {self.collection_name} already exists")
-        except Exception as e:
-            logger.error(f"Error ensuring collection exists: {e}")
-            raise
+    @property
+    def model(self):
+        """Shared embedding model, loaded on first use"""
+        return registry.get_embedding_model()
     
-    def generate_embedding(self, text: str) -> list:
+    def store_for(self, website_id: int = None):
+        """Vector store holding a website's chunks"""
+        if self.mode == 'local':
+            return self.local_store
+        if self.mode == 'auto' and self.local_store.exists(website_id):
+            return self.local_store
+        return self.qdrant_store
+    
+    def generate_embedding(self, text: str) -> np.ndarray:
         """
         Generate embedding vector for text
+        Repeated texts come from the embedding cache (rag.embedding_cache).
         """
         try:
-            # Truncate text if too long (model limit is ~512 tokens)
-            text = text[:5000]
-            embedding = self.model.encode(text)
-            return embedding.tolist()
+            cache = registry.get_embedding_cache()
+            with tracing.span('embed') as span:
+                embedding = cache.get(text)
+                span.set(cached=embedding is not None)
+                if embedding is None:
+                    embedding = cache.set(text, self._encode_query(text))
+            return embedding
         except Exception as e:
             logger.error(f"Error generating embedding: {e}")
             raise
     
-    def add_document(self, page_id: int, url: str, title: str, content: str) -> str:
+    def _encode_query(self, text: str) -> np.ndarray:
+        if settings.RAG_EMBED_BATCHER_ENABLED:
+            # Coalesced with concurrent queries into one forward pass
+            embedding = registry.get_embedding_batcher().embed(text)
+        else:
+            embedding = self.model.encode(text)
+        return np.asarray(embedding, dtype=np.float32)
+    
+    def generate_embeddings(self, texts: list) -> np.ndarray:
         """
-        Add a document to Qdrant
-        Returns: vector_id (UUID)
+        Generate embedding vectors for many texts in batched forward passes
+        Returns: float32 NumPy matrix with one row per text
         """
         try:
-            # Generate embedding from FULL content
-            embedding = self.generate_embedding(content)
+            return np.asarray(self.model.encode(
+                texts,
+                batch_size=settings.RAG_EMBED_BATCH_SIZE,
+                show_progress_bar=False,
+            ), dtype=np.float32)
+        except Exception as e:
+            logger.error(f"Error generating embeddings: {e}")
+            raise
+    
+    def add_document(self, page_id: int, url: str, title: str, content: str,
+                     website_id: int = None) -> str:
+        """
+        Split a document into chunks and add them to its vector store
+        Returns: vector_id of the first chunk (UUID)
+        """
+        vector_ids = self.add_documents([{
+            'page_id': page_id,
+            'website_id': website_id,
+            'url': url,
+            'title': title,
+            'content': content,
+        }])
+        return vector_ids.get(page_id)
+    
+    def chunk_documents(self, documents: list) -> tuple:
+        """
+        Split documents into chunks (deterministic, see rag.chunking)
+        Returns: (chunks, dict of page_id -> vector_id of the page's first chunk)
+        """
+        chunks = []
+        vector_ids = {}
+        for document in documents:
+            page_chunks = chunk_page(
+                document['page_id'],
+                document['url'],
+                document['title'],
+                document['content'],
+                website_id=document.get('website_id'),
+            )
+            if page_chunks:
+                vector_ids[document['page_id']] = page_chunks[0]['id']
+            chunks.extend(page_chunks)
+        return chunks, vector_ids
+    
+    def embed_chunks(self, chunks: list) -> np.ndarray:
+        """Encode chunks in batched forward passes; the title gives each window some page-level context"""
+        return self.generate_embeddings([chunk['embed_text'] for chunk in chunks])
+    
+    def upload_chunks(self, chunks: list, embeddings: np.ndarray):
+        """Upsert chunks with their vectors into each website's vector store"""
+        # Group point indexes by website
+        by_website = {}
+        for index, chunk in enumerate(chunks):
+            by_website.setdefault(chunk['payload']['website_id'], []).append(index)
+        
+        for website_id, indexes in by_website.items():
+            ids = [chunks[i]['id'] for i in indexes]
+            payloads = [chunks[i]['payload'] for i in indexes]
+            if self.mode == 'local':
+                self.local_store.upload(website_id, ids, embeddings[indexes], payloads)
+            elif (self.mode == 'qdrant' or website_id is None
+                  or website_id in settings.QDRANT_DEDICATED_COLLECTION_WEBSITES):
+                self.qdrant_store.upload(website_id, ids, embeddings[indexes], payloads)
+            else:
+                self._upload_auto(website_id, ids, embeddings[indexes], payloads)
+    
+    def _upload_auto(self, website_id: int, ids: list, vectors: np.ndarray, payloads: list):
+        """
+        Keep a website in the local store while it is small: new websites
+        start there, and are moved to Qdrant once they exceed
+        RAG_LOCAL_VECTOR_MAX_POINTS chunks
+        """
+        with LocalVectorIndex.update(website_id) as index:
+            if not len(index) and self.qdrant_store.count(website_id):
+                # Already in Qdrant
+                self.qdrant_store.upload(website_id, ids, vectors, payloads)
+                return
             
-            # Generate unique ID
-            vector_id = str(uuid.uuid4())
+            index.upsert(ids, vectors, payloads)
+            if len(index) > settings.RAG_LOCAL_VECTOR_MAX_POINTS:
+                self.qdrant_store.upload(website_id, index.ids, np.asarray(index.vectors), index.payloads)
+                index.discard()
+                logger.info(f"Moved {len(index)} vectors of website {website_id} to Qdrant")
+    
+    def add_documents(self, documents: list) -> dict:
+        """
+        Bulk-add documents to their vector stores
+        
+        All chunks of all documents are encoded into a single matrix with
+        batched forward passes, then uploaded per website (to Qdrant in
+        QDRANT_UPSERT_BATCH_SIZE point batches).
+        
+        Args:
+            documents: list of dicts with 'page_id', 'website_id', 'url',
+                       'title' and 'content'
+        
+        Returns: dict of page_id -> vector_id of the page's first chunk
+        """
+        try:
+            chunks, vector_ids = self.chunk_documents(documents)
             
-            # Create point with MORE content stored
-            point = PointStruct(
-                id=vector_id,
-                vector=embedding,
-                payload={
-                    'page_id': page_id,
-                    'url': url,
-                    'title': title,
-                    'content': content[:2000],  # Store more content (2k chars)
-                    'content_length': len(content)
-                }
-            )
+            if not chunks:
+                logger.warning("Nothing to index")
+                return vector_ids
             
-            # Upload to Qdrant
-            self.client.upsert(
-                collection_name=self.collection_name,
-                points=[point]
-            )
+            self.upload_chunks(chunks, self.embed_chunks(chunks))
             
-            logger.info(f"Added document to Qdrant: {title} ({len(content)} chars)")
-            return vector_id
+            logger.info(f"Added {len(documents)} documents ({len(chunks)} chunks)")
+            return vector_ids
             
         except Exception as e:
-            logger.error(f"Error adding document to Qdrant: {e}")
+            logger.error(f"Error adding documents: {e}")
             raise
     
-    def search(self, query: str, limit: int = 5):
+    def search(self, query: str, limit: int = 5, website_id: int = None,
+               query_vector: np.ndarray = None):
         """
         Search for similar documents
         Returns: list of search results with scores
+        
+        Args:
+            website_id: only search this website's chunks (uses the
+                        website_id payload index)
+            query_vector: precomputed embedding of the query
         """
         try:
             # Generate query embedding
-            query_embedding = self.generate_embedding(query)
+            query_embedding = query_vector if query_vector is not None else self.generate_embedding(query)
             
-            # Search in Qdrant
-            results = self.client.search(
-                collection_name=self.collection_name,
-                query_vector=query_embedding,
-                limit=limit
-            )
+            with tracing.span('vector_search', limit=limit) as span:
+                results = self.store_for(website_id).search(query_embedding, limit, website_id)
+                span.set(results=len(results))
+            return results
+            
+        except Exception as e:
+            logger.error(f"Error searching vectors: {e}")
+            return []
+    
+    async def agenerate_embedding(self, text: str) -> np.ndarray:
+        """
+        Generate embedding vector for text without blocking the event loop
+        (cache lookup, then the micro-batcher or the registry's bounded
+        embedding executor)
+        """
+        cache = registry.get_embedding_cache()
+        with tracing.span('embed') as span:
+            embedding = await cache.aget(text)
+            span.set(cached=embedding is not None)
+            if embedding is not None:
+                return embedding
             
-            # Format results
-            formatted_results = []
-            for result in results:
-                formatted_results.append({
-                    'page_id': result.payload.get('page_id'),
-                    'url': result.payload.get('url'),
-                    'title': result.payload.get('title'),
-                    'content': result.payload.get('content'),
-                    'score': result.score
-                })
+            if settings.RAG_EMBED_BATCHER_ENABLED:
+                # The batcher thread encodes; the coroutine just awaits its future
+                embedding = await registry.get_embedding_batcher().aembed(text)
+            else:
+                loop = asyncio.get_running_loop()
+                embedding = await loop.run_in_executor(
+                    registry.get_embedding_executor(), self._encode_query, text
+                )
+            return await cache.aset(text, embedding)
+    
+    async def asearch(self, query: str, limit: int = 5, website_id: int = None,
+                      query_vector: np.ndarray = None):
+        """
+        Async variant of search() (async Qdrant client, or the retrieval executor)
+        Returns: list of search results with scores
+        """
+        try:
+            if query_vector is None:
+                query_vector = await self.agenerate_embedding(query)
             
-            return formatted_results
+            with tracing.span('vector_search', limit=limit) as span:
+                results = await self.store_for(website_id).asearch(query_vector, limit, website_id)
+                span.set(results=len(results))
+            return results
             
         except Exception as e:
-            logger.error(f"Error searching Qdrant: {e}")
+            logger.error(f"Error searching vectors: {e}")
             return []
     
-    def delete_by_page_id(self, page_id: int):
+    def delete_by_page_id(self, page_id: int, website_id: int = None):
         """Delete vectors by page_id"""
         try:
-            self.client.delete(
-                collection_name=self.collection_name,
-                points_selector={
-                    "filter": {
-                        "must": [
-                            {
-                                "key": "page_id",
-                                "match": {"value": page_id}
-                            }
-                        ]
-                    }
-                }
-            )
+            self.store_for(website_id).delete_by_page_ids([page_id], website_id)
             logger.info(f"Deleted vectors for page_id: {page_id}")
         except Exception as e:
-            logger.error(f"Error deleting from Qdrant: {e}")
\ No newline at end of file
+            logger.error(f"Error deleting vectors: {e}")
+    
+    def delete_by_page_ids(self, page_ids: list, website_id: int = None):
+        """Delete the vectors of many pages in one request"""
+        if not page_ids:
+            return
+        try:
+            self.store_for(website_id).delete_by_page_ids(page_ids, website_id)
+            logger.info(f"Deleted vectors for {len(page_ids)} pages")
+        except Exception as e:
+            logger.error(f"Error deleting vectors: {e}")
+            raise
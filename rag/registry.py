@@ -0,0 +1,296 @@
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
+import asyncio
+import threading
+import weakref
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class ServiceRegistry:
+    """
+    Process-wide holder for the expensive RAG dependencies.
+
+    The embedding model, the Qdrant client and the Gemini model are loaded
+    lazily on first use and then shared by every request and task running
+    in this worker process.
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._embedding_model = None
+        self._qdrant_client = None
+        self._gemini_model = None
+        self._llm_client = None
+        self._reranker_model = None
+        self._ready_collections = set()
+        # One async client per event loop: its connection pool is bound to the loop
+        self._async_qdrant_clients = weakref.WeakKeyDictionary()
+        self._embedding_executor = None
+        self._embedding_batcher = None
+        self._retrieval_executor = None
+        self._embedding_cache = None
+        self._redis_client = None
+        self._chunk_tokenizer = None
+
+    def get_embedding_model(self):
+        """
+        Return the shared embedding backend (RAG_EMBEDDING_BACKEND), loading
+        it on first use; it encodes like SentenceTransformer.encode
+        """
+        if self._embedding_model is None:
+            with self._lock:
+                if self._embedding_model is None:
+                    from .embedding_backends import load_embedding_backend
+
+                    self._embedding_model = load_embedding_backend(settings.RAG_EMBEDDING_BACKEND)
+                    logger.info(
+                        f"Loaded embedding model: {settings.RAG_EMBEDDING_MODEL} "
+                        f"({settings.RAG_EMBEDDING_BACKEND})"
+                    )
+        return self._embedding_model
+
+    def get_chunk_tokenizer(self):
+        """
+        Return the embedding model's tokenizer (rag.embedding_backends.load_tokenizer),
+        used to size chunks; it loads without the model
+        """
+        if self._chunk_tokenizer is None:
+            with self._lock:
+                if self._chunk_tokenizer is None:
+                    from .embedding_backends import load_tokenizer
+
+                    self._chunk_tokenizer = load_tokenizer()
+        return self._chunk_tokenizer
+
+    def get_reranker_model(self):
+        """Return the shared cross-encoder (RAG_RERANK_MODEL), loading it on first use"""
+        if self._reranker_model is None:
+            with self._lock:
+                if self._reranker_model is None:
+                    from sentence_transformers import CrossEncoder
+
+                    self._reranker_model = CrossEncoder(settings.RAG_RERANK_MODEL, max_length=256)
+                    logger.info(f"Loaded reranker model: {settings.RAG_RERANK_MODEL}")
+        return self._reranker_model
+
+    def get_qdrant_client(self):
+        """Return the shared Qdrant client, connecting on first use"""
+        if self._qdrant_client is None:
+            with self._lock:
+                if self._qdrant_client is None:
+                    from qdrant_client import QdrantClient
+
+                    if settings.QDRANT_URL and settings.QDRANT_API_KEY:
+                        # Cloud setup
+                        self._qdrant_client = QdrantClient(
+                            url=settings.QDRANT_URL,
+                            api_key=settings.QDRANT_API_KEY,
+                            timeout=settings.QDRANT_TIMEOUT,
+                        )
+                        logger.info("Connected to Qdrant Cloud")
+                    else:
+                        # Local setup
+                        self._qdrant_client = QdrantClient(
+                            host=settings.QDRANT_HOST,
+                            port=settings.QDRANT_PORT,
+                            timeout=settings.QDRANT_TIMEOUT,
+                        )
+                        logger.info(f"Connected to local Qdrant at {settings.QDRANT_HOST}:{settings.QDRANT_PORT}")
+        return self._qdrant_client
+
+    def get_async_qdrant_client(self):
+        """Return the async Qdrant client of the running event loop"""
+        loop = asyncio.get_running_loop()
+        client = self._async_qdrant_clients.get(loop)
+        if client is None:
+            from qdrant_client import AsyncQdrantClient
+
+            if settings.QDRANT_URL and settings.QDRANT_API_KEY:
+                client = AsyncQdrantClient(
+                    url=settings.QDRANT_URL,
+                    api_key=settings.QDRANT_API_KEY,
+                    timeout=settings.QDRANT_TIMEOUT,
+                )
+            else:
+                client = AsyncQdrantClient(
+                    host=settings.QDRANT_HOST,
+                    port=settings.QDRANT_PORT,
+                    timeout=settings.QDRANT_TIMEOUT,
+                )
+            self._async_qdrant_clients[loop] = client
+        return client
+
+    def get_embedding_executor(self):
+        """
+        Bounded thread pool for embedding work started from async code,
+        so CPU-bound encoding never runs on the event loop
+        """
+        if self._embedding_executor is None:
+            with self._lock:
+                if self._embedding_executor is None:
+                    self._embedding_executor = ThreadPoolExecutor(
+                        max_workers=settings.RAG_EMBED_EXECUTOR_WORKERS,
+                        thread_name_prefix='rag-embed',
+                    )
+        return self._embedding_executor
+
+    def get_retrieval_executor(self):
+        """Thread pool running retrieval legs (e.g. BM25) next to the vector search"""
+        if self._retrieval_executor is None:
+            with self._lock:
+                if self._retrieval_executor is None:
+                    self._retrieval_executor = ThreadPoolExecutor(
+                        max_workers=settings.RAG_RETRIEVAL_EXECUTOR_WORKERS,
+                        thread_name_prefix='rag-retrieval',
+                    )
+        return self._retrieval_executor
+
+    def get_embedding_batcher(self):
+        """Shared micro-batcher for query embeddings"""
+        if self._embedding_batcher is None:
+            with self._lock:
+                if self._embedding_batcher is None:
+                    from .embedding_batcher import EmbeddingBatcher
+
+                    self._embedding_batcher = EmbeddingBatcher(
+                        self._encode_batch,
+                        max_batch_size=settings.RAG_EMBED_BATCHER_MAX_BATCH_SIZE,
+                        max_wait_ms=settings.RAG_EMBED_BATCHER_MAX_WAIT_MS,
+                    )
+        return self._embedding_batcher
+
+    def get_embedding_cache(self):
+        """Shared two-tier cache of query embeddings (memory LRU + Redis)"""
+        if self._embedding_cache is None:
+            with self._lock:
+                if self._embedding_cache is None:
+                    from .embedding_cache import EmbeddingCache
+
+                    self._embedding_cache = EmbeddingCache()
+        return self._embedding_cache
+
+    def get_redis_client(self):
+        """Shared Redis client (REDIS_URL) with short timeouts, for caches"""
+        if self._redis_client is None:
+            with self._lock:
+                if self._redis_client is None:
+                    import redis
+
+                    self._redis_client = redis.Redis.from_url(
+                        settings.REDIS_URL,
+                        socket_timeout=settings.REDIS_SOCKET_TIMEOUT,
+                        socket_connect_timeout=settings.REDIS_SOCKET_TIMEOUT,
+                    )
+        return self._redis_client
+
+    def _encode_batch(self, texts):
+        return self.get_embedding_model().encode(
+            texts, batch_size=len(texts), show_progress_bar=False
+        )
+
+    def get_gemini_model(self):
+        """Return the shared, configured Gemini model"""
+        if self._gemini_model is None:
+            with self._lock:
+                if self._gemini_model is None:
+                    if settings.GEMINI_BACKEND == 'fake':
+                        from .fake_llm import FakeGenerativeModel
+
+                        self._gemini_model = FakeGenerativeModel(
+                            delay=settings.GEMINI_FAKE_DELAY,
+                            jitter=settings.GEMINI_FAKE_JITTER,
+                            failure_rate=settings.GEMINI_FAKE_FAILURE_RATE,
+                        )
+                        logger.info("Using the offline fake Gemini model")
+                        return self._gemini_model
+
+                    import google.generativeai as genai
+
+                    genai.configure(api_key=settings.GEMINI_API_KEY)
+                    self._gemini_model = genai.GenerativeModel(settings.GEMINI_MODEL_NAME)
+                    logger.info(f"Initialized Gemini API with {settings.GEMINI_MODEL_NAME}")
+        return self._gemini_model
+
+    def get_llm_client(self):
+        """
+        Shared resilient client around the Gemini model (rag/llm_client.py);
+        its limiters and circuit breaker cover every call of the process
+        """
+        if self._llm_client is None:
+            with self._lock:
+                if self._llm_client is None:
+                    from .llm_client import ResilientLLMClient
+
+                    self._llm_client = ResilientLLMClient(self.get_gemini_model())
+        return self._llm_client
+
+    def ensure_collection(self, name, create_collection):
+        """
+        Run the check for a collection once per process.
+
+        Args:
+            name: collection name
+            create_collection: callable that verifies/creates the collection
+        """
+        if name in self._ready_collections:
+            return
+        with self._lock:
+            if name not in self._ready_collections:
+                create_collection()
+                self._ready_collections.add(name)
+
+    def warm_up(self):
+        """
+        Load every shared dependency up front so the first request
+        doesn't pay for model loading and the collection check.
+        """
+        from .qdrant_service import QdrantService
+
+        try:
+            self.get_embedding_model()
+            if settings.RAG_RERANK_ENABLED:
+                self.get_reranker_model()
+            QdrantService()
+            self.get_gemini_model()
+            logger.info("RAG services warmed up")
+        except Exception as e:
+            # Don't prevent the process from starting; the services
+            # will be loaded again lazily on the first request.
+            logger.error(f"Error warming up RAG services: {e}")
+
+    def reset_connections(self):
+        """
+        Drop the network clients but keep the loaded model.
+        Called in forked worker processes, which must not share
+        HTTP/gRPC connections with their parent.
+        """
+        with self._lock:
+            self._qdrant_client = None
+            self._gemini_model = None
+            self._llm_client = None
+            self._async_qdrant_clients = weakref.WeakKeyDictionary()
+            self._embedding_executor = None
+            self._embedding_batcher = None
+            self._retrieval_executor = None
+            self._redis_client = None
+
+    def reset(self):
+        """Drop every cached dependency"""
+        with self._lock:
+            self._embedding_model = None
+            self._reranker_model = None
+            self._qdrant_client = None
+            self._gemini_model = None
+            self._llm_client = None
+            self._ready_collections = set()
+            self._async_qdrant_clients = weakref.WeakKeyDictionary()
+            self._embedding_executor = None
+            self._embedding_batcher = None
+            self._retrieval_executor = None
+            self._embedding_cache = None
+            self._redis_client = None
+
+
+registry = ServiceRegistry()
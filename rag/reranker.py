@@ -0,0 +1,77 @@
+from django.conf import settings
+from .registry import registry
+from . import metrics
+import asyncio
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class Reranker:
+    """
+    Cross-encoder reranking of first-pass candidates under a time budget
+
+    Candidates are scored in small batches in first-pass order. Before each
+    batch the reranker checks whether it still fits the budget (judging by
+    the previous batch); once it doesn't, the remaining candidates keep their
+    first-pass order behind the reranked ones. So a slow request degrades to
+    the plain vector/hybrid ranking instead of missing its deadline.
+
+    Metrics: rag_rerank_seconds histogram, rag_rerank_fallbacks_total{reason}.
+    """
+
+    def __init__(self, budget_ms: float = None, batch_size: int = None):
+        self.budget = (settings.RAG_RERANK_BUDGET_MS if budget_ms is None else budget_ms) / 1000
+        self.batch_size = batch_size or settings.RAG_RERANK_BATCH_SIZE
+
+    def rerank(self, query: str, results: list, limit: int) -> list:
+        """
+        Reorder search results by cross-encoder relevance
+        Returns: the top `limit` results, each with a 'rerank_score' (None if unscored)
+        """
+        if len(results) <= 1:
+            return results[:limit]
+
+        started_at = time.monotonic()
+        deadline = started_at + self.budget
+        scores = []
+        batch_seconds = 0.0
+        try:
+            model = registry.get_reranker_model()
+            for start in range(0, len(results), self.batch_size):
+                if time.monotonic() + batch_seconds > deadline:
+                    metrics.increment('rag_rerank_fallbacks_total', reason='budget')
+                    break
+                batch_started_at = time.monotonic()
+                batch = results[start:start + self.batch_size]
+                scores.extend(
+                    float(score) for score in model.predict(
+                        [(query, f"{result['title']}\n{result['content']}") for result in batch],
+                        batch_size=len(batch),
+                        show_progress_bar=False,
+                    )
+                )
+                batch_seconds = time.monotonic() - batch_started_at
+        except Exception as e:
+            logger.error(f"Error reranking results: {e}")
+            metrics.increment('rag_rerank_fallbacks_total', reason='error')
+            scores = []
+
+        metrics.observe('rag_rerank_seconds', time.monotonic() - started_at)
+
+        # Stable sort: ties and unscored candidates keep their first-pass order
+        scored = sorted(
+            (dict(result, rerank_score=score) for result, score in zip(results, scores)),
+            key=lambda result: result['rerank_score'],
+            reverse=True,
+        )
+        unscored = [dict(result, rerank_score=None) for result in results[len(scores):]]
+        return (scored + unscored)[:limit]
+
+    async def arerank(self, query: str, results: list, limit: int) -> list:
+        """Async variant of rerank(); the model runs in the retrieval executor"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            registry.get_retrieval_executor(), self.rerank, query, results, limit
+        )
@@ -0,0 +1,57 @@
+from celery import shared_task
+from api.models import ChatSession, Message
+from django.conf import settings
+from django.core.cache import cache
+from django.utils import timezone
+from .gemini_service import GeminiService
+from .memory import SUMMARY_LOCK_KEY
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+@shared_task(bind=True, max_retries=3, default_retry_delay=30)
+def summarize_session_task(self, session_id: int):
+    """
+    Fold the turns older than the verbatim window into the session summary
+
+    Runs off the request path. The summary is only written if no other run
+    moved it forward in the meantime, so retries and duplicates are harmless.
+    """
+    try:
+        session = ChatSession.objects.get(id=session_id)
+        messages = list(
+            Message.objects.filter(session=session, id__gt=session.summary_last_message_id).order_by('id')
+        )
+        to_fold = messages[:-settings.RAG_MEMORY_TURNS] if settings.RAG_MEMORY_TURNS else messages
+        if not to_fold:
+            cache.delete(SUMMARY_LOCK_KEY.format(session_id))
+            return {'status': 'skipped', 'session_id': session_id}
+        
+        summary = GeminiService().summarize_conversation(
+            session.summary,
+            [(message.user_message, message.bot_response) for message in to_fold],
+        )
+        
+        updated = ChatSession.objects.filter(
+            id=session_id, summary_last_message_id=session.summary_last_message_id
+        ).update(
+            summary=summary[:settings.RAG_MEMORY_SUMMARY_CHARS],
+            summary_last_message_id=to_fold[-1].id,
+            summary_updated_at=timezone.now(),
+        )
+        cache.delete(SUMMARY_LOCK_KEY.format(session_id))
+        logger.info(f"Summarized {len(to_fold)} messages of session {session_id}")
+        return {'status': 'success' if updated else 'superseded', 'session_id': session_id}
+        
+    except ChatSession.DoesNotExist:
+        cache.delete(SUMMARY_LOCK_KEY.format(session_id))
+        logger.error(f"Chat session with id {session_id} not found")
+        return {'status': 'error', 'message': 'Chat session not found'}
+        
+    except Exception as e:
+        logger.error(f"Error summarizing session {session_id}: {str(e)}", exc_info=True)
+        if self.request.retries >= self.max_retries:
+            cache.delete(SUMMARY_LOCK_KEY.format(session_id))
+            return {'status': 'error', 'message': str(e)}
+        raise self.retry(exc=e)
@@ -1,3 +1,684 @@
-from django.test import TestCase
+from django.conf import settings
+from django.test import SimpleTestCase, override_settings
+from pathlib import Path
+from unittest import mock
+from qdrant_client import QdrantClient
+from django.core.cache import cache
+from rag.chat_service import ChatService
+from rag.chunking import SPECIAL_TOKENS, chunk_page
+from rag.embedding_cache import EmbeddingCache
+from rag.extractive import ExtractiveAnswerer
+from rag.fake_llm import FakeGenerativeModel, FakeResponse, ResourceExhausted
+from rag.gemini_service import GeminiService
+from rag.hybrid_retriever import reciprocal_rank_fusion
+from rag.lexical_index import LexicalIndex
+from rag.llm_client import CircuitBreaker, ConcurrencyLimiter, LLMUnavailableError, ResilientLLMClient, TokenBucket
+from rag.embedding_backends import ONNX_MODEL_FILE, ONNX_QUANTIZED_MODEL_FILE, TOKENIZER_FILE
+from rag.management.commands.check_embedding_parity import SAMPLE_TEXTS
+from rag.memory import is_follow_up
+from rag.qdrant_service import QdrantService
+from rag.registry import registry
+from rag.vector_stores import LocalVectorIndex, LocalVectorStore
+import asyncio
+import importlib.util
+import re
+import tempfile
+import time
+import unittest
+import uuid
+import numpy as np
 
-# Create your tests here.
+
+def _missing_onnx_parity_requirements() -> str:
+    """Why the parity test can't run here, or '' if it can"""
+    for module in ('torch', 'sentence_transformers', 'onnxruntime', 'tokenizers'):
+        if importlib.util.find_spec(module) is None:
+            return f"{module} is not installed"
+    model_dir = Path(settings.RAG_ONNX_MODEL_DIR)
+    if not (model_dir / TOKENIZER_FILE).is_file():
+        return f"no ONNX export in {model_dir} (run manage.py export_onnx_model)"
+    return ''
+
+
+ONNX_PARITY_SKIP_REASON = _missing_onnx_parity_requirements()
+
+
+@unittest.skipIf(ONNX_PARITY_SKIP_REASON, ONNX_PARITY_SKIP_REASON)
+class EmbeddingParityTests(SimpleTestCase):
+    """The ONNX backend must embed like the sentence-transformers reference"""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        from rag.embedding_backends import SentenceTransformerBackend
+
+        cls.reference = cls._normalized(SentenceTransformerBackend(settings.RAG_EMBEDDING_MODEL).encode(SAMPLE_TEXTS))
+
+    @staticmethod
+    def _normalized(vectors) -> np.ndarray:
+        vectors = np.asarray(vectors, dtype=np.float32)
+        return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+    def _assert_parity(self, quantized: bool, tolerance: float):
+        from rag.embedding_backends import OnnxEmbeddingBackend
+
+        model_file = ONNX_QUANTIZED_MODEL_FILE if quantized else ONNX_MODEL_FILE
+        if not (Path(settings.RAG_ONNX_MODEL_DIR) / model_file).is_file():
+            self.skipTest(f"{model_file} was not exported")
+        candidate = self._normalized(
+            OnnxEmbeddingBackend(settings.RAG_ONNX_MODEL_DIR, quantized=quantized).encode(SAMPLE_TEXTS)
+        )
+        self.assertEqual(candidate.shape, self.reference.shape)
+        similarities = (self.reference * candidate).sum(axis=1)
+        self.assertGreaterEqual(similarities.min(), tolerance)
+
+    def test_fp32_model_matches_reference(self):
+        self._assert_parity(quantized=False, tolerance=0.999)
+
+    def test_int8_model_matches_reference(self):
+        self._assert_parity(quantized=True, tolerance=0.99)
+
+    def test_single_text_returns_a_vector(self):
+        from rag.embedding_backends import OnnxEmbeddingBackend
+
+        backend = OnnxEmbeddingBackend(settings.RAG_ONNX_MODEL_DIR, quantized=True)
+        self.assertEqual(backend.encode(SAMPLE_TEXTS[0]).shape, (self.reference.shape[1],))
+
+
+class FollowUpTests(SimpleTestCase):
+    """Only questions that depend on earlier turns are rewritten"""
+
+    def test_references_are_follow_ups(self):
+        self.assertTrue(is_follow_up("Does it ship to Canada?"))
+        self.assertTrue(is_follow_up("How much do those cost in the winter sale for members?"))
+
+    def test_short_elliptical_questions_are_follow_ups(self):
+        self.assertTrue(is_follow_up("What about pricing?"))
+        self.assertTrue(is_follow_up("and on weekends?"))
+
+    def test_short_standalone_questions_are_not(self):
+        self.assertFalse(is_follow_up("What are your opening hours?"))
+        self.assertFalse(is_follow_up("Where is the shop?"))
+        self.assertFalse(is_follow_up("Refund policy"))
+
+
+def _points(website_id: int, page_ids: list, size: int = 8, seed: int = 0):
+    """IDs, vectors and payloads of one point per page"""
+    rng = np.random.default_rng(seed)
+    ids = [str(uuid.uuid5(uuid.NAMESPACE_URL, f"{website_id}/{page_id}")) for page_id in page_ids]
+    payloads = [
+        {'page_id': page_id, 'website_id': website_id, 'url': f"https://example.com/{page_id}",
+         'title': f"Page {page_id}", 'content': f"Content of page {page_id}", 'chunk_index': 0}
+        for page_id in page_ids
+    ]
+    return ids, rng.normal(size=(len(page_ids), size)).astype(np.float32), payloads
+
+
+class LocalVectorStoreTestCase(SimpleTestCase):
+    """Local store tests write their indexes to a temporary directory"""
+
+    def setUp(self):
+        super().setUp()
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        overrides = override_settings(RAG_VECTOR_STORE='local', RAG_LOCAL_VECTOR_DIR=directory.name)
+        overrides.enable()
+        self.addCleanup(overrides.disable)
+
+
+class LocalVectorIndexTests(LocalVectorStoreTestCase):
+
+    def test_search_returns_cosine_scores_best_first(self):
+        ids, vectors, payloads = _points(1, [10, 11, 12])
+        index = LocalVectorIndex(1)
+        index.upsert(ids, vectors, payloads)
+
+        results = index.search(vectors[1] * 3, limit=2)
+        self.assertEqual([result['page_id'] for result in results][0], 11)
+        self.assertEqual(len(results), 2)
+        self.assertAlmostEqual(results[0]['score'], 1.0, places=5)
+        self.assertGreaterEqual(results[0]['score'], results[1]['score'])
+
+    def test_upsert_replaces_points_with_the_same_id(self):
+        ids, vectors, payloads = _points(1, [10, 11])
+        index = LocalVectorIndex(1)
+        index.upsert(ids, vectors, payloads)
+        replacement = np.ones((1, vectors.shape[1]), dtype=np.float32)
+        index.upsert(ids[:1], replacement, [dict(payloads[0], content='Updated')])
+
+        self.assertEqual(len(index), 2)
+        result = index.search(replacement[0], limit=2)[0]
+        self.assertEqual(result['id'], ids[0])
+        self.assertEqual(result['content'], 'Updated')
+
+    def test_remove_pages(self):
+        ids, vectors, payloads = _points(1, [10, 11, 12])
+        index = LocalVectorIndex(1)
+        index.upsert(ids, vectors, payloads)
+        index.remove_pages([10, 12])
+
+        self.assertEqual(index.ids, [ids[1]])
+        self.assertEqual([result['page_id'] for result in index.search(vectors[0], limit=5)], [11])
+
+    def test_update_persists_and_removes_empty_indexes(self):
+        ids, vectors, payloads = _points(1, [10, 11])
+        store = LocalVectorStore()
+        store.upload(1, ids, vectors, payloads)
+
+        self.assertTrue(store.exists(1))
+        self.assertEqual(store.count(1), 2)
+        self.assertEqual(store.search(vectors[0], 1, website_id=1)[0]['id'], ids[0])
+
+        store.delete_by_page_ids([10, 11], website_id=1)
+        self.assertFalse(store.exists(1))
+
+
+@override_settings(
+    QDRANT_COLLECTION_NAME='test_local_to_qdrant',
+    QDRANT_DEDICATED_COLLECTION_WEBSITES=[],
+    RAG_LOCAL_VECTOR_MAX_POINTS=3,
+)
+class LocalToQdrantTests(LocalVectorStoreTestCase):
+    """'auto' keeps a small website local and moves it to Qdrant (in memory) once it outgrows the local store"""
+
+    def setUp(self):
+        super().setUp()
+        overrides = override_settings(RAG_VECTOR_STORE='auto')
+        overrides.enable()
+        self.addCleanup(overrides.disable)
+        # A fresh in-memory Qdrant per test, so collections aren't memoized across clients
+        for patcher in (
+            mock.patch.object(registry, 'get_qdrant_client', return_value=QdrantClient(location=':memory:')),
+            mock.patch.object(registry, 'ensure_collection', lambda name, create_collection: create_collection()),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.service = QdrantService()
+
+    def _upload(self, page_ids: list, seed: int):
+        ids, vectors, payloads = _points(1, page_ids, size=self.service.vector_size, seed=seed)
+        self.service.upload_chunks([{'id': point_id, 'payload': payload} for point_id, payload in zip(ids, payloads)],
+                                   vectors)
+        return vectors
+
+    def test_small_website_stays_local(self):
+        vectors = self._upload([10, 11], seed=1)
+
+        self.assertIs(self.service.store_for(1), self.service.local_store)
+        self.assertEqual(self.service.qdrant_store.count(1), 0)
+        self.assertEqual(self.service.search('', limit=1, website_id=1, query_vector=vectors[1])[0]['page_id'], 11)
+
+    def test_website_moves_to_qdrant_past_the_local_limit(self):
+        self._upload([10, 11], seed=1)
+        vectors = self._upload([12, 13], seed=2)
+
+        self.assertFalse(LocalVectorIndex.exists(1))
+        self.assertIs(self.service.store_for(1), self.service.qdrant_store)
+        self.assertEqual(self.service.qdrant_store.count(1), 4)
+        result = self.service.search('', limit=1, website_id=1, query_vector=vectors[0])[0]
+        self.assertEqual(result['page_id'], 12)
+        self.assertAlmostEqual(result['score'], 1.0, places=4)
+
+        # Later batches go straight to Qdrant
+        self._upload([14], seed=3)
+        self.assertFalse(LocalVectorIndex.exists(1))
+        self.assertEqual(self.service.qdrant_store.count(1), 5)
+
+
+class ExtractiveSentenceScoreTests(SimpleTestCase):
+    """The extractive answer reuses the sentence scores of the prompt build"""
+
+    RESULT = {
+        'title': 'Visit us', 'url': 'https://example.com/hours', 'score': 0.9,
+        'content': "Our opening hours are Monday to Friday from 9am to 6pm. Parking is behind the building.",
+    }
+
+    def setUp(self):
+        super().setUp()
+        self.answerer = ExtractiveAnswerer(min_score=0.5, min_sentence_score=0.5, min_term_coverage=0.5)
+        self.answerer.enabled = True
+
+    def test_known_scores_are_not_embedded_again(self):
+        scores = {
+            "Our opening hours are Monday to Friday from 9am to 6pm.": 0.8,
+            "Parking is behind the building.": 0.1,
+        }
+        with mock.patch('rag.extractive.sentence_similarities') as similarities:
+            span = self.answerer.find("opening hours", np.ones(4), [self.RESULT], sentence_scores=scores)
+        similarities.assert_not_called()
+        self.assertAlmostEqual(span['sentence_score'], 0.8, places=5)
+        self.assertTrue(span['text'].startswith("Our opening hours"))
+
+    def test_only_unscored_sentences_are_embedded(self):
+        scores = {"Our opening hours are Monday to Friday from 9am to 6pm.": 0.8}
+        with mock.patch('rag.extractive.sentence_similarities', return_value=np.array([0.1])) as similarities:
+            span = self.answerer.find("opening hours", np.ones(4), [self.RESULT], sentence_scores=scores)
+        self.assertEqual(similarities.call_args.args[0], ["Parking is behind the building."])
+        self.assertAlmostEqual(span['sentence_score'], 0.8, places=5)
+
+
+@override_settings(
+    RAG_VECTOR_STORE='local', RAG_ANSWER_CACHE_ENABLED=True,
+    RAG_PROMPT_COMPRESSION_ENABLED=False, RAG_EXTRACTIVE_ENABLED=False,
+)
+class AnswerCacheHistoryTests(SimpleTestCase):
+    """Answers generated with a session's history are not served to other histories"""
+
+    RESULTS = [{
+        'id': 'chunk-1', 'page_id': 1, 'title': 'Returns', 'url': 'https://example.com/returns',
+        'content': "Items can be returned within thirty days of delivery.", 'score': 0.9,
+    }]
+
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        self.addCleanup(cache.clear)
+        for patcher in (
+            mock.patch.object(GeminiService, '__init__', return_value=None),
+            mock.patch.object(
+                GeminiService, 'generate_response',
+                side_effect=lambda query, context, history='': f"Answer given after: {history or 'nothing'}",
+            ),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.chat = ChatService(website_id=1)
+        self.query_vector = np.ones(8, dtype=np.float32)
+
+    def _answer(self, turns: list) -> str:
+        memory = {'summary': '', 'turns': turns}
+        question = "Can I return it?"
+        retrieval = self.chat._retrieval(question, question, self.RESULTS, self.query_vector, memory)
+        return self.chat.answer(question, retrieval)
+
+    def test_sessions_with_different_history_do_not_share_an_answer(self):
+        first = self._answer([("Do you sell kayaks?", "Yes, three models.")])
+        second = self._answer([("Do you sell tents?", "Yes, two models.")])
+
+        self.assertIn("kayaks", first)
+        self.assertIn("tents", second)
+        self.assertEqual(GeminiService.generate_response.call_count, 2)
+
+    def test_same_history_reuses_the_answer(self):
+        turns = [("Do you sell kayaks?", "Yes, three models.")]
+        first = self._answer(turns)
+
+        self.assertEqual(self._answer(turns), first)
+        self.assertEqual(GeminiService.generate_response.call_count, 1)
+
+    def test_private_answers_are_not_fallbacks(self):
+        self._answer([("Do you sell kayaks?", "Yes, three models.")])
+        self.assertIsNone(self.chat.answer_cache.get_fallback(self.query_vector))
+
+        shared = self._answer([])
+        self.assertEqual(self.chat.answer_cache.get_fallback(self.query_vector), shared)
+
+
+class FakeClock:
+    """Stands in for the time module in rag.llm_client"""
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self):
+        return self.now
+
+    def time(self):
+        return self.now
+
+
+class LLMClientTestCase(SimpleTestCase):
+    def setUp(self):
+        super().setUp()
+        self.clock = FakeClock()
+        patcher = mock.patch('rag.llm_client.time', self.clock)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+
+class CircuitBreakerTests(LLMClientTestCase):
+    def setUp(self):
+        super().setUp()
+        self.breaker = CircuitBreaker(failure_threshold=3, reset_seconds=30, name='test')
+
+    def _open(self):
+        for _ in range(3):
+            self.breaker.record_failure()
+
+    def test_opens_after_the_threshold(self):
+        self.breaker.record_failure()
+        self.breaker.record_failure()
+        self.assertEqual(self.breaker.state, 'closed')
+        self.assertTrue(self.breaker.allow())
+
+        self.breaker.record_failure()
+        self.assertEqual(self.breaker.state, 'open')
+        self.assertFalse(self.breaker.allow())
+
+    def test_success_resets_the_failure_count(self):
+        self.breaker.record_failure()
+        self.breaker.record_failure()
+        self.breaker.record_success()
+        self.breaker.record_failure()
+
+        self.assertEqual(self.breaker.state, 'closed')
+
+    def test_half_open_lets_one_trial_call_through(self):
+        self._open()
+        self.clock.now += 30
+
+        self.assertEqual(self.breaker.state, 'half_open')
+        self.assertTrue(self.breaker.allow())
+        # The trial is in flight; everyone else still fails fast
+        self.assertFalse(self.breaker.allow())
+
+    def test_trial_success_closes(self):
+        self._open()
+        self.clock.now += 30
+        self.breaker.allow()
+        self.breaker.record_success()
+
+        self.assertEqual(self.breaker.state, 'closed')
+        self.assertTrue(self.breaker.allow())
+
+    def test_trial_failure_reopens_for_another_period(self):
+        self._open()
+        self.clock.now += 30
+        self.breaker.allow()
+        self.breaker.record_failure()
+
+        self.assertEqual(self.breaker.state, 'open')
+        self.clock.now += 29
+        self.assertFalse(self.breaker.allow())
+        self.clock.now += 1
+        self.assertTrue(self.breaker.allow())
+
+
+@override_settings(GEMINI_LIMITER_REDIS_ENABLED=False, GEMINI_BREAKER_FAILURES=2, GEMINI_MAX_RETRIES=0)
+class ResilientLLMClientBreakerTests(SimpleTestCase):
+    def setUp(self):
+        super().setUp()
+        self.client = ResilientLLMClient(FakeGenerativeModel())
+
+    def test_non_transient_errors_leave_the_breaker_alone(self):
+        self.client._failed(ResourceExhausted("429"), 0)
+        self.assertFalse(self.client._failed(ValueError("bad prompt"), 0))
+        # The earlier transient failure still counts
+        self.client._failed(ResourceExhausted("429"), 0)
+
+        self.assertEqual(self.client.breaker.state, 'open')
+
+    def test_non_transient_errors_do_not_close_an_open_breaker(self):
+        for _ in range(2):
+            self.client._failed(ResourceExhausted("429"), 0)
+        self.client._failed(ValueError("bad prompt"), 0)
+
+        self.assertEqual(self.client.breaker.state, 'open')
+
+
+class ConcurrencyLimiterTests(SimpleTestCase):
+    def test_local_limit_and_release(self):
+        limiter = ConcurrencyLimiter(limit=2)
+        permits = [limiter.try_acquire(), limiter.try_acquire()]
+
+        self.assertEqual(permits, ['', ''])
+        self.assertIsNone(limiter.try_acquire())
+        self.assertEqual(limiter.active, 2)
+
+        limiter.release(permits[0])
+        self.assertEqual(limiter.active, 1)
+        self.assertEqual(limiter.try_acquire(), '')
+
+
+class TokenBucketTests(LLMClientTestCase):
+    def test_burst_then_rate(self):
+        bucket = TokenBucket(per_minute=60, burst=2, redis_enabled=False)
+
+        self.assertEqual(bucket.take(), 0)
+        self.assertEqual(bucket.take(), 0)
+        self.assertAlmostEqual(bucket.take(), 1.0)
+
+        self.clock.now += 0.5
+        self.assertAlmostEqual(bucket.take(), 0.5)
+        self.clock.now += 0.5
+        self.assertEqual(bucket.take(), 0)
+
+    def test_refill_is_capped_at_the_burst(self):
+        bucket = TokenBucket(per_minute=60, burst=2, redis_enabled=False)
+        self.clock.now += 600
+
+        self.assertEqual([bucket.take() for _ in range(2)], [0, 0])
+        self.assertGreater(bucket.take(), 0)
+
+    def test_zero_rate_disables_the_limit(self):
+        bucket = TokenBucket(per_minute=0, burst=1, redis_enabled=False)
+
+        self.assertEqual([bucket.take() for _ in range(5)], [0] * 5)
+
+
+class StallingModel:
+    """Streams `pieces`, stalling for `stall` seconds before the piece at `stall_at`"""
+
+    def __init__(self, pieces: list, stall_at: int, stall: float, stalled_calls: int = 1):
+        self.pieces = pieces
+        self.stall_at = stall_at
+        self.stall = stall
+        self.stalled_calls = stalled_calls
+        self.calls = 0
+
+    def generate_content(self, prompt, stream: bool = False, **kwargs):
+        self.calls += 1
+        stalls = self.calls <= self.stalled_calls
+        for index, piece in enumerate(self.pieces):
+            if stalls and index == self.stall_at:
+                time.sleep(self.stall)
+            yield FakeResponse(piece)
+
+
+@override_settings(
+    GEMINI_LIMITER_REDIS_ENABLED=False, GEMINI_TIMEOUT=0.1, GEMINI_MAX_RETRIES=1,
+    GEMINI_RETRY_BASE_DELAY=0, GEMINI_BREAKER_FAILURES=5,
+)
+class ResilientLLMClientStreamTests(SimpleTestCase):
+    def test_stall_before_the_first_piece_is_retried(self):
+        model = StallingModel(['one', ' two'], stall_at=0, stall=0.5)
+        client = ResilientLLMClient(model)
+
+        self.assertEqual(''.join(client.stream("prompt")), 'one two')
+        self.assertEqual(model.calls, 2)
+
+    def test_stall_between_pieces_fails_the_stream(self):
+        client = ResilientLLMClient(StallingModel(['one', ' two'], stall_at=1, stall=0.5))
+        stream = client.stream("prompt")
+
+        self.assertEqual(next(stream), 'one')
+        with self.assertRaises(LLMUnavailableError):
+            next(stream)
+
+    def test_slot_is_freed_when_the_stream_ends(self):
+        client = ResilientLLMClient(FakeGenerativeModel())
+        list(client.stream("Content: Shipping is free. Returns are easy."))
+        client.executor.shutdown(wait=True)
+
+        self.assertEqual(client.limiter.active, 0)
+
+
+class PieceTokenizer:
+    """Stand-in for the model's tokenizer: words split into pieces of up to 3 characters"""
+
+    def encode(self, text: str, add_special_tokens: bool = True):
+        offsets = []
+        for match in re.finditer(r'\S+', text):
+            for start in range(match.start(), match.end(), 3):
+                offsets.append((start, min(start + 3, match.end())))
+        return mock.Mock(offsets=offsets)
+
+    def count(self, text: str) -> int:
+        return len(self.encode(text).offsets)
+
+
+@override_settings(RAG_CHUNK_TOKENS=40, RAG_CHUNK_OVERLAP=8, RAG_EMBEDDING_MAX_TOKENS=48)
+class ChunkPageTests(SimpleTestCase):
+    URL = 'https://example.com/returns'
+    TITLE = "Returns and refunds for orders shipped abroad"
+    CONTENT = ' '.join(
+        ["Items can be returned within thirty days of delivery."] * 12
+        + ["See https://example.com/help/returns/international-orders?lang=en&region=eu-west for details."]
+        + ["Refunds reach the original payment method in 5-10 business days."] * 12
+    )
+
+    def setUp(self):
+        super().setUp()
+        self.tokenizer = PieceTokenizer()
+        patcher = mock.patch.object(registry, 'get_chunk_tokenizer', return_value=self.tokenizer)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def _chunks(self, website_id=1):
+        return chunk_page(7, self.URL, self.TITLE, self.CONTENT, website_id=website_id)
+
+    def test_ids_are_stable_across_runs(self):
+        chunks = self._chunks()
+
+        self.assertGreater(len(chunks), 1)
+        # uuid5 of website/url/index: the same in every process and release
+        self.assertEqual(chunks[0]['id'], 'b2b66261-3584-550c-9b8f-d8a6f6a80653')
+        self.assertEqual([chunk['id'] for chunk in self._chunks()], [chunk['id'] for chunk in chunks])
+        self.assertEqual(len({chunk['id'] for chunk in chunks}), len(chunks))
+
+    def test_ids_differ_between_websites(self):
+        first, second = self._chunks(website_id=1), self._chunks(website_id=2)
+
+        self.assertFalse({chunk['id'] for chunk in first} & {chunk['id'] for chunk in second})
+
+    def test_no_window_exceeds_the_token_limit(self):
+        chunks = self._chunks()
+
+        for chunk in chunks:
+            self.assertLessEqual(self.tokenizer.count(chunk['text']), 40)
+            self.assertLessEqual(self.tokenizer.count(chunk['embed_text']) + SPECIAL_TOKENS, 48)
+        # The windows cover the whole page
+        self.assertEqual(chunks[0]['payload']['char_start'], 0)
+        self.assertEqual(chunks[-1]['payload']['char_end'], len(self.CONTENT))
+
+
+class ReciprocalRankFusionTests(SimpleTestCase):
+    @staticmethod
+    def _results(ids: list) -> list:
+        return [{'id': result_id, 'score': 1.0 - rank / 10} for rank, result_id in enumerate(ids)]
+
+    def test_fusion_order_with_k_60(self):
+        fused = reciprocal_rank_fusion(
+            [('vector', self._results(['x', 'a', 'y'])), ('lexical', self._results(['b', 'y', 'c']))],
+            limit=10,
+        )
+
+        # y is third and second: 1/63 + 1/62 beats a single first place (1/61);
+        # ties keep the order of the legs
+        self.assertEqual([result['id'] for result in fused], ['y', 'x', 'b', 'a', 'c'])
+        self.assertAlmostEqual(fused[0]['score'], 1 / 63 + 1 / 62)
+        self.assertAlmostEqual(fused[1]['score'], 1 / 61)
+        self.assertEqual((fused[0]['vector_score'], fused[0]['lexical_score']), (0.8, 0.9))
+        self.assertEqual((fused[1]['vector_score'], fused[1]['lexical_score']), (1.0, None))
+
+    def test_limit(self):
+        fused = reciprocal_rank_fusion([('vector', self._results(['x', 'a', 'y']))], limit=2)
+
+        self.assertEqual([result['id'] for result in fused], ['x', 'a'])
+
+
+@override_settings(RAG_CHUNK_TOKENS=24, RAG_CHUNK_OVERLAP=4)
+class LexicalIndexTests(SimpleTestCase):
+    def setUp(self):
+        super().setUp()
+        patcher = mock.patch.object(registry, 'get_chunk_tokenizer', return_value=PieceTokenizer())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.index = LexicalIndex(website_id=1)
+
+    @staticmethod
+    def _document(page_id: int, content: str) -> dict:
+        return {'page_id': page_id, 'url': f'https://example.com/{page_id}', 'title': 'Help', 'content': content}
+
+    def assertConsistent(self):
+        chunk_ids = [chunk_id for chunk_ids in self.index.page_chunks.values() for chunk_id in chunk_ids]
+        self.assertCountEqual(chunk_ids, self.index.documents)
+        for chunk_id, document in self.index.documents.items():
+            self.assertIn(chunk_id, self.index.page_chunks[document['result']['page_id']])
+        self.assertEqual(self.index.total_length, sum(document['length'] for document in self.index.documents.values()))
+        for term, postings in self.index.postings.items():
+            self.assertTrue(postings)
+            self.assertLessEqual(set(postings), set(self.index.documents))
+
+    def test_add_documents_tracks_every_chunk(self):
+        self.index.add_documents([
+            self._document(1, "Kayaks ship within two days. " * 10),
+            self._document(2, "Tents can be returned within thirty days."),
+        ])
+
+        self.assertEqual(set(self.index.page_chunks), {1, 2})
+        self.assertGreater(len(self.index.page_chunks[1]), 1)
+        self.assertConsistent()
+
+    def test_reindexing_a_page_replaces_its_chunks(self):
+        self.index.add_documents([
+            self._document(1, "Kayaks ship within two days. " * 10),
+            self._document(2, "Tents can be returned within thirty days."),
+        ])
+        self.index.add_documents([self._document(1, "Paddles are sold separately.")])
+
+        self.assertEqual(len(self.index.page_chunks[1]), 1)
+        self.assertConsistent()
+        self.assertEqual(self.index.search("kayaks"), [])
+        self.assertEqual([result['page_id'] for result in self.index.search("paddles")], [1])
+
+    def test_remove_pages(self):
+        self.index.add_documents([
+            self._document(1, "Kayaks ship within two days. " * 10),
+            self._document(2, "Tents can be returned within thirty days."),
+        ])
+        self.index.remove_pages([1, 3])
+
+        self.assertEqual(set(self.index.page_chunks), {2})
+        self.assertConsistent()
+        self.assertNotIn('kayaks', self.index.postings)
+        self.assertEqual([result['page_id'] for result in self.index.search("tents")], [2])
+
+
+@override_settings(
+    RAG_VECTOR_STORE='local', RAG_EMBEDDING_CACHE_ENABLED=True,
+    RAG_EMBEDDING_CACHE_REDIS_ENABLED=False, RAG_EMBED_BATCHER_ENABLED=False,
+)
+class QueryEmbeddingCacheTests(SimpleTestCase):
+    """Long queries sharing a prefix don't share a cached embedding"""
+
+    def setUp(self):
+        super().setUp()
+        for patcher in (
+            mock.patch.object(registry, 'get_embedding_cache', return_value=EmbeddingCache()),
+            mock.patch.object(
+                QdrantService, '_encode_query', side_effect=lambda text: np.full(4, len(text), dtype=np.float32)
+            ),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.service = QdrantService()
+        self.encode = QdrantService._encode_query
+        prefix = "Compare the warranty terms of these products: " + "kayak " * 1000
+        self.texts = [prefix + "which one covers water damage?", prefix + "which one ships fastest?"]
+
+    def test_long_queries_are_embedded_whole(self):
+        first, second = (self.service.generate_embedding(text) for text in self.texts)
+
+        self.assertEqual(self.encode.call_count, 2)
+        self.assertEqual([call.args[0] for call in self.encode.call_args_list], self.texts)
+        self.assertFalse(np.array_equal(first, second))
+
+    def test_async_long_queries_are_embedded_whole(self):
+        async def embed():
+            return [await self.service.agenerate_embedding(text) for text in self.texts]
+
+        first, second = asyncio.run(embed())
+
+        self.assertEqual(self.encode.call_count, 2)
+        self.assertFalse(np.array_equal(first, second))
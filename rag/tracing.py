@@ -0,0 +1,154 @@
+from contextlib import contextmanager
+from . import metrics
+import contextvars
+import functools
+import threading
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Trace of the request being handled. asyncio tasks and sync_to_async copy
+# it; thread pools need contextvars.copy_context() (see in_context).
+_current_trace = contextvars.ContextVar('rag_trace', default=None)
+
+# Histograms of every stage and of whole requests, by stage / endpoint
+STAGE_METRIC = 'rag_stage_seconds'
+REQUEST_METRIC = 'rag_request_seconds'
+
+
+class Span:
+    """One timed stage, with attributes such as token counts or result sizes"""
+
+    def __init__(self, name: str, attributes: dict):
+        self.name = name
+        self.attributes = dict(attributes)
+        self.seconds = None
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+    def as_dict(self) -> dict:
+        return {'stage': self.name, 'ms': round(self.seconds * 1000, 2), **self.attributes}
+
+
+class Trace:
+    """
+    Spans recorded while handling one request
+
+    Spans are appended as they end, from any thread or task sharing the
+    trace, so parallel stages (e.g. the two hybrid search legs) both show.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self.spans = []
+        self._started_at = time.perf_counter()
+        self._lock = threading.Lock()
+        self._finished = False
+
+    def add(self, span: Span):
+        with self._lock:
+            self.spans.append(span)
+
+    def span(self, name: str, **attributes):
+        """Time a stage of this trace, whether or not it is the current one"""
+        return _record(name, attributes, self)
+
+    def bind(self, func):
+        """
+        Wrap func to run with this trace as the current one, e.g. for the
+        pieces of a stream pulled after the request's view has returned
+        """
+        context = contextvars.copy_context()
+        context.run(_current_trace.set, self)
+        return functools.partial(context.run, func)
+
+    def elapsed(self) -> float:
+        return time.perf_counter() - self._started_at
+
+    def finish(self):
+        """Observe the request's duration in rag_request_seconds{endpoint} (once)"""
+        with self._lock:
+            if self._finished:
+                return
+            self._finished = True
+        seconds = self.elapsed()
+        metrics.observe(REQUEST_METRIC, seconds, endpoint=self.name)
+        logger.debug(f"Trace {self.name} ({seconds * 1000:.1f}ms): {self.timings()}")
+
+    def timings(self) -> list:
+        """Spans as dicts ('stage', 'ms' and the attributes), in the order they ended"""
+        with self._lock:
+            return [span.as_dict() for span in self.spans]
+
+    def server_timing(self) -> str:
+        """
+        Server-Timing header value: one entry per span plus 'total'
+        Attributes go in the description, e.g.
+        prompt_build;dur=1.8;desc="prompt_tokens=812 sources_used=3"
+        """
+        entries = []
+        for timing in self.timings():
+            entry = f"{timing.pop('stage')};dur={timing.pop('ms')}"
+            if timing:
+                desc = ' '.join(f"{key}={value}" for key, value in timing.items())
+                entry += ';desc="{}"'.format(desc.replace('\\', '\\\\').replace('"', '\\"'))
+            entries.append(entry)
+        entries.append(f"total;dur={round(self.elapsed() * 1000, 2)}")
+        return ', '.join(entries)
+
+
+@contextmanager
+def _record(name: str, attributes: dict, trace):
+    span = Span(name, attributes)
+    started_at = time.perf_counter()
+    try:
+        yield span
+    except BaseException as e:
+        span.set(error=type(e).__name__)
+        raise
+    finally:
+        span.seconds = time.perf_counter() - started_at
+        metrics.observe(STAGE_METRIC, span.seconds, stage=name)
+        if trace is not None:
+            trace.add(span)
+
+
+def span(name: str, **attributes):
+    """
+    Time a stage: observed in rag_stage_seconds{stage} and added to the
+    current trace, if any
+
+        with tracing.span('vector_search', limit=limit) as span:
+            results = ...
+            span.set(results=len(results))
+    """
+    return _record(name, attributes, _current_trace.get())
+
+
+def current_trace():
+    """Trace of the request being handled, or None"""
+    return _current_trace.get()
+
+
+@contextmanager
+def trace(name: str, finish: bool = True):
+    """
+    Collect the spans of a request; its duration is observed in
+    rag_request_seconds{endpoint=name} on exit, or with finish off when
+    the caller calls Trace.finish() (e.g. once a streamed response ends)
+    """
+    current = Trace(name)
+    token = _current_trace.set(current)
+    try:
+        yield current
+    finally:
+        _current_trace.reset(token)
+        if finish:
+            current.finish()
+
+
+def in_context(func):
+    """Wrap func to run in a copy of the caller's context (trace included), for thread pools"""
+    return functools.partial(contextvars.copy_context().run, func)
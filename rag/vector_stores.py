@@ -0,0 +1,403 @@
+from qdrant_client.models import (
+    Distance, VectorParams, Filter, FilterSelector, FieldCondition,
+    MatchAny, MatchValue, PayloadSchemaType, ScalarQuantization,
+    ScalarQuantizationConfig, ScalarType, BinaryQuantization,
+    BinaryQuantizationConfig, SearchParams, QuantizationSearchParams
+)
+from django.conf import settings
+from contextlib import contextmanager
+from pathlib import Path
+from .registry import registry
+import numpy as np
+import asyncio
+import fcntl
+import os
+import pickle
+import threading
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+# website_id -> (mtime, LocalVectorIndex); reloaded when the file changes
+_loaded = {}
+_loaded_lock = threading.Lock()
+
+
+def _result(point_id, payload: dict, score: float) -> dict:
+    """Search result dict shared by both stores"""
+    return {
+        'id': str(point_id),
+        'page_id': payload.get('page_id'),
+        'website_id': payload.get('website_id'),
+        'url': payload.get('url'),
+        'title': payload.get('title'),
+        'content': payload.get('content'),
+        'chunk_index': payload.get('chunk_index'),
+        'score': score
+    }
+
+
+class QdrantVectorStore:
+    """
+    Vectors in Qdrant: one shared collection filtered by website_id, plus
+    dedicated collections for the websites in QDRANT_DEDICATED_COLLECTION_WEBSITES
+    """
+
+    name = 'qdrant'
+
+    def __init__(self, vector_size: int):
+        self.client = registry.get_qdrant_client()
+        self.collection_name = settings.QDRANT_COLLECTION_NAME
+        self.vector_size = vector_size
+
+        # Create collection if it doesn't exist (checked once per process)
+        registry.ensure_collection(self.collection_name, self._ensure_collection_exists)
+
+    def collection_for(self, website_id: int = None) -> str:
+        """
+        Collection holding a website's vectors
+        Large tenants listed in QDRANT_DEDICATED_COLLECTION_WEBSITES get their
+        own collection; everyone else shares the default one.
+        """
+        if website_id is None or website_id not in settings.QDRANT_DEDICATED_COLLECTION_WEBSITES:
+            return self.collection_name
+
+        name = f"{self.collection_name}_site_{website_id}"
+        registry.ensure_collection(name, lambda: self._ensure_collection_exists(name))
+        return name
+
+    def _ensure_collection_exists(self, collection_name: str = None):
+        """Create collection and its payload indexes if they don't exist"""
+        collection_name = collection_name or self.collection_name
+        try:
+            collections = self.client.get_collections().collections
+            collection_names = [col.name for col in collections]
+
+            quantization_config = self._quantization_config()
+            if collection_name not in collection_names:
+                self.client.create_collection(
+                    collection_name=collection_name,
+                    vectors_config=VectorParams(
+                        size=self.vector_size,
+                        distance=Distance.COSINE,
+                        # Originals on disk only when the quantized copy serves searches
+                        on_disk=quantization_config is not None and settings.QDRANT_ORIGINALS_ON_DISK
+                    ),
+                    quantization_config=quantization_config
+                )
+                logger.info(f"Created collection: {collection_name} (quantization: {settings.QDRANT_QUANTIZATION})")
+            else:
+                logger.info(f"Collection {collection_name} already exists")
+                if quantization_config is not None:
+                    self.client.update_collection(
+                        collection_name=collection_name,
+                        quantization_config=quantization_config
+                    )
+
+            # Filtered search and deletes go through these fields;
+            # creating an existing index is a no-op.
+            for field_name in ('website_id', 'page_id'):
+                self.client.create_payload_index(
+                    collection_name=collection_name,
+                    field_name=field_name,
+                    field_schema=PayloadSchemaType.INTEGER,
+                )
+        except Exception as e:
+            logger.error(f"Error ensuring collection exists: {e}")
+            raise
+
+    def _quantization_config(self):
+        """Qdrant quantization settings for QDRANT_QUANTIZATION (None when disabled)"""
+        if settings.QDRANT_QUANTIZATION == 'scalar':
+            # int8 per dimension: 4x smaller than float32, kept in RAM
+            return ScalarQuantization(
+                scalar=ScalarQuantizationConfig(type=ScalarType.INT8, quantile=0.99, always_ram=True)
+            )
+        if settings.QDRANT_QUANTIZATION == 'binary':
+            # 1 bit per dimension: 32x smaller, needs rescoring for accuracy
+            return BinaryQuantization(binary=BinaryQuantizationConfig(always_ram=True))
+        return None
+
+    def _search_params(self):
+        """Rescore quantized candidates against the original vectors"""
+        if settings.QDRANT_QUANTIZATION == 'none':
+            return None
+        return SearchParams(
+            quantization=QuantizationSearchParams(
+                rescore=settings.QDRANT_RESCORE,
+                oversampling=settings.QDRANT_OVERSAMPLING
+            )
+        )
+
+    def _website_filter(self, website_id: int = None):
+        """Payload filter restricting a search to one website"""
+        if website_id is None:
+            return None
+        return Filter(
+            must=[FieldCondition(key='website_id', match=MatchValue(value=website_id))]
+        )
+
+    def upload(self, website_id: int, ids: list, vectors: np.ndarray, payloads: list):
+        """Upsert points in QDRANT_UPSERT_BATCH_SIZE batches"""
+        # Vectors stay a NumPy matrix; the client serializes it in batches
+        self.client.upload_collection(
+            collection_name=self.collection_for(website_id),
+            vectors=vectors,
+            payload=payloads,
+            ids=ids,
+            batch_size=settings.QDRANT_UPSERT_BATCH_SIZE,
+            wait=True,
+        )
+
+    def count(self, website_id: int) -> int:
+        """Number of a website's points"""
+        return self.client.count(
+            collection_name=self.collection_for(website_id),
+            count_filter=self._website_filter(website_id),
+            exact=True,
+        ).count
+
+    def search(self, query_vector, limit: int, website_id: int = None) -> list:
+        results = self.client.search(
+            collection_name=self.collection_for(website_id),
+            query_vector=query_vector,
+            query_filter=self._website_filter(website_id),
+            search_params=self._search_params(),
+            limit=limit
+        )
+        return [_result(result.id, result.payload, result.score) for result in results]
+
+    async def asearch(self, query_vector, limit: int, website_id: int = None) -> list:
+        results = await registry.get_async_qdrant_client().search(
+            collection_name=self.collection_for(website_id),
+            query_vector=query_vector,
+            query_filter=self._website_filter(website_id),
+            search_params=self._search_params(),
+            limit=limit
+        )
+        return [_result(result.id, result.payload, result.score) for result in results]
+
+    def delete_by_page_ids(self, page_ids: list, website_id: int = None):
+        self.client.delete(
+            collection_name=self.collection_for(website_id),
+            points_selector=FilterSelector(
+                filter=Filter(
+                    must=[FieldCondition(key='page_id', match=MatchAny(any=list(page_ids)))]
+                )
+            ),
+        )
+
+
+class LocalVectorIndex:
+    """
+    One website's vectors in process: a NumPy matrix searched by brute force
+
+    Rows are L2-normalized, so a matrix-vector product gives the cosine
+    scores Qdrant would return. Persisted under RAG_LOCAL_VECTOR_DIR as a
+    pickle of the point IDs and payloads plus a .npy matrix that is
+    memory-mapped on load, so processes share the OS page cache instead of
+    each holding a copy. Every save writes a new matrix file and then swaps
+    the pickle that names it, so readers never see a half-written index.
+    """
+
+    def __init__(self, website_id: int):
+        self.website_id = website_id
+        self.ids = []
+        self.payloads = []
+        self.vectors = None
+        self.vectors_file = None
+        self.dirty = False
+        self.deleted = False
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        del state['vectors']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.vectors = None
+        if self.vectors_file:
+            self.vectors = np.load(self.path_for(self.website_id).parent / self.vectors_file, mmap_mode='r')
+
+    @staticmethod
+    def path_for(website_id: int) -> Path:
+        return Path(settings.RAG_LOCAL_VECTOR_DIR) / f"website_{website_id}.pkl"
+
+    @classmethod
+    def exists(cls, website_id: int) -> bool:
+        return cls.path_for(website_id).exists()
+
+    @classmethod
+    def load(cls, website_id: int, fresh: bool = False) -> 'LocalVectorIndex':
+        """
+        Return the website's index, reusing the in-process copy when the
+        file is unchanged (unless fresh is set, e.g. to modify it)
+        """
+        path = cls.path_for(website_id)
+        for attempt in range(2):
+            try:
+                mtime = path.stat().st_mtime_ns
+                with _loaded_lock:
+                    cached = _loaded.get(website_id)
+                    if cached and cached[0] == mtime and not fresh:
+                        return cached[1]
+
+                with open(path, 'rb') as index_file:
+                    index = pickle.load(index_file)
+                break
+            except FileNotFoundError:
+                # Missing, or its matrix was replaced by a concurrent save
+                if attempt or not path.exists():
+                    return cls(website_id)
+
+        if not fresh:
+            with _loaded_lock:
+                _loaded[website_id] = (mtime, index)
+        return index
+
+    @classmethod
+    @contextmanager
+    def update(cls, website_id: int):
+        """
+        Load, modify and save a website's index under an exclusive file lock
+        (ingest tasks for the same website may run in parallel)
+        """
+        path = cls.path_for(website_id)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with open(f"{path}.lock", 'w') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                index = cls.load(website_id, fresh=True)
+                yield index
+                if index.deleted or (index.dirty and not index.ids):
+                    index._remove_files()
+                elif index.dirty:
+                    index.save()
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def save(self):
+        """Write the matrix, then atomically swap the index file"""
+        path = self.path_for(self.website_id)
+        previous_file = self.vectors_file
+        vectors = self.vectors if self.vectors is not None else np.empty((0, 0), dtype=np.float32)
+        self.vectors_file = f"website_{self.website_id}.{time.time_ns()}.npy"
+        np.save(path.parent / self.vectors_file, np.ascontiguousarray(vectors, dtype=np.float32))
+
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'wb') as index_file:
+            pickle.dump(self, index_file, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, path)
+        if previous_file:
+            # Readers that still map the old matrix keep it until they reload
+            (path.parent / previous_file).unlink(missing_ok=True)
+        self.dirty = False
+
+        with _loaded_lock:
+            _loaded.pop(self.website_id, None)
+
+    def _remove_files(self):
+        path = self.path_for(self.website_id)
+        path.unlink(missing_ok=True)
+        if self.vectors_file:
+            (path.parent / self.vectors_file).unlink(missing_ok=True)
+        with _loaded_lock:
+            _loaded.pop(self.website_id, None)
+
+    def discard(self):
+        """Delete the index when the update ends (e.g. moved to Qdrant)"""
+        self.deleted = True
+
+    def _keep_rows(self, keep: np.ndarray):
+        self.ids = [point_id for point_id, kept in zip(self.ids, keep) if kept]
+        self.payloads = [payload for payload, kept in zip(self.payloads, keep) if kept]
+        self.vectors = np.asarray(self.vectors)[keep]
+        self.dirty = True
+
+    def upsert(self, ids: list, vectors: np.ndarray, payloads: list):
+        """Add points, replacing existing points with the same IDs"""
+        ids = [str(point_id) for point_id in ids]
+        if self.ids:
+            replaced = set(ids)
+            self._keep_rows(np.array([point_id not in replaced for point_id in self.ids], dtype=bool))
+
+        vectors = np.asarray(vectors, dtype=np.float32)
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        vectors = vectors / norms
+
+        self.vectors = vectors if not self.ids else np.concatenate([self.vectors, vectors])
+        self.ids.extend(ids)
+        self.payloads.extend(payloads)
+        self.dirty = True
+
+    def remove_pages(self, page_ids: list):
+        """Drop every point of the given pages"""
+        page_ids = set(page_ids)
+        keep = np.array([payload.get('page_id') not in page_ids for payload in self.payloads], dtype=bool)
+        if not keep.all():
+            self._keep_rows(keep)
+
+    def search(self, query_vector, limit: int) -> list:
+        """
+        Exact cosine top-k
+        Returns: list of result dicts (same shape as QdrantService.search)
+        """
+        if not self.ids or limit <= 0:
+            return []
+        query = np.asarray(query_vector, dtype=np.float32)
+        scores = self.vectors @ (query / (np.linalg.norm(query) or 1.0))
+        if limit < len(scores):
+            top = np.argpartition(-scores, limit - 1)[:limit]
+            top = top[np.argsort(-scores[top])]
+        else:
+            top = np.argsort(-scores)
+        return [_result(self.ids[i], self.payloads[i], float(scores[i])) for i in top]
+
+
+class LocalVectorStore:
+    """
+    Embedded vector store: one LocalVectorIndex per website, no network
+
+    Searches are in-process brute-force products over a memory-mapped
+    matrix, well under a millisecond for sites of a few thousand chunks.
+    Every search is scoped to one website. The indexes are files in
+    RAG_LOCAL_VECTOR_DIR, so this store only suits a single host.
+    """
+
+    name = 'local'
+
+    def exists(self, website_id: int) -> bool:
+        return website_id is not None and LocalVectorIndex.exists(website_id)
+
+    def upload(self, website_id: int, ids: list, vectors: np.ndarray, payloads: list):
+        with LocalVectorIndex.update(website_id) as index:
+            index.upsert(ids, vectors, payloads)
+
+    def count(self, website_id: int) -> int:
+        return len(LocalVectorIndex.load(website_id))
+
+    def search(self, query_vector, limit: int, website_id: int = None) -> list:
+        if website_id is None:
+            raise ValueError("The local vector store only searches within one website")
+        return LocalVectorIndex.load(website_id).search(query_vector, limit)
+
+    async def asearch(self, query_vector, limit: int, website_id: int = None) -> list:
+        # Loading a changed index reads files, so keep it off the event loop
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            registry.get_retrieval_executor(), self.search, query_vector, limit, website_id
+        )
+
+    def delete_by_page_ids(self, page_ids: list, website_id: int = None):
+        if website_id is None:
+            raise ValueError("The local vector store only deletes within one website")
+        if not LocalVectorIndex.exists(website_id):
+            return
+        with LocalVectorIndex.update(website_id) as index:
+            index.remove_pages(page_ids)
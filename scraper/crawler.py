@@ -0,0 +1,232 @@
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from django.conf import settings
+from urllib.parse import urlparse
+from typing import List, Dict, Optional
+from rag.llm_client import TokenBucket
+import aiohttp
+import asyncio
+import threading
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+# host -> TokenBucket, shared by every crawler of the process
+_host_buckets = {}
+_host_buckets_lock = threading.Lock()
+
+
+def host_bucket(host: str) -> TokenBucket:
+    """
+    Politeness limit of a host: SCRAPER_PER_HOST_RATE requests a second,
+    bursts of SCRAPER_PER_HOST_BURST. The bucket is kept in Redis, so the
+    fetch batches a crawl fans out (in any worker) share one budget per
+    host; while Redis is unavailable, the crawlers of a process share it.
+    """
+    with _host_buckets_lock:
+        bucket = _host_buckets.get(host)
+        if bucket is None:
+            bucket = TokenBucket(
+                settings.SCRAPER_PER_HOST_RATE * 60,
+                settings.SCRAPER_PER_HOST_BURST,
+                key=f"scraper:host_bucket:{host}",
+                redis_enabled=settings.SCRAPER_HOST_LIMIT_REDIS_ENABLED,
+            )
+            _host_buckets[host] = bucket
+        return bucket
+
+
+class AsyncCrawler:
+    """
+    Concurrent fetch engine for sitemaps and pages
+
+    - a global semaphore bounds the number of in-flight requests
+    - a token bucket per host (host_bucket, shared through Redis) keeps
+      the crawl polite across parallel fetch batches
+    - one keep-alive connection pool is reused for the whole crawl
+    - HTML/XML parsing runs in a worker pool, off the event loop
+    """
+
+    def __init__(self, headers: Dict[str, str] = None):
+        self.headers = headers or {}
+        self.concurrency = settings.SCRAPER_CONCURRENCY
+        self.timeout = settings.SCRAPER_REQUEST_TIMEOUT
+        self._semaphore = None
+        self._session = None
+        self._executor = None
+
+    def _bucket_for(self, url: str) -> TokenBucket:
+        return host_bucket(urlparse(url).netloc)
+
+    async def _wait_for_host(self, url: str):
+        """Wait for a token of the URL's host (taken off the event loop: it may call Redis)"""
+        bucket = self._bucket_for(url)
+        while True:
+            wait = await asyncio.to_thread(bucket.take)
+            if not wait:
+                return
+            await asyncio.sleep(wait)
+
+    def _create_executor(self):
+        if settings.SCRAPER_PARSE_EXECUTOR == 'process':
+            return ProcessPoolExecutor(max_workers=settings.SCRAPER_PARSE_WORKERS)
+        return ThreadPoolExecutor(max_workers=settings.SCRAPER_PARSE_WORKERS)
+
+    async def _parse(self, func, *args):
+        """Run a parse function in the worker pool"""
+        loop = asyncio.get_running_loop()
+        try:
+            return await loop.run_in_executor(self._executor, func, *args)
+        except (BrokenProcessPool, AssertionError, OSError) as e:
+            # Daemonic workers (e.g. some Celery pools) can't spawn
+            # child processes; parse in threads instead.
+            if isinstance(self._executor, ThreadPoolExecutor):
+                raise
+            logger.warning(f"Process pool unavailable ({e}), parsing in threads")
+            self._executor.shutdown(wait=False)
+            self._executor = ThreadPoolExecutor(max_workers=settings.SCRAPER_PARSE_WORKERS)
+            return await loop.run_in_executor(self._executor, func, *args)
+
+    async def __aenter__(self):
+        self._semaphore = asyncio.Semaphore(self.concurrency)
+        self._executor = self._create_executor()
+        connector = aiohttp.TCPConnector(
+            limit=self.concurrency,
+            keepalive_timeout=30,
+            ttl_dns_cache=300,
+        )
+        self._session = aiohttp.ClientSession(
+            connector=connector,
+            headers=self.headers,
+            timeout=aiohttp.ClientTimeout(total=self.timeout),
+        )
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self._session.close()
+        self._executor.shutdown(wait=False)
+
+    async def fetch(self, url: str, headers: Dict[str, str] = None) -> Optional[Dict]:
+        """
+        Fetch a URL within the global and per-host limits
+        Returns: dict with 'status', 'content', 'etag', 'last_modified',
+                 or None on error
+        """
+        await self._wait_for_host(url)
+        async with self._semaphore:
+            try:
+                async with self._session.get(url, headers=headers) as response:
+                    if response.status == 304:
+                        return {'status': 304, 'content': b'', 'etag': None, 'last_modified': None}
+                    response.raise_for_status()
+                    return {
+                        'status': response.status,
+                        'content': await response.read(),
+                        'etag': response.headers.get('ETag'),
+                        'last_modified': response.headers.get('Last-Modified'),
+                    }
+            except Exception as e:
+                logger.error(f"Error fetching {url}: {e}")
+                return None
+
+    async def get_sitemap_entries(self, sitemap_url: str, _seen: set = None) -> List[Dict]:
+        """
+        Extract page entries ('url', 'lastmod') from an XML sitemap
+        Nested sitemaps (sitemap index) are resolved concurrently
+        """
+        from .scraper_service import parse_sitemap, is_sitemap
+
+        seen = _seen if _seen is not None else set()
+        if sitemap_url in seen:
+            return []
+        seen.add(sitemap_url)
+
+        response = await self.fetch(sitemap_url)
+        if response is None:
+            return []
+
+        try:
+            locs = await self._parse(parse_sitemap, response['content'])
+        except Exception as e:
+            logger.error(f"Error parsing sitemap {sitemap_url}: {e}")
+            return []
+
+        nested = [entry['url'] for entry in locs if is_sitemap(entry['url'])]
+        entries = [entry for entry in locs if not is_sitemap(entry['url'])]
+        for url in nested:
+            logger.info(f"Found nested sitemap: {url}")
+
+        nested_results = await asyncio.gather(
+            *(self.get_sitemap_entries(url, seen) for url in nested)
+        )
+        for nested_entries in nested_results:
+            entries.extend(nested_entries)
+
+        logger.info(f"Extracted {len(entries)} URLs from sitemap: {sitemap_url}")
+        return entries
+
+    async def get_urls_from_sitemap(self, sitemap_url: str) -> List[str]:
+        """Extract page URLs from an XML sitemap"""
+        return [entry['url'] for entry in await self.get_sitemap_entries(sitemap_url)]
+
+    async def fetch_page(self, url: str, known: Dict = None, sitemap_lastmod: str = None) -> Dict:
+        """
+        Fetch a page unless it is known to be unchanged
+
+        Args:
+            known: validators stored by the previous crawl ('etag',
+                   'last_modified', 'sitemap_lastmod'); used to skip the
+                   page or send a conditional GET
+            sitemap_lastmod: <lastmod> of the page in the current sitemap
+
+        Returns: dict with 'url' and 'sitemap_lastmod', plus either
+                 'not_modified', 'failed' or the fetched 'content', 'etag'
+                 and 'last_modified'
+        """
+        from .scraper_service import conditional_headers
+
+        result = {'url': url, 'sitemap_lastmod': sitemap_lastmod}
+        if known and sitemap_lastmod and known.get('sitemap_lastmod') == sitemap_lastmod:
+            return dict(result, not_modified=True)
+
+        response = await self.fetch(url, headers=conditional_headers(known))
+        if response is None:
+            return dict(result, failed=True)
+        if response['status'] == 304:
+            return dict(result, not_modified=True)
+        return dict(
+            result,
+            content=response['content'],
+            etag=response['etag'],
+            last_modified=response['last_modified'],
+        )
+
+    async def scrape_page(self, url: str, known: Dict = None, sitemap_lastmod: str = None) -> Dict:
+        """
+        Fetch and parse a single page
+        Arguments as for fetch_page()
+        """
+        from .scraper_service import extract_page, not_modified_page, finish_page
+
+        fetched = await self.fetch_page(url, known, sitemap_lastmod)
+        if fetched.get('not_modified'):
+            return not_modified_page(url, sitemap_lastmod)
+        if fetched.get('failed'):
+            return {'url': url, 'title': '', 'content': ''}
+        try:
+            page_data = await self._parse(extract_page, url, fetched['content'])
+        except Exception as e:
+            logger.error(f"Error scraping {url}: {e}")
+            return {'url': url, 'title': '', 'content': ''}
+        return finish_page(page_data, fetched['etag'], fetched['last_modified'], sitemap_lastmod)
+
+    async def scrape_pages(self, entries: List[Dict], known_pages: Dict[str, Dict] = None) -> List[Dict]:
+        """
+        Fetch and parse many sitemap entries concurrently, preserving order
+        """
+        known_pages = known_pages or {}
+        return await asyncio.gather(*(
+            self.scrape_page(entry['url'], known_pages.get(entry['url']), entry.get('lastmod'))
+            for entry in entries
+        ))
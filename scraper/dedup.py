@@ -0,0 +1,183 @@
+from django.conf import settings
+import numpy as np
+import hashlib
+import logging
+
+logger = logging.getLogger(__name__)
+
+# MinHash signature size, split into LSH bands of MINHASH_ROWS values
+MINHASH_PERMUTATIONS = 128
+MINHASH_ROWS = 4
+
+_rng = np.random.default_rng(20240601)
+# Odd multipliers combining the word hashes of a shingle (order sensitive)
+_SHINGLE_WEIGHTS = _rng.integers(1, 2 ** 63, size=64, dtype=np.uint64) * np.uint64(2) + np.uint64(1)
+# Hash functions of the MinHash signature: x * a + b (mod 2**64), then an xorshift
+_PERMUTATION_A = _rng.integers(1, 2 ** 63, size=MINHASH_PERMUTATIONS, dtype=np.uint64) * np.uint64(2) + np.uint64(1)
+_PERMUTATION_B = _rng.integers(0, 2 ** 63, size=MINHASH_PERMUTATIONS, dtype=np.uint64)
+
+
+def _word_hashes(words: list, cache: dict) -> np.ndarray:
+    """Stable 64-bit hash of each (lowercased) word"""
+    hashes = np.empty(len(words), dtype=np.uint64)
+    for i, word in enumerate(words):
+        word = word.lower()
+        value = cache.get(word)
+        if value is None:
+            value = int.from_bytes(hashlib.blake2b(word.encode('utf-8'), digest_size=8).digest(), 'little')
+            cache[word] = value
+        hashes[i] = value
+    return hashes
+
+
+def shingle_hashes(words: list, size: int, cache: dict = None) -> np.ndarray:
+    """
+    64-bit hashes of every run of `size` consecutive words
+    Returns: array with one hash per start position (empty for short texts)
+    """
+    count = len(words) - size + 1
+    if count <= 0:
+        return np.empty(0, dtype=np.uint64)
+    hashes = _word_hashes(words, {} if cache is None else cache)
+    shingles = np.zeros(count, dtype=np.uint64)
+    for offset in range(size):
+        shingles += hashes[offset:offset + count] * _SHINGLE_WEIGHTS[offset]  # wraps mod 2**64
+    return shingles
+
+
+def minhash(shingles: np.ndarray) -> np.ndarray:
+    """
+    MinHash signature of a set of shingle hashes (None without shingles)
+    The share of equal values of two signatures estimates the Jaccard
+    similarity of the sets.
+    """
+    if not len(shingles):
+        return None
+    hashed = shingles[:, None] * _PERMUTATION_A + _PERMUTATION_B
+    hashed ^= hashed >> np.uint64(29)
+    return hashed.min(axis=0)
+
+
+def strip_boilerplate(text: str, boilerplate, size: int = None) -> str:
+    """
+    Remove the words covered by boilerplate shingles (see SiteDeduplicator)
+    Text that would be left empty is returned unchanged.
+    """
+    if not len(boilerplate):
+        return text
+    size = size or settings.SCRAPER_SHINGLE_WORDS
+    words = text.split()
+    shingles = shingle_hashes(words, size)
+    matches = np.flatnonzero(np.isin(shingles, np.asarray(boilerplate, dtype=np.uint64)))
+    if not len(matches):
+        return text
+
+    covered = np.zeros(len(words) + 1, dtype=np.int32)
+    np.add.at(covered, matches, 1)
+    np.add.at(covered, matches + size, -1)
+    keep = np.cumsum(covered[:-1]) == 0
+    stripped = ' '.join(word for word, kept in zip(words, keep) if kept)
+    return stripped or text
+
+
+def pack_hashes(hashes) -> bytes:
+    """Shingle hashes as bytes, e.g. for Website.boilerplate"""
+    return np.asarray(hashes, dtype=np.uint64).tobytes()
+
+
+def unpack_hashes(packed) -> np.ndarray:
+    return np.frombuffer(bytes(packed or b''), dtype=np.uint64)
+
+
+class SiteDeduplicator:
+    """
+    Boilerplate and near-duplicate detection across the pages of a website
+
+    Pages are compared as sets of word shingles (runs of
+    SCRAPER_SHINGLE_WORDS words), so shared chrome is found even though the
+    extracted text has no block boundaries:
+
+    - boilerplate: shingles found on at least SCRAPER_BOILERPLATE_MIN_PAGES
+      pages and SCRAPER_BOILERPLATE_MIN_RATIO of the site (cookie banners,
+      repeated sidebars, legal footers); their words are stripped before
+      embedding
+    - near duplicates: pages whose remaining shingles have an estimated
+      Jaccard similarity (MinHash) of at least
+      SCRAPER_NEAR_DUPLICATE_SIMILARITY with another page (pagination, URL
+      variants, printer versions). Candidate pairs come from LSH bands of
+      the signatures, so the site is never compared pairwise. Each cluster
+      keeps its page with the shortest URL (then the oldest).
+    """
+
+    def __init__(self, shingle_words: int = None, min_pages: int = None,
+                 min_ratio: float = None, similarity: float = None):
+        self.shingle_words = shingle_words or settings.SCRAPER_SHINGLE_WORDS
+        self.min_pages = min_pages or settings.SCRAPER_BOILERPLATE_MIN_PAGES
+        self.min_ratio = settings.SCRAPER_BOILERPLATE_MIN_RATIO if min_ratio is None else min_ratio
+        self.similarity = similarity or settings.SCRAPER_NEAR_DUPLICATE_SIMILARITY
+
+    def analyze(self, pages) -> dict:
+        """
+        Args:
+            pages: iterable of (page_id, url, content)
+
+        Returns: dict with 'boilerplate' (sorted shingle hashes, for
+        strip_boilerplate) and 'duplicate_of' (page_id -> kept page_id)
+        """
+        cache = {}
+        keys = {}
+        page_shingles = {}
+        for page_id, url, content in pages:
+            keys[page_id] = (len(url), page_id)
+            page_shingles[page_id] = np.unique(shingle_hashes(content.split(), self.shingle_words, cache))
+
+        boilerplate = np.empty(0, dtype=np.uint64)
+        if page_shingles:
+            values, counts = np.unique(np.concatenate(list(page_shingles.values())), return_counts=True)
+            threshold = max(self.min_pages, self.min_ratio * len(page_shingles))
+            boilerplate = values[counts >= threshold]
+
+        signatures = {}
+        for page_id, shingles in page_shingles.items():
+            signature = minhash(shingles[~np.isin(shingles, boilerplate)])
+            if signature is not None:
+                signatures[page_id] = signature
+
+        return {
+            'boilerplate': [int(value) for value in boilerplate],
+            'duplicate_of': self._near_duplicates(signatures, keys),
+        }
+
+    def _near_duplicates(self, signatures: dict, keys: dict) -> dict:
+        # Pages sharing a whole band are candidates: with 32 bands of 4, a
+        # pair at 0.8 similarity is missed with a probability below 1e-7
+        buckets = {}
+        for page_id, signature in signatures.items():
+            for start in range(0, MINHASH_PERMUTATIONS, MINHASH_ROWS):
+                band = signature[start:start + MINHASH_ROWS].tobytes()
+                buckets.setdefault((start, band), []).append(page_id)
+
+        # Union-find over the matching pairs, rooted at the page to keep
+        parent = {page_id: page_id for page_id in signatures}
+
+        def find(page_id):
+            while parent[page_id] != page_id:
+                parent[page_id] = parent[parent[page_id]]
+                page_id = parent[page_id]
+            return page_id
+
+        for bucket in buckets.values():
+            for i, page_id in enumerate(bucket):
+                for other in bucket[i + 1:]:
+                    a, b = find(page_id), find(other)
+                    if a == b or np.mean(signatures[page_id] == signatures[other]) < self.similarity:
+                        continue
+                    if keys[b] < keys[a]:
+                        a, b = b, a
+                    parent[b] = a
+
+        return {
+            page_id: find(page_id)
+            for page_id in signatures
+            if find(page_id) != page_id
+        }
@@ -0,0 +1,82 @@
+from django.core.management.base import BaseCommand, CommandError
+from pathlib import Path
+from scraper.extractors import LxmlExtractor, SoupExtractor
+import time
+
+FIXTURES_DIR = Path(__file__).resolve().parents[2] / 'fixtures' / 'html'
+
+
+class Command(BaseCommand):
+    help = (
+        "Check that the lxml extractor produces the same title and text as the "
+        "BeautifulSoup reference on a corpus of HTML files, and time both per page"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('paths', nargs='*',
+                            help="HTML files or directories (default: scraper/fixtures/html)")
+        parser.add_argument('--repeat', type=int, default=20,
+                            help="Extractions per page for the timing")
+
+    def _files(self, paths: list) -> list:
+        files = []
+        for path in map(Path, paths or [FIXTURES_DIR]):
+            files.extend(sorted(path.glob('*.html')) if path.is_dir() else [path])
+        return files
+
+    def _time(self, extractor, url: str, content: bytes, repeat: int) -> float:
+        """Best of `repeat` runs, in milliseconds"""
+        best = float('inf')
+        for _ in range(repeat):
+            started_at = time.perf_counter()
+            extractor.extract(url, content)
+            best = min(best, time.perf_counter() - started_at)
+        return best * 1000
+
+    def handle(self, *args, **options):
+        files = self._files(options['paths'])
+        if not files:
+            raise CommandError("No HTML files to compare")
+
+        reference, candidate = SoupExtractor(), LxmlExtractor()
+        repeat = max(options['repeat'], 1)
+        mismatches = []
+        totals = [0.0, 0.0]
+
+        self.stdout.write(f"{'page':<32}{'KB':>8}{'soup ms':>10}{'lxml ms':>10}{'speedup':>9}  parity")
+        for path in files:
+            content = path.read_bytes()
+            url = path.as_uri()
+            expected = reference.extract(url, content)
+            actual = candidate.extract(url, content)
+            same = expected == actual
+            if not same:
+                mismatches.append((path, expected, actual))
+
+            soup_ms = self._time(reference, url, content, repeat)
+            lxml_ms = self._time(candidate, url, content, repeat)
+            totals[0] += soup_ms
+            totals[1] += lxml_ms
+            self.stdout.write(
+                f"{path.name[:31]:<32}{len(content) / 1024:>8.1f}{soup_ms:>10.3f}{lxml_ms:>10.3f}"
+                f"{soup_ms / lxml_ms:>8.1f}x  {'ok' if same else 'DIFF'}"
+            )
+        self.stdout.write(
+            f"{'total':<32}{'':>8}{totals[0]:>10.3f}{totals[1]:>10.3f}{totals[0] / totals[1]:>8.1f}x"
+        )
+
+        for path, expected, actual in mismatches:
+            for field in ('title', 'content'):
+                if expected[field] != actual[field]:
+                    position = next(
+                        (i for i, (a, b) in enumerate(zip(expected[field], actual[field])) if a != b),
+                        min(len(expected[field]), len(actual[field]))
+                    )
+                    self.stderr.write(
+                        f"{path.name} {field} differs at character {position}:\n"
+                        f"  soup: {expected[field][max(position - 40, 0):position + 40]!r}\n"
+                        f"  lxml: {actual[field][max(position - 40, 0):position + 40]!r}"
+                    )
+        if mismatches:
+            raise CommandError(f"Parity check failed for {len(mismatches)} of {len(files)} pages")
+        self.stdout.write(self.style.SUCCESS(f"Parity check passed for {len(files)} pages"))
@@ -0,0 +1,135 @@
+from django.conf import settings
+from django.core.cache import cache
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Page counters of a crawl, incremented by the pipeline stages
+COUNTERS = ['discovered', 'fetched', 'unchanged', 'failed', 'to_embed', 'embedded']
+
+STAGE_QUEUED = 'queued'
+STAGE_DISCOVERING = 'discovering'
+STAGE_FETCHING = 'fetching'
+STAGE_EMBEDDING = 'embedding'
+STAGE_COMPLETE = 'complete'
+STAGE_FAILED = 'failed'
+FINISHED_STAGES = (STAGE_COMPLETE, STAGE_FAILED)
+
+
+class IngestProgress:
+    """
+    Live progress of a website's ingest, kept in the default cache
+
+    The stages run in the Celery workers and are read by the web processes,
+    so this needs the shared Redis cache of the default CACHES (a local
+    memory cache is only seen by the process that wrote it). Counters are
+    separate keys updated with cache.incr (Redis INCR), so the concurrent
+    fetch/embed batches of a crawl don't overwrite each other. Readers get
+    everything in one get_many, without touching the database.
+
+    Recording progress never fails the ingest: cache errors are logged.
+    """
+
+    def __init__(self, website_id: int):
+        self.website_id = website_id
+        self.ttl = settings.SCRAPER_PROGRESS_TTL
+
+    def _key(self, name: str) -> str:
+        return f"scraper:progress:{self.website_id}:{name}"
+
+    def start(self, stage: str = STAGE_DISCOVERING):
+        """Reset the counters for a new crawl"""
+        try:
+            values = {self._key(name): 0 for name in COUNTERS}
+            values[self._key('state')] = {'stage': stage, 'started_at': time.time()}
+            cache.set_many(values, self.ttl)
+        except Exception as e:
+            logger.error(f"Error resetting progress of website {self.website_id}: {e}")
+
+    def set_stage(self, stage: str, **fields):
+        """Move to the next stage; `fields` set counters (e.g. discovered=40)"""
+        try:
+            state = cache.get(self._key('state')) or {'started_at': time.time()}
+            state['stage'] = stage
+            state[f'{stage}_at'] = time.time()
+            values = {self._key(name): value for name, value in fields.items()}
+            values[self._key('state')] = state
+            cache.set_many(values, self.ttl)
+        except Exception as e:
+            logger.error(f"Error updating progress of website {self.website_id}: {e}")
+
+    def increment(self, **counts):
+        """Add to counters, e.g. increment(fetched=18, failed=2)"""
+        for name, count in counts.items():
+            if not count:
+                continue
+            try:
+                cache.incr(self._key(name), count)
+            except ValueError:
+                # Expired or reset by another crawl; another batch may
+                # recreate the key first
+                try:
+                    if not cache.add(self._key(name), count, self.ttl):
+                        cache.incr(self._key(name), count)
+                except Exception as e:
+                    logger.error(f"Error updating progress of website {self.website_id}: {e}")
+            except Exception as e:
+                logger.error(f"Error updating progress of website {self.website_id}: {e}")
+
+    def snapshot(self):
+        """
+        Returns: dict with the stage, the counters, throughput and ETA of
+        the current stage, or None if no crawl was recorded
+        """
+        values = cache.get_many([self._key(name) for name in COUNTERS + ['state']])
+        state = values.get(self._key('state'))
+        if state is None:
+            return None
+
+        counters = {name: int(values.get(self._key(name)) or 0) for name in COUNTERS}
+        now = time.time()
+        finished_at = state.get(f'{state["stage"]}_at') if state['stage'] in FINISHED_STAGES else None
+        end = finished_at or now
+
+        # Fetch covers discovery to the start of embedding; embedding the rest
+        fetch_started_at = state.get(f'{STAGE_FETCHING}_at')
+        embed_started_at = state.get(f'{STAGE_EMBEDDING}_at')
+        fetch_done = counters['fetched'] + counters['unchanged'] + counters['failed']
+        fetch_rate = _rate(fetch_done, fetch_started_at, embed_started_at or end)
+        embed_rate = _rate(counters['embedded'], embed_started_at, end)
+
+        eta = None
+        if state['stage'] == STAGE_FETCHING and fetch_rate:
+            eta = max(counters['discovered'] - fetch_done, 0) / fetch_rate
+        elif state['stage'] == STAGE_EMBEDDING and embed_rate:
+            eta = max(counters['to_embed'] - counters['embedded'], 0) / embed_rate
+        elif state['stage'] in FINISHED_STAGES:
+            eta = 0.0
+
+        return dict(
+            counters,
+            website_id=self.website_id,
+            stage=state['stage'],
+            finished=state['stage'] in FINISHED_STAGES,
+            elapsed_seconds=round(end - state['started_at'], 3),
+            fetch_pages_per_second=round(fetch_rate, 3) if fetch_rate is not None else None,
+            embed_pages_per_second=round(embed_rate, 3) if embed_rate is not None else None,
+            eta_seconds=round(eta, 1) if eta is not None else None,
+        )
+
+
+def website_snapshot(website) -> dict:
+    """Fallback for websites without recorded progress (never crawled, or expired)"""
+    return {
+        'website_id': website.id,
+        'stage': website.get_status_display().lower(),
+        'finished': website.status in (website.STATUS_COMPLETE, website.STATUS_FAILED),
+        'total_pages': website.total_pages,
+    }
+
+
+def _rate(done: int, started_at, until: float):
+    if started_at is None or until <= started_at:
+        return None
+    return done / (until - started_at)
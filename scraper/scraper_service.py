@@ -1,13 +1,111 @@
 import requests
-from bs4 import BeautifulSoup
-from urllib.parse import urljoin, urlparse
 import xml.etree.ElementTree as ET
 from typing import List, Dict
+from .crawler import AsyncCrawler
+from .extractors import get_extractor
+import asyncio
+import hashlib
 import logging
-import time
 
 logger = logging.getLogger(__name__)
 
+REQUEST_HEADERS = {
+    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
+}
+
+
+def is_sitemap(url: str) -> bool:
+    """Check if URL is an XML sitemap"""
+    return url.endswith('.xml') or 'sitemap' in url.lower()
+
+
+def clean_text(text: str) -> str:
+    """Clean and normalize text content"""
+    # Remove extra whitespace
+    text = ' '.join(text.split())
+    return text
+
+
+def parse_sitemap(content: bytes) -> List[Dict[str, str]]:
+    """
+    Return every <loc> of a sitemap (pages and nested sitemaps) with its
+    <lastmod>, as dicts with 'url' and 'lastmod'.
+    Module-level so it can run in a parse worker process.
+    """
+    # Parse XML properly
+    root = ET.fromstring(content)
+    
+    # Get namespace from root tag
+    namespace = ''
+    if '}' in root.tag:
+        namespace = root.tag.split('}')[0] + '}'
+    
+    # Each <url>/<sitemap> element holds a <loc> and an optional <lastmod>
+    entries = []
+    for element in root:
+        loc = element.find(f'{namespace}loc')
+        if loc is None or not loc.text:
+            continue
+        lastmod = element.find(f'{namespace}lastmod')
+        entries.append({
+            'url': loc.text.strip(),
+            'lastmod': lastmod.text.strip() if lastmod is not None and lastmod.text else None,
+        })
+    return entries
+
+
+def content_hash(text: str) -> str:
+    """SHA-256 of the extracted text, used to detect changed pages"""
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+def conditional_headers(known: Dict = None) -> Dict[str, str]:
+    """Build If-None-Match/If-Modified-Since headers from stored validators"""
+    headers = {}
+    if known:
+        if known.get('etag'):
+            headers['If-None-Match'] = known['etag']
+        if known.get('last_modified'):
+            headers['If-Modified-Since'] = known['last_modified']
+    return headers
+
+
+def not_modified_page(url: str, sitemap_lastmod: str = None) -> Dict:
+    """Result for a page that is unchanged since the previous crawl"""
+    return {
+        'url': url,
+        'title': '',
+        'content': '',
+        'not_modified': True,
+        'sitemap_lastmod': sitemap_lastmod,
+    }
+
+
+def finish_page(page_data: Dict, etag: str = None, last_modified: str = None,
+                sitemap_lastmod: str = None) -> Dict:
+    """Attach the HTTP validators and content hash to an extracted page"""
+    page_data.update({
+        'etag': etag,
+        'last_modified': last_modified,
+        'sitemap_lastmod': sitemap_lastmod,
+        'content_hash': content_hash(page_data['content']),
+        'not_modified': False,
+    })
+    return page_data
+
+
+def extract_page(url: str, content: bytes) -> Dict[str, str]:
+    """
+    Extract title and main text from an HTML document.
+    Module-level so it can run in a parse worker process.
+    Returns: dict with 'url', 'title', 'content'
+    """
+    page_data = get_extractor().extract(url, content)
+    
+    logger.info(f"Successfully scraped: {page_data['title']} ({len(page_data['content'])} chars)")
+    
+    return page_data
+
 
 class WebScraper:
     """
@@ -16,106 +114,48 @@ class WebScraper:
     
     def __init__(self, base_url: str):
         self.base_url = base_url
+        self.headers = dict(REQUEST_HEADERS)
         self.session = requests.Session()
-        self.session.headers.update({
-            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
-        })
+        self.session.headers.update(self.headers)
     
     def is_sitemap(self, url: str) -> bool:
         """Check if URL is an XML sitemap"""
-        return url.endswith('.xml') or 'sitemap' in url.lower()
+        return is_sitemap(url)
     
     def get_urls_from_sitemap(self, sitemap_url: str) -> List[str]:
         """
         Extract URLs from XML sitemap
-        Handles nested sitemaps (sitemap index)
+        Handles nested sitemaps (sitemap index), fetched concurrently
         """
-        urls = []
-        try:
-            response = self.session.get(sitemap_url, timeout=10)
-            response.raise_for_status()
-            
-            # Parse XML properly
-            root = ET.fromstring(response.content)
-            
-            # Get namespace from root tag
-            namespace = ''
-            if '}' in root.tag:
-                namespace = root.tag.split('}')[0] + '}'
-            
-            # Try to find <loc> tags (actual page URLs)
-            loc_tags = root.findall(f'.//{namespace}loc')
-            
-            for loc in loc_tags:
-                url = loc.text.strip()
-                
-                # Check if this is a nested sitemap
-                if self.is_sitemap(url):
-                    logger.info(f"Found nested sitemap: {url}")
-                    # Recursively get URLs from nested sitemap
-                    nested_urls = self.get_urls_from_sitemap(url)
-                    urls.extend(nested_urls)
-                else:
-                    # It's a regular page URL
-                    urls.append(url)
-            
-            logger.info(f"Extracted {len(urls)} URLs from sitemap: {sitemap_url}")
-            return urls
-            
-        except Exception as e:
-            logger.error(f"Error parsing sitemap {sitemap_url}: {e}")
-            return []
+        async def run():
+            async with AsyncCrawler(headers=self.headers) as crawler:
+                return await crawler.get_urls_from_sitemap(sitemap_url)
+        return asyncio.run(run())
     
     def clean_text(self, text: str) -> str:
         """Clean and normalize text content"""
-        # Remove extra whitespace
-        text = ' '.join(text.split())
-        return text
+        return clean_text(text)
     
-    def scrape_page(self, url: str) -> Dict[str, str]:
+    def scrape_page(self, url: str, known: Dict = None) -> Dict[str, str]:
         """
         Scrape a single page and extract title and content
         Returns: dict with 'url', 'title', 'content'
+        
+        Args:
+            known: validators from the previous crawl, sent as a conditional GET
         """
         try:
-            response = self.session.get(url, timeout=10)
+            response = self.session.get(url, headers=conditional_headers(known), timeout=10)
+            if response.status_code == 304:
+                logger.info(f"Not modified: {url}")
+                return not_modified_page(url)
             response.raise_for_status()
-            
-            # Parse with lxml for HTML (not XML)
-            soup = BeautifulSoup(response.content, 'html.parser')
-            
-            # Extract title
-            title = soup.find('title')
-            title = title.get_text().strip() if title else url
-            
-            # Remove unwanted tags
-            for tag in soup(['script', 'style', 'nav', 'footer', 'header', 'aside', 
-                           'iframe', 'noscript', 'form', 'button']):
-                tag.decompose()
-            
-            # Try to find main content area
-            main_content = soup.find('main') or soup.find('article') or soup.find('body')
-            
-            if main_content:
-                # Extract text from main content
-                content = main_content.get_text(separator=' ', strip=True)
-            else:
-                # Fallback: get all text
-                content = soup.get_text(separator=' ', strip=True)
-            
-            # Clean the content
-            content = self.clean_text(content)
-            
-            # Limit content length (important for embeddings and free tier)
-            content = content[:10000]  # Limit to 10k characters
-            
-            logger.info(f"Successfully scraped: {title} ({len(content)} chars)")
-            
-            return {
-                'url': url,
-                'title': title,
-                'content': content
-            }
+            page_data = extract_page(url, response.content)
+            return finish_page(
+                page_data,
+                etag=response.headers.get('ETag'),
+                last_modified=response.headers.get('Last-Modified'),
+            )
             
         except Exception as e:
             logger.error(f"Error scraping {url}: {e}")
@@ -125,48 +165,51 @@ class WebScraper:
                 'content': ''
             }
     
-    def scrape_website(self, max_pages: int = 10) -> List[Dict[str, str]]:
+    def scrape_website(self, max_pages: int = 10, known_pages: Dict[str, Dict] = None) -> List[Dict[str, str]]:
         """
         Scrape website - either from sitemap or main page
-        Returns: list of scraped pages
+        Returns: list of scraped pages; pages unchanged since the previous
+        crawl are returned with 'not_modified' set and no content
         
         Args:
             max_pages: Maximum number of pages to scrape (default 10 for free tier)
+            known_pages: url -> validators ('etag', 'last_modified',
+                         'sitemap_lastmod') stored by the previous crawl
         """
         pages = []
+        known_pages = known_pages or {}
         
         if self.is_sitemap(self.base_url):
             logger.info(f"Detected sitemap URL: {self.base_url}")
-            
+            pages = asyncio.run(self._crawl_sitemap(max_pages, known_pages))
+        else:
+            logger.info(f"Scraping single page: {self.base_url}")
+            # Just scrape the main page
+            page_data = self.scrape_page(self.base_url, known_pages.get(self.base_url))
+            if page_data['content'] or page_data.get('not_modified'):
+                pages.append(page_data)
+        
+        logger.info(f"Total pages successfully scraped: {len(pages)}")
+        return pages
+    
+    async def _crawl_sitemap(self, max_pages: int, known_pages: Dict[str, Dict]) -> List[Dict[str, str]]:
+        """Discover sitemap URLs and fetch the pages concurrently"""
+        async with AsyncCrawler(headers=self.headers) as crawler:
             # Get all URLs from sitemap
-            urls = self.get_urls_from_sitemap(self.base_url)
+            entries = await crawler.get_sitemap_entries(self.base_url)
             
-            if not urls:
+            if not entries:
                 logger.warning("No URLs found in sitemap")
-                return pages
+                return []
             
             # Limit number of pages for free tier
-            urls = urls[:max_pages]
-            logger.info(f"Will scrape {len(urls)} pages (limited to {max_pages})")
+            entries = entries[:max_pages]
+            logger.info(f"Will scrape {len(entries)} pages (limited to {max_pages})")
             
-            # Scrape each URL
-            for i, url in enumerate(urls, 1):
-                logger.info(f"Scraping page {i}/{len(urls)}: {url}")
-                
-                page_data = self.scrape_page(url)
-                
-                # Only add if content exists
-                if page_data['content']:
-                    pages.append(page_data)
-                
-                # Small delay to be polite to the server
-                time.sleep(0.5)
-        else:
-            logger.info(f"Scraping single page: {self.base_url}")
-            # Just scrape the main page
-            page_data = self.scrape_page(self.base_url)
-            if page_data['content']:
-                pages.append(page_data)
+            results = await crawler.scrape_pages(entries, known_pages)
         
-        logger.info(f"Total pages successfully scraped: {len(pages)}")
-        return pages
\ No newline at end of file
+        # Only keep pages with content (or known to be unchanged)
+        return [
+            page_data for page_data in results
+            if page_data['content'] or page_data.get('not_modified')
+        ]
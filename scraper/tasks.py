@@ -1,18 +1,285 @@
-from celery import shared_task
+from celery import shared_task, chain, chord, group
 from api.models import Website, ScrapedPage
-from .scraper_service import WebScraper
+from .crawler import AsyncCrawler
+from .scraper_service import (
+    REQUEST_HEADERS, is_sitemap, extract_page, finish_page, not_modified_page, content_hash
+)
+from .dedup import SiteDeduplicator, strip_boilerplate, pack_hashes, unpack_hashes
+from .progress import IngestProgress, STAGE_FETCHING, STAGE_EMBEDDING, STAGE_COMPLETE, STAGE_FAILED
 from rag.qdrant_service import QdrantService
+from rag.answer_cache import AnswerCache
+from rag.lexical_index import LexicalIndex
+from django.conf import settings
+from django.core.cache import cache
 from django.utils import timezone
+import numpy as np
+import asyncio
+import zlib
 import logging
 
 logger = logging.getLogger(__name__)
 
 
-@shared_task(bind=True)
+VALIDATOR_FIELDS = ['etag', 'last_modified', 'sitemap_lastmod']
+
+
+def _existing_pages(website, qdrant):
+    """
+    Map url -> ScrapedPage for a website.
+    Duplicate rows left by earlier full re-scrapes are removed together
+    with their vectors, keeping the newest row per URL.
+    """
+    existing = {}
+    duplicates = []
+    for page in ScrapedPage.objects.filter(website=website).order_by('-id'):
+        if page.url in existing:
+            duplicates.append(page.id)
+        else:
+            existing[page.url] = page
+    
+    if duplicates:
+        qdrant.delete_by_page_ids(duplicates, website_id=website.id)
+        with LexicalIndex.update(website.id) as lexical_index:
+            lexical_index.remove_pages(duplicates)
+        ScrapedPage.objects.filter(id__in=duplicates).delete()
+        logger.info(f"Removed {len(duplicates)} duplicate pages for {website.url}")
+    return existing
+
+
+class FetchBatchError(Exception):
+    """Every page of a fetch batch failed (retried as a whole)"""
+
+
+class MissingPayloadError(Exception):
+    """A stage's input expired from the cache before it ran (not retried)"""
+
+
+# Stage tasks retry transient failures (network, Qdrant, DB) with backoff.
+# Every stage is idempotent, so a retry only redoes its own batch.
+STAGE_OPTIONS = {
+    'bind': True,
+    'autoretry_for': (Exception,),
+    'dont_autoretry_for': (MissingPayloadError,),
+    'retry_backoff': True,
+    'retry_backoff_max': 300,
+    'max_retries': 3,
+}
+
+
+def _batches(items: list, size: int) -> list:
+    return [items[start:start + size] for start in range(0, len(items), size)]
+
+
+# Bulky stage output (raw HTML, vectors) is handed to the next stage through
+# the cache (Redis) instead of as the task's result, which the django-db
+# result backend would persist: the producing task ignores its result and
+# passes the payload's key down the chain
+PAYLOAD_KEY = 'ingest:payload:{}'
+
+
+def _put_payload(task_id: str, payload) -> str:
+    key = PAYLOAD_KEY.format(task_id)
+    cache.set(key, payload, timeout=settings.SCRAPER_PAYLOAD_TTL)
+    return key
+
+
+def _get_payload(key: str):
+    payload = cache.get(key)
+    if payload is None:
+        raise MissingPayloadError(f"Payload {key} is no longer in the cache")
+    return payload
+
+
+def _discover_entries(url: str) -> list:
+    """Sitemap entries ('url', 'lastmod') of a website, or its single page"""
+    if not is_sitemap(url):
+        return [{'url': url, 'lastmod': None}]
+    
+    async def run():
+        async with AsyncCrawler(headers=REQUEST_HEADERS) as crawler:
+            return await crawler.get_sitemap_entries(url)
+    return asyncio.run(run())
+
+
+def _site_boilerplate(website_id: int) -> np.ndarray:
+    """Boilerplate shingle hashes stored by the website's last crawl"""
+    return unpack_hashes(Website.objects.filter(id=website_id).values_list('boilerplate', flat=True).first())
+
+
+def _documents(pages: list, boilerplate: np.ndarray) -> list:
+    """Documents to index, with the site's boilerplate stripped"""
+    return [
+        {
+            'page_id': page.id,
+            'website_id': page.website_id,
+            'url': page.url,
+            'title': page.title,
+            'content': strip_boilerplate(page.content, boilerplate),
+        }
+        for page in pages
+    ]
+
+
+def _deduplicate(website_id: int) -> dict:
+    """
+    Detect the site's boilerplate and near-duplicate pages (SiteDeduplicator),
+    store the boilerplate on the website and the pages' duplicate_of
+    
+    Pages that became duplicates lose their vectors; pages that are no
+    longer duplicates, or whose text without the new boilerplate differs
+    from what was indexed (index_hash), are queued for embedding again.
+    
+    Returns: dict with 'duplicates' and 'stale' (pages re-queued for the
+    boilerplate change) counts
+    """
+    pages = list(
+        ScrapedPage.objects.filter(website_id=website_id)
+        .only('id', 'url', 'content', 'vector_id', 'duplicate_of', 'index_hash')
+    )
+    if settings.SCRAPER_DEDUP_ENABLED:
+        analysis = SiteDeduplicator().analyze((page.id, page.url, page.content) for page in pages)
+    else:
+        analysis = {'boilerplate': [], 'duplicate_of': {}}
+    boilerplate = np.array(analysis['boilerplate'], dtype=np.uint64)
+    Website.objects.filter(id=website_id).update(boilerplate=pack_hashes(boilerplate))
+    
+    updated_pages = []
+    dropped = []
+    stale = 0
+    for page in pages:
+        duplicate_of = analysis['duplicate_of'].get(page.id)
+        if page.duplicate_of_id != duplicate_of:
+            if duplicate_of is not None and page.vector_id:
+                dropped.append(page.id)
+            page.duplicate_of_id = duplicate_of
+            page.vector_id = None
+            updated_pages.append(page)
+        elif duplicate_of is None and page.vector_id and page.index_hash != content_hash(
+            strip_boilerplate(page.content, boilerplate)
+        ):
+            page.vector_id = None
+            updated_pages.append(page)
+            stale += 1
+    
+    if dropped:
+        QdrantService().delete_by_page_ids(dropped, website_id=website_id)
+        with LexicalIndex.update(website_id) as lexical_index:
+            lexical_index.remove_pages(dropped)
+    if updated_pages:
+        ScrapedPage.objects.bulk_update(
+            updated_pages, ['duplicate_of', 'vector_id'], batch_size=settings.SCRAPER_DB_BATCH_SIZE
+        )
+    
+    logger.info(
+        f"Website {website_id}: {len(analysis['boilerplate'])} boilerplate shingles, "
+        f"{len(analysis['duplicate_of'])} near-duplicate pages ({len(dropped)} removed from the index), "
+        f"{stale} pages to re-embed without the new boilerplate"
+    )
+    return {'duplicates': len(analysis['duplicate_of']), 'stale': stale}
+
+
+def _store_pages(website, pages: list) -> dict:
+    """
+    Diff a batch of crawled pages against the stored rows and write them
+    
+    Rows are matched by URL, so a retried batch updates instead of
+    duplicating. New and changed pages are stored without vector_id,
+    which queues them for the embedding stage.
+    """
+    existing = {
+        page.url: page
+        for page in ScrapedPage.objects.filter(
+            website=website, url__in=[page_data['url'] for page_data in pages]
+        ).order_by('id')
+    }
+    
+    new_pages = []
+    updated_pages = []
+    changed = 0
+    unchanged = 0
+    for page_data in pages:
+        page = existing.get(page_data['url'])
+        
+        if page is None:
+            if page_data.get('not_modified'):
+                continue
+            new_pages.append(ScrapedPage(
+                website=website,
+                url=page_data['url'],
+                title=page_data['title'],
+                content=page_data['content'],
+                content_hash=page_data['content_hash'],
+                etag=page_data['etag'],
+                last_modified=page_data['last_modified'],
+                sitemap_lastmod=page_data['sitemap_lastmod'],
+            ))
+            continue
+        
+        if page_data.get('not_modified'):
+            unchanged += 1
+            if page_data.get('sitemap_lastmod'):
+                page.sitemap_lastmod = page_data['sitemap_lastmod']
+                updated_pages.append(page)
+            continue
+        
+        for field in VALIDATOR_FIELDS:
+            setattr(page, field, page_data[field])
+        if page.content_hash != page_data['content_hash']:
+            page.title = page_data['title']
+            page.content = page_data['content']
+            page.content_hash = page_data['content_hash']
+            # Cleared until the new vectors are stored, so a failed
+            # embed is retried by the next run
+            page.vector_id = None
+            changed += 1
+        else:
+            unchanged += 1
+        updated_pages.append(page)
+    
+    # Save new pages in one round-trip
+    if new_pages:
+        ScrapedPage.objects.bulk_create(new_pages, batch_size=settings.SCRAPER_DB_BATCH_SIZE)
+    
+    if updated_pages:
+        ScrapedPage.objects.bulk_update(
+            updated_pages,
+            ['title', 'content', 'content_hash', 'vector_id'] + VALIDATOR_FIELDS,
+            batch_size=settings.SCRAPER_DB_BATCH_SIZE
+        )
+    
+    return {
+        'pages': len(pages),
+        'new': len(new_pages),
+        'changed': changed,
+        'unchanged': unchanged,
+    }
+
+
+def _mark_failed(website_id: int):
+    Website.objects.filter(id=website_id).update(status='f', updated_at=timezone.now())  # STATUS_FAILED
+    IngestProgress(website_id).set_stage(STAGE_FAILED)
+
+
+@shared_task(bind=True, max_retries=3)
 def scrape_website_task(self, website_id: int):
     """
     Celery task to scrape a website and store in Qdrant
+    
+    Stage 1 of the ingest pipeline: discover the website's pages and fan
+    out fetch/parse batches. With INGEST_STAGE_QUEUES on, each stage runs
+    on its own queue (CELERY_TASK_ROUTES):
+    
+        discover -+- fetch -> parse (batch 1) -+- plan -+- embed -> index (batch 1) -+- finalize
+                  +- fetch -> parse (batch n) -+        +- embed -> index (batch n) -+
+    
+    Re-crawls are incremental: unchanged pages are skipped via sitemap
+    <lastmod> and conditional GETs, and only pages whose content hash
+    changed are re-embedded.
+    
+    Progress (pages discovered/fetched/embedded, throughput, ETA) is
+    published to the cache by every stage, see IngestProgress.
     """
+    progress = IngestProgress(website_id)
     try:
         # Get the website object
         website = Website.objects.get(id=website_id)
@@ -21,62 +288,52 @@ def scrape_website_task(self, website_id: int):
         # Update status to scraping
         website.status = 's'  # STATUS_SCRAPING
         website.save()
+        progress.start()
         
-        # Initialize scraper and Qdrant
-        scraper = WebScraper(website.url)
-        qdrant = QdrantService()
+        existing = _existing_pages(website, QdrantService())
         
-        # Scrape the website (limit to 10 pages for free tier)
-        pages = scraper.scrape_website(max_pages=10)
+        entries = []
+        seen_urls = set()
+        for entry in _discover_entries(website.url):
+            if entry['url'] not in seen_urls:
+                seen_urls.add(entry['url'])
+                entries.append(entry)
         
-        if not pages:
-            logger.warning(f"No pages scraped for {website.url}")
+        # Limit number of pages for free tier
+        entries = entries[:settings.SCRAPER_MAX_PAGES]
+        
+        if not entries:
+            logger.warning(f"No pages found for {website.url}")
             website.status = 'f'
             website.save()
+            progress.set_stage(STAGE_FAILED)
             return {
                 'status': 'error',
                 'message': 'No pages were scraped',
                 'website_id': website_id
             }
         
-        # Save scraped pages to database AND Qdrant
-        for page_data in pages:
-            # Create database entry
-            scraped_page = ScrapedPage.objects.create(
-                website=website,
-                url=page_data['url'],
-                title=page_data['title'],
-                content=page_data['content']
+        batches = _batches(entries, settings.SCRAPER_FETCH_BATCH_SIZE)
+        progress.set_stage(STAGE_FETCHING, discovered=len(entries))
+        header = group(
+            chain(
+                fetch_pages_task.s(website_id, batch, {
+                    entry['url']: {field: getattr(existing[entry['url']], field) for field in VALIDATOR_FIELDS}
+                    for entry in batch if entry['url'] in existing
+                }),
+                parse_pages_task.s(website_id),
             )
-            
-            # Store in Qdrant vector DB
-            try:
-                vector_id = qdrant.add_document(
-                    page_id=scraped_page.id,
-                    url=page_data['url'],
-                    title=page_data['title'],
-                    content=page_data['content']
-                )
-                
-                # Update scraped_page with vector_id
-                scraped_page.vector_id = vector_id
-                scraped_page.save()
-                
-                logger.info(f"Stored in Qdrant: {page_data['title']}")
-            except Exception as e:
-                logger.error(f"Failed to store in Qdrant: {e}")
-        
-        # Update website status
-        website.status = 'c'  # STATUS_COMPLETE
-        website.total_pages = len(pages)
-        website.updated_at = timezone.now()
-        website.save()
-        
-        logger.info(f"Successfully scraped {len(pages)} pages for {website.url}")
+            for batch in batches
+        )
+        chord(header)(
+            plan_embedding_task.s(website_id).on_error(ingest_failed_task.s(website_id))
+        )
         
+        logger.info(f"Discovered {len(entries)} pages for {website.url}, fetching in {len(batches)} batches")
         return {
-            'status': 'success',
-            'pages_scraped': len(pages),
+            'status': 'started',
+            'pages_discovered': len(entries),
+            'fetch_batches': len(batches),
             'website_id': website_id
         }
         
@@ -86,12 +343,222 @@ def scrape_website_task(self, website_id: int):
         
     except Exception as e:
         logger.error(f"Error in scrape_website_task: {str(e)}", exc_info=True)
-        # Update status to failed
+        if self.request.retries < self.max_retries:
+            raise self.retry(exc=e, countdown=2 ** self.request.retries * 10)
+        _mark_failed(website_id)
+        return {'status': 'error', 'message': str(e)}
+
+
+@shared_task(ignore_result=True, **STAGE_OPTIONS)
+def fetch_pages_task(self, website_id: int, entries: list, known_pages: dict):
+    """
+    Stage 2: fetch a batch of sitemap entries concurrently
+    
+    Pages unchanged since the previous crawl are skipped (sitemap <lastmod>,
+    conditional GET). Single failed pages are dropped; the batch is retried
+    only if all of its pages failed.
+    
+    Returns: cache key of the fetched entries (HTML zlib-compressed) for
+    parse_pages_task
+    """
+    async def run():
+        async with AsyncCrawler(headers=REQUEST_HEADERS) as crawler:
+            return await asyncio.gather(*(
+                crawler.fetch_page(entry['url'], known_pages.get(entry['url']), entry.get('lastmod'))
+                for entry in entries
+            ))
+    
+    fetched = asyncio.run(run())
+    if fetched and all(item.get('failed') for item in fetched) and self.request.retries < self.max_retries:
+        raise FetchBatchError(f"All {len(fetched)} pages of the batch failed")
+    
+    for item in fetched:
+        if 'content' in item:
+            item['content'] = zlib.compress(item['content'])
+    fetched_count = sum('content' in item for item in fetched)
+    IngestProgress(website_id).increment(
+        fetched=fetched_count,
+        unchanged=sum(bool(item.get('not_modified')) for item in fetched),
+        failed=sum(bool(item.get('failed')) for item in fetched),
+    )
+    logger.info(f"Fetched {fetched_count}/{len(entries)} pages for website {website_id}")
+    return _put_payload(self.request.id, fetched)
+
+
+@shared_task(**STAGE_OPTIONS)
+def parse_pages_task(self, fetched_key: str, website_id: int):
+    """
+    Stage 3: extract the text of a fetched batch and store the pages
+    Returns: batch stats ('pages', 'new', 'changed', 'unchanged')
+    """
+    website = Website.objects.get(id=website_id)
+    fetched = _get_payload(fetched_key)
+    
+    pages = []
+    for item in fetched:
+        if item.get('failed'):
+            continue
+        if item.get('not_modified'):
+            pages.append(not_modified_page(item['url'], item['sitemap_lastmod']))
+            continue
         try:
-            website = Website.objects.get(id=website_id)
-            website.status = 'f'  # STATUS_FAILED
-            website.save()
-        except:
-            pass
-        
-        return {'status': 'error', 'message': str(e)}
\ No newline at end of file
+            page_data = extract_page(item['url'], zlib.decompress(item['content']))
+        except Exception as e:
+            logger.error(f"Error parsing {item['url']}: {e}")
+            continue
+        # Only keep pages with content
+        if page_data['content']:
+            pages.append(finish_page(
+                page_data, item['etag'], item['last_modified'], item['sitemap_lastmod']
+            ))
+    
+    stats = _store_pages(website, pages)
+    cache.delete(fetched_key)
+    return stats
+
+
+@shared_task(**STAGE_OPTIONS)
+def plan_embedding_task(self, batch_stats: list, website_id: int):
+    """
+    Stage 4: deduplicate the site, then fan out embedding of every page
+    without vectors
+    
+    The work list comes from the DB rather than from this crawl, so pages
+    whose embedding failed in an earlier run are picked up again.
+    Near-duplicate pages are skipped, and the boilerplate found across the
+    site is stripped from the pages that are embedded.
+    """
+    stats = {
+        'pages_scraped': sum(batch['pages'] for batch in batch_stats),
+        'pages_new': sum(batch['new'] for batch in batch_stats),
+        'pages_reembedded': sum(batch['changed'] for batch in batch_stats),
+        'pages_unchanged': sum(batch['unchanged'] for batch in batch_stats),
+    }
+    if not stats['pages_scraped']:
+        logger.warning(f"No pages scraped for website {website_id}")
+        _mark_failed(website_id)
+        return {'status': 'error', 'message': 'No pages were scraped', 'website_id': website_id}
+    
+    dedup = _deduplicate(website_id)
+    stats['pages_duplicate'] = dedup['duplicates']
+    stats['pages_reembedded'] += dedup['stale']
+    
+    page_ids = list(
+        ScrapedPage.objects.filter(website_id=website_id, vector_id__isnull=True, duplicate_of__isnull=True)
+        .order_by('id').values_list('id', flat=True)
+    )
+    IngestProgress(website_id).set_stage(STAGE_EMBEDDING, to_embed=len(page_ids))
+    finalize = finalize_ingest_task.s(website_id, stats).on_error(ingest_failed_task.s(website_id))
+    if not page_ids:
+        finalize.delay([])
+        return {'pages_to_embed': 0}
+    
+    batches = _batches(page_ids, settings.SCRAPER_EMBED_BATCH_SIZE)
+    chord(group(
+        chain(embed_pages_task.s(website_id, batch), index_pages_task.s(website_id))
+        for batch in batches
+    ))(finalize)
+    
+    logger.info(f"Embedding {len(page_ids)} pages of website {website_id} in {len(batches)} batches")
+    return {'pages_to_embed': len(page_ids), 'embed_batches': len(batches)}
+
+
+@shared_task(ignore_result=True, **STAGE_OPTIONS)
+def embed_pages_task(self, website_id: int, page_ids: list):
+    """
+    Stage 5: encode the chunks of a batch of pages, without the site's
+    boilerplate (Website.boilerplate)
+    
+    Returns: cache key of the hashes of the embedded texts and the float32
+    vectors (in chunk order) for index_pages_task, which re-derives the
+    same chunks
+    """
+    pages = list(ScrapedPage.objects.filter(id__in=page_ids, website_id=website_id).order_by('id'))
+    qdrant = QdrantService()
+    documents = _documents(pages, _site_boilerplate(website_id))
+    chunks, _ = qdrant.chunk_documents(documents)
+    embeddings = qdrant.embed_chunks(chunks) if chunks else np.empty((0, qdrant.vector_size), np.float32)
+    return _put_payload(self.request.id, {
+        'pages': {str(document['page_id']): content_hash(document['content']) for document in documents},
+        'chunk_count': len(chunks),
+        'vectors': np.ascontiguousarray(embeddings, dtype=np.float32).tobytes(),
+    })
+
+
+@shared_task(**STAGE_OPTIONS)
+def index_pages_task(self, embedded_key: str, website_id: int):
+    """
+    Stage 6: replace the pages' points in the vector store, update the BM25
+    index and mark the pages as embedded
+    
+    Point IDs are stable and a page's old points are deleted first, so a
+    retry rewrites the same state. Pages whose text (or the site's
+    boilerplate) changed since they were embedded are left for the next run.
+    """
+    embedded = _get_payload(embedded_key)
+    page_ids = sorted(int(page_id) for page_id in embedded['pages'])
+    pages = list(ScrapedPage.objects.filter(id__in=page_ids, website_id=website_id).order_by('id'))
+    documents = _documents(pages, _site_boilerplate(website_id))
+    index_hashes = {document['page_id']: content_hash(document['content']) for document in documents}
+    if [page.id for page in pages] != page_ids or any(
+        index_hashes[page.id] != embedded['pages'][str(page.id)] for page in pages
+    ):
+        logger.warning(f"Pages changed since they were embedded, skipping batch of {len(page_ids)}")
+        cache.delete(embedded_key)
+        return {'pages_indexed': 0}
+    
+    qdrant = QdrantService()
+    chunks, vector_ids = qdrant.chunk_documents(documents)
+    if len(chunks) != embedded['chunk_count']:
+        logger.warning(f"Chunking changed since embedding, skipping batch of {len(page_ids)}")
+        cache.delete(embedded_key)
+        return {'pages_indexed': 0}
+    
+    qdrant.delete_by_page_ids(page_ids, website_id=website_id)
+    if chunks:
+        embeddings = np.frombuffer(embedded['vectors'], dtype=np.float32).reshape(len(chunks), -1)
+        qdrant.upload_chunks(chunks, embeddings)
+    
+    # Keep the BM25 index of the hybrid retriever in step
+    with LexicalIndex.update(website_id) as lexical_index:
+        lexical_index.add_documents(documents)
+    
+    # Update scraped pages with their vector_id
+    for page in pages:
+        page.vector_id = vector_ids.get(page.id)
+        page.index_hash = index_hashes[page.id]
+    ScrapedPage.objects.bulk_update(pages, ['vector_id', 'index_hash'], batch_size=settings.SCRAPER_DB_BATCH_SIZE)
+    IngestProgress(website_id).increment(embedded=len(pages))
+    cache.delete(embedded_key)
+    
+    logger.info(f"Stored {len(pages)} pages ({len(chunks)} chunks)")
+    return {'pages_indexed': len(pages)}
+
+
+@shared_task(bind=True)
+def finalize_ingest_task(self, index_results: list, website_id: int, stats: dict):
+    """Stage 7: invalidate cached answers and mark the website complete"""
+    # Cached answers may quote content that just changed
+    if any(result['pages_indexed'] for result in index_results):
+        AnswerCache.invalidate(website_id)
+    
+    website = Website.objects.get(id=website_id)
+    website.status = 'c'  # STATUS_COMPLETE
+    website.total_pages = stats['pages_scraped']
+    website.updated_at = timezone.now()
+    website.save()
+    IngestProgress(website_id).set_stage(STAGE_COMPLETE)
+    
+    logger.info(
+        f"Crawl diff for {website.url}: {stats['pages_new']} new, "
+        f"{stats['pages_reembedded']} re-embedded, {stats['pages_unchanged']} unchanged, "
+        f"{stats['pages_duplicate']} near-duplicates"
+    )
+    return dict({'status': 'success'}, **stats, website_id=website_id)
+
+
+@shared_task
+def ingest_failed_task(request, exc, traceback, website_id: int):
+    """Errback of the pipeline's chords: a stage gave up after its retries"""
+    logger.error(f"Ingest of website {website_id} failed in task {request.id}: {exc}")
+    _mark_failed(website_id)
@@ -1,3 +1,191 @@
-from django.test import TestCase
+from django.test import SimpleTestCase, TestCase, override_settings
+from unittest import mock
+from api.models import ScrapedPage, Website
+from scraper import crawler
+from scraper.crawler import AsyncCrawler
+from scraper.dedup import SiteDeduplicator, strip_boilerplate, unpack_hashes
+from scraper.extractors import LxmlExtractor, SoupExtractor
+from scraper.management.commands.benchmark_extractors import FIXTURES_DIR
+from scraper.scraper_service import content_hash
+from scraper.tasks import _deduplicate
+import random
 
-# Create your tests here.
+
+@override_settings(SCRAPER_PER_HOST_RATE=1.0, SCRAPER_PER_HOST_BURST=2, SCRAPER_HOST_LIMIT_REDIS_ENABLED=False)
+class HostRateLimitTests(SimpleTestCase):
+    """Parallel fetch batches (one crawler each) share a host's budget"""
+
+    def setUp(self):
+        super().setUp()
+        patcher = mock.patch.dict(crawler._host_buckets, clear=True)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_two_crawlers_on_the_same_host_share_the_budget(self):
+        first, second = AsyncCrawler(), AsyncCrawler()
+
+        self.assertEqual(first._bucket_for('https://example.com/a').take(), 0)
+        self.assertEqual(second._bucket_for('https://example.com/b').take(), 0)
+        # The burst of 2 is used up by both crawlers together
+        self.assertGreater(first._bucket_for('https://example.com/c').take(), 0)
+        self.assertGreater(second._bucket_for('https://example.com/d').take(), 0)
+
+    def test_hosts_have_separate_budgets(self):
+        first, second = AsyncCrawler(), AsyncCrawler()
+        for _ in range(2):
+            first._bucket_for('https://example.com/').take()
+
+        self.assertEqual(second._bucket_for('https://example.org/').take(), 0)
+
+    def test_budget_is_keyed_by_host_in_redis(self):
+        bucket = AsyncCrawler()._bucket_for('https://example.com:8080/page')
+
+        self.assertEqual(bucket.key, 'scraper:host_bucket:example.com:8080')
+        self.assertEqual(bucket.rate, 1.0)
+        self.assertEqual(bucket.capacity, 2)
+
+
+class ExtractorParityTests(SimpleTestCase):
+    """The lxml extractor matches the BeautifulSoup reference on the benchmark fixtures"""
+
+    def test_fixtures_extract_the_same_title_and_text(self):
+        fixtures = sorted(FIXTURES_DIR.glob('*.html'))
+        self.assertTrue(fixtures, f"No fixtures in {FIXTURES_DIR}")
+
+        reference, candidate = SoupExtractor(), LxmlExtractor()
+        for path in fixtures:
+            with self.subTest(fixture=path.name):
+                content = path.read_bytes()
+                url = path.as_uri()
+                self.assertEqual(candidate.extract(url, content), reference.extract(url, content))
+
+
+HEADER = "Acme Outdoor Store home tents kayaks sale about us contact cart sign in"
+FOOTER = "Copyright 2024 Acme Outdoor Store all rights reserved privacy policy terms of service"
+
+
+def _body(seed: int, words: int = 60) -> str:
+    """Text with a vocabulary of its own, so bodies of different seeds share no shingles"""
+    rng = random.Random(seed)
+    return ' '.join(f"s{seed}w{rng.randrange(1000)}" for _ in range(words))
+
+
+def _page(seed: int) -> str:
+    return f"{HEADER} {_body(seed)} {FOOTER}"
+
+
+@override_settings(
+    SCRAPER_SHINGLE_WORDS=5, SCRAPER_BOILERPLATE_MIN_PAGES=3,
+    SCRAPER_BOILERPLATE_MIN_RATIO=0.3, SCRAPER_NEAR_DUPLICATE_SIMILARITY=0.8,
+)
+class SiteDeduplicatorTests(SimpleTestCase):
+    def test_near_duplicates_collapse_to_the_shortest_url(self):
+        near_duplicate = _page(1).replace(FOOTER, f"Page 2 {FOOTER}")
+        pages = [
+            (1, 'https://example.com/tents?page=1&sort=name', _page(1)),
+            (2, 'https://example.com/tents', near_duplicate),
+        ]
+        pages += [(seed, f'https://example.com/{seed}', _page(seed)) for seed in range(3, 6)]
+        analysis = SiteDeduplicator().analyze(pages)
+
+        self.assertEqual(analysis['duplicate_of'], {1: 2})
+
+    def test_equal_urls_keep_the_oldest_page(self):
+        pages = [(seed, f'https://example.com/{seed}', _page(seed)) for seed in range(3, 6)]
+        pages += [(2, 'https://example.com/b', _page(1)), (1, 'https://example.com/a', _page(1))]
+
+        self.assertEqual(SiteDeduplicator().analyze(pages)['duplicate_of'], {2: 1})
+
+    def test_distinct_pages_are_not_merged(self):
+        analysis = SiteDeduplicator().analyze(
+            (seed, f'https://example.com/{seed}', _page(seed)) for seed in range(5)
+        )
+
+        # They share the header and footer, which is boilerplate, not similarity
+        self.assertTrue(analysis['boilerplate'])
+        self.assertEqual(analysis['duplicate_of'], {})
+
+    def test_strip_boilerplate_removes_the_shared_header_and_footer(self):
+        analysis = SiteDeduplicator().analyze(
+            (seed, f'https://example.com/{seed}', _page(seed)) for seed in range(5)
+        )
+
+        for seed in range(5):
+            self.assertEqual(strip_boilerplate(_page(seed), analysis['boilerplate']), _body(seed))
+
+    def test_text_made_only_of_boilerplate_is_kept(self):
+        analysis = SiteDeduplicator().analyze(
+            (seed, f'https://example.com/{seed}', _page(seed)) for seed in range(5)
+        )
+        text = f"{HEADER} {FOOTER}"
+
+        self.assertEqual(strip_boilerplate(text, analysis['boilerplate']), text)
+
+
+@override_settings(
+    SCRAPER_DEDUP_ENABLED=True, SCRAPER_SHINGLE_WORDS=5, SCRAPER_BOILERPLATE_MIN_PAGES=3,
+    SCRAPER_BOILERPLATE_MIN_RATIO=0.3, SCRAPER_NEAR_DUPLICATE_SIMILARITY=0.8,
+)
+class DeduplicateTaskTests(TestCase):
+    """Pages indexed with other boilerplate are queued for embedding again"""
+
+    def setUp(self):
+        super().setUp()
+        self.website = Website.objects.create(url='https://example.com/')
+        self.pages = []
+
+    def _add_pages(self, seeds, indexed: bool):
+        # Indexed pages were embedded as they are, before any boilerplate was known
+        for seed in seeds:
+            self.pages.append(ScrapedPage.objects.create(
+                website=self.website, url=f'https://example.com/{seed}', content=_page(seed),
+                vector_id=f'vector-{seed}' if indexed else None,
+                index_hash=content_hash(_page(seed)) if indexed else None,
+            ))
+
+    def _boilerplate(self):
+        self.website.refresh_from_db()
+        return unpack_hashes(self.website.boilerplate)
+
+    def _mark_indexed(self):
+        # What the embedding stage stores
+        boilerplate = self._boilerplate()
+        for page in self.pages:
+            ScrapedPage.objects.filter(id=page.id).update(
+                vector_id=f'vector-{page.id}', index_hash=content_hash(strip_boilerplate(page.content, boilerplate))
+            )
+
+    def _indexed_ids(self) -> set:
+        return set(
+            ScrapedPage.objects.filter(website=self.website, vector_id__isnull=False).values_list('id', flat=True)
+        )
+
+    def test_boilerplate_found_later_requeues_the_indexed_pages(self):
+        self._add_pages(range(2), indexed=True)
+        # Two pages are too few to tell boilerplate
+        self.assertEqual(_deduplicate(self.website.id), {'duplicates': 0, 'stale': 0})
+        self.assertEqual(len(self._boilerplate()), 0)
+
+        self._add_pages(range(2, 4), indexed=False)
+
+        self.assertEqual(_deduplicate(self.website.id), {'duplicates': 0, 'stale': 2})
+        self.assertTrue(len(self._boilerplate()))
+        self.assertEqual(self._indexed_ids(), set())
+
+    def test_unchanged_boilerplate_keeps_the_vectors(self):
+        self._add_pages(range(4), indexed=False)
+        _deduplicate(self.website.id)
+        self._mark_indexed()
+
+        self.assertEqual(_deduplicate(self.website.id), {'duplicates': 0, 'stale': 0})
+        self.assertEqual(self._indexed_ids(), {page.id for page in self.pages})
+
+    def test_dropped_boilerplate_requeues_the_pages(self):
+        self._add_pages(range(4), indexed=False)
+        _deduplicate(self.website.id)
+        self._mark_indexed()
+
+        with self.settings(SCRAPER_DEDUP_ENABLED=False):
+            self.assertEqual(_deduplicate(self.website.id)['stale'], 4)
+        self.assertEqual(len(self._boilerplate()), 0)
+        self.assertEqual(self._indexed_ids(), set())